@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the columnize template filter.
+
+Usage: python benchmarks/bench_columnize.py [--number N]
+"""
+import sys
+import timeit
+from os.path import dirname, abspath
+from optparse import OptionParser
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from django_conference.templatetags.columnize import columnize_helper
+
+
+def typical_input():
+    """A registration confirmation e-mail"""
+    return [
+        u"Registration Type: HSS Member",
+        u"Guest Name(s): Foo Bar",
+        u"Abstracts: 1 @ $10.00/each",
+        u"Graduate Student Travel Fund: $25.00",
+        u"Total: $135.00",
+        u"",
+        u"Sessions: \"History of Science in the Early Modern...\"",
+    ]
+
+
+def worst_case_input():
+    """
+    A session submission e-mail with 10 papers, long labels and abstracts,
+    which is what made the old implementation quadratic.
+    """
+    abstract = u" ".join([u"word"] * 250)
+    lines = [
+        u"Session Title: " + u"A very long session title " * 5,
+        u"Session Abstract: " + abstract,
+    ]
+    for i in range(10):
+        lines.extend([
+            u"Paper %d Title: %s" % (i, u"A long paper title " * 5),
+            u"Paper %d Presenter Name and Institutional Affiliation: Foo Bar, "
+                u"University of Somewhere" % i,
+            u"Paper %d Abstract: %s" % (i, abstract),
+            u"",
+        ])
+    # a block of long unlabeled text, as found in free-form notes
+    lines.extend([u"notes " * 20] * 200)
+    return lines
+
+
+def run(number):
+    for name, lines in [("typical", typical_input()),
+                        ("worst case", worst_case_input())]:
+        total = timeit.timeit(lambda: columnize_helper(lines, 30),
+            number=number)
+        print "%-12s %5d lines: %8.1f usec/call" % (name, len(lines),
+            total / number * 1e6)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('--number', default=1000, type='int', dest='number')
+    (options, args) = parser.parse_args()
+    run(options.number)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the money_format template filter, comparing the per-cell
+cost against the original digit-reversing implementation.
+
+Usage: python benchmarks/bench_money_format.py [--number N]
+"""
+import sys
+import timeit
+from decimal import Decimal
+from os.path import dirname, abspath
+from optparse import OptionParser
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from django_conference.templatetags.money_format import money_format
+
+
+def reference_money_format(value):
+    """
+    The original implementation, adapted from
+    https://docs.python.org/2/library/decimal.html#recipes
+    """
+    q = Decimal(10) ** -2
+    _, digits, exp = Decimal(str(value)).quantize(q).as_tuple()
+    result = []
+    digits = map(str, digits)
+    build, next = result.append, digits.pop
+    for i in range(2):
+        build(next() if digits else '0')
+    build('.')
+    if not digits:
+        build('0')
+    i = 0
+    while digits:
+        build(next())
+        i += 1
+        if i == 3 and digits:
+            i = 0
+            build(',')
+    build('$')
+    return ''.join(reversed(result))
+
+
+COLUMNS = {
+    "Decimal": [Decimal("%d.%02d" % (i * 37, i % 100)) for i in range(1000)],
+    "int": [i * 37 for i in range(1000)],
+    "float": [i * 37.25 for i in range(1000)],
+}
+
+
+def run(number):
+    print "%-8s %14s %14s" % ("type", "before (usec)", "after (usec)")
+    for name, column in sorted(COLUMNS.items()):
+        assert map(unicode, map(reference_money_format, column)) == \
+            map(money_format, column)
+        timings = [
+            timeit.timeit(lambda: map(func, column), number=number)
+            for func in [reference_money_format, money_format]
+        ]
+        per_cell = [t / number / len(column) * 1e6 for t in timings]
+        print "%-8s %14.2f %14.2f" % tuple([name] + per_cell)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('--number', default=100, type='int', dest='number')
+    (options, args) = parser.parse_args()
+    run(options.number)
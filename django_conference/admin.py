@@ -1,16 +1,33 @@
+from datetime import datetime
+from decimal import Decimal
+import operator
+
 from django.core.urlresolvers import reverse
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.utils import lookup_needs_distinct
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
 from django.conf import settings
+from django.db.models import (Case, Count, IntegerField, Max, Q, Value,
+    When)
+from django.template.response import TemplateResponse
+from django.utils.text import smart_split, unescape_string_literal
 from django import forms
 
-from django_conference.models import (DonationType, ExtraType, Meeting,
-    MeetingDonation, MeetingExtra, MeetingInstitution, Paper, PaperPresenter,
-    Registration, RegistrationDonation, RegistrationExtra, RegistrationGuest,
-    RegistrationOption, Session, SessionCadre, SessionPapers,
-    PaperPresenterRegion, PaperPresenterTimePeriod, PaperPresenterSubject)
+from django_conference.models import (Announcement, DonationType, ExtraType,
+    Meeting, MeetingDonation, MeetingExtra, MeetingInstitution, OutgoingEmail,
+    Paper, PaperPresenter, Registration, RegistrationDonation,
+    RegistrationExtra, RegistrationGuest, RegistrationOption,
+    RegistrationPayment, RegistrationPaymentChange, Session, SessionCadre,
+    SessionPapers, PaperPresenterRegion, PaperPresenterTimePeriod,
+    PaperPresenterSubject, PaperSearchTerm, SessionSearchTerm)
 
 from dal import autocomplete
 
+from django_conference import search
+from django_conference.pagination import (EstimatedCountChangeList,
+    EstimatedCountPaginator)
+
 
 admin.site.register(DonationType)
 admin.site.register(ExtraType)
@@ -49,6 +66,54 @@ class RegistrationOptionInline(admin.TabularInline):
         will only be available when entering registrations through the admin
         interface.
     """
+class CloneMeetingForm(forms.Form):
+    """
+    Options for cloning meetings with the MeetingAdmin "clone" action.
+    """
+    days = forms.IntegerField(label="Days to move dates forward",
+        initial=364, help_text="364 days (52 weeks) keeps the meetings on "+\
+        "the same days of the week.")
+    price_percent = forms.DecimalField(label="Price change (%)",
+        initial=0, max_digits=5, decimal_places=2, min_value=-100,
+        help_text="Percentage to raise (or lower, if negative) the prices "+\
+        "of registration options and extras by.")
+    location = forms.CharField(max_length=45, required=False,
+        help_text="Leave blank to keep the same location.")
+
+    def __init__(self, *args, **kwargs):
+        self.meetings = kwargs.pop('meetings')
+        super(CloneMeetingForm, self).__init__(*args, **kwargs)
+
+    def clean_price_percent(self):
+        """
+        Checks that the changed prices of the selected meetings still fit in
+        their fields, since the INSERTs would fail (or be truncated on some
+        databases) otherwise.
+        """
+        price_percent = self.cleaned_data['price_percent']
+        factor = 1 + price_percent / 100
+        for model, field_names in [
+            (RegistrationOption, ('early_price', 'regular_price',
+                                  'onsite_price')),
+            (MeetingExtra, ('price',)),
+        ]:
+            highest = model.objects.filter(meeting__in=self.meetings) \
+                .aggregate(*[Max(name) for name in field_names])
+            for name in field_names:
+                field = model._meta.get_field(name)
+                digits = field.max_digits - field.decimal_places
+                limit = Decimal(10) ** digits
+                price = highest['%s__max' % name]
+                if price is not None and \
+                        (price * factor).quantize(Decimal('0.01')) >= limit:
+                    raise forms.ValidationError(
+                        "This would raise the %s of %s to %.2f, but it "
+                        "must be less than %d." % (field.verbose_name,
+                        model._meta.verbose_name_plural, price * factor,
+                        limit))
+        return price_percent
+
+
 class MeetingAdmin(admin.ModelAdmin):
     change_form_template = "django_conference/meeting_change_form.html"
     fieldsets = (
@@ -68,15 +133,41 @@ class MeetingAdmin(admin.ModelAdmin):
     )
     inlines = [MeetingDonationInline, MeetingExtraInline,
         MeetingInstitutionInline, RegistrationOptionInline]
-    actions = '<a href="%s">Admin Tasks</a>'
+    admin_tasks_link = '<a href="%s">Admin Tasks</a>'
     list_display = ('__unicode__', 'admin_actions')
+    actions = ['clone_meetings']
 
     def admin_actions(self, obj):
         view_name = 'django_conference_choose_admin_task'
-        return self.actions % reverse(view_name, kwargs={'meeting_id': obj.pk})
+        return self.admin_tasks_link % reverse(view_name,
+            kwargs={'meeting_id': obj.pk})
     admin_actions.short_description = "Administrative Actions"
     admin_actions.allow_tags = True
 
+    def clone_meetings(self, request, queryset):
+        """
+        Shows a form for the date shift and price change to use, then clones
+        each selected meeting with Meeting.clone().
+        """
+        form = CloneMeetingForm(request.POST if 'apply' in request.POST
+                                else None, meetings=queryset)
+        if form.is_valid():
+            for meeting in queryset:
+                meeting.clone(**form.cleaned_data)
+            self.message_user(request,
+                "Cloned %d meeting(s). The copies are inactive." %
+                len(queryset))
+            return None
+        return TemplateResponse(request,
+            "django_conference/clone_meetings.html", {
+                'title': "Clone meetings",
+                'form': form,
+                'queryset': queryset,
+                'opts': self.model._meta,
+                'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            })
+    clone_meetings.short_description = "Clone selected meetings"
+
     class Media:
         js = [settings.STATIC_URL+"django_conference/js/jquery-1.3.2.min.js",
               settings.STATIC_URL+"django_conference/js/dynamic_inlines.js"]
@@ -119,6 +210,71 @@ class LimitChoicesForFieldsToCurrentMeetingMixin(object):
         return formset
 
 
+class FullTextSearchMixin(object):
+    """
+    Mixin for ModelAdmins that searches the fields indexed by the SearchTerm
+    subclass in "search_term_model" (usually large text fields like
+    abstracts) through the full-text index in django_conference.search
+    instead of with LIKE '%term%' queries. The rest of the fields in
+    search_fields are searched as usual. Words made up of stop words, which
+    aren't indexed, are searched for in every field in search_fields.
+
+    Unless the user has picked a column to sort by, the best matches are
+    moved to the top of the results.
+    """
+    search_term_model = None
+
+    def get_search_results(self, request, queryset, search_term):
+        term_model = self.search_term_model
+        other_fields = [f for f in self.search_fields
+                        if f not in term_model.source_fields]
+        use_distinct = any(lookup_needs_distinct(self.opts, f)
+                           for f in other_fields)
+        all_terms = []
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")):
+                bit = unescape_string_literal(bit)
+            terms = search.get_query_terms(bit)
+            if terms:
+                all_terms.extend(terms)
+                conditions = [search.get_terms_q(term_model, terms)]
+                fields = other_fields
+            else:
+                # only stop words, which aren't indexed
+                conditions = []
+                fields = self.search_fields
+            conditions.extend(Q(**{field + '__icontains': bit})
+                              for field in fields)
+            if conditions:
+                queryset = queryset.filter(reduce(operator.or_, conditions))
+
+        if all_terms and ORDER_VAR not in request.GET:
+            ranked_ids = search.rank_by_terms(term_model, queryset,
+                all_terms, self.list_per_page)
+            if ranked_ids:
+                rank = Case(*[When(pk=pk, then=Value(i))
+                              for i, pk in enumerate(ranked_ids)],
+                    default=Value(len(ranked_ids)),
+                    output_field=IntegerField())
+                queryset = queryset.order_by(rank, *queryset.query.order_by)
+        return queryset, use_distinct
+
+
+class EstimatedCountMixin(object):
+    """
+    Mixin for ModelAdmins of tables that grow large over the years. The
+    changelist shows the database's estimate of the number of rows instead of
+    counting them when there are enough of them, caches exact counts
+    briefly, and builds the date hierarchy from a single cached query.
+    See django_conference.pagination.
+    """
+    paginator = EstimatedCountPaginator
+    change_list_template = "django_conference/estimated_count_change_list.html"
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+
 class RegistrationExtraInline(
     LimitChoicesForFieldsToCurrentMeetingMixin, admin.TabularInline):
     model = RegistrationExtra
@@ -138,6 +294,23 @@ class RegistrationDonationInline(
 class RegistrationGuestInline(admin.TabularInline):
     model = RegistrationGuest
     extra = 1
+class RegistrationPaymentChangeInline(admin.TabularInline):
+    """Read-only history of the bulk payment actions for a registration"""
+    model = RegistrationPaymentChange
+    fields = readonly_fields = ('date_changed', 'changed_by',
+        'old_payment_type', 'payment_type', 'old_payment_received',
+        'payment_received')
+    extra = 0
+    max_num = 0
+    can_delete = False
+class RegistrationPaymentInline(admin.TabularInline):
+    """Read-only list of the card payments made for a registration"""
+    model = RegistrationPayment
+    fields = readonly_fields = ('date_created', 'amount', 'status',
+        'charge_id', 'date_captured', 'last_error')
+    extra = 0
+    max_num = 0
+    can_delete = False
 class RegistrationForm(forms.ModelForm):
     class Meta:
         model = Paper
@@ -145,25 +318,28 @@ class RegistrationForm(forms.ModelForm):
         widgets = {
             'registrant': autocomplete.ModelSelect2(url='user-autocomplete'),
         }
-class RegistrationAdmin(
+class RegistrationAdmin(EstimatedCountMixin,
     LimitChoicesForFieldsToCurrentMeetingMixin, admin.ModelAdmin):
     form = RegistrationForm
     date_hierarchy = "date_entered"
     fieldsets = (
         ("General Information", {
             'fields': ('registrant', 'type', 'entered_by', 'meeting',
-                       'payment_type'),
+                       'payment_type', 'payment_received'),
         }),
         ("Special Information", {
             'fields': ('special_needs', 'sessions'),
         }),
     )
     list_display = ('registrant', 'meeting', 'type', 'date_entered',
-        'has_special_needs')
+        'payment_type', 'payment_received', 'has_special_needs')
+    list_filter = ('payment_type',)
     search_fields = ('registrant__first_name', 'registrant__last_name',
         'type__option_name', 'special_needs')
     inlines = [RegistrationExtraInline, RegistrationDonationInline,
-        RegistrationGuestInline]
+        RegistrationGuestInline, RegistrationPaymentInline,
+        RegistrationPaymentChangeInline]
+    actions = ['record_payment', 'clear_payment', 'send_register_emails']
     filter_horizontal = ['sessions']
     limit_to_curr_meeting = [
         { 'field_name': 'type', 'relationship_attribute': 'regoptions' },
@@ -173,10 +349,92 @@ class RegistrationAdmin(
             'filter': { 'accepted': True },
         },
     ]
+
+    def get_queryset(self, request):
+        return super(RegistrationAdmin, self).get_queryset(request) \
+            .select_related('registrant', 'meeting', 'type')
+
+    def get_actions(self, request):
+        actions = super(RegistrationAdmin, self).get_actions(request)
+        if not actions:
+            return actions
+        # one action for each payment type
+        for payment_type, label in Registration.PAYMENT_TYPES:
+            name = 'set_payment_type_%s' % payment_type
+            actions[name] = (self.make_payment_type_action(payment_type),
+                name, "Change payment type of selected registrations to %s"
+                % label.lower())
+        return actions
+
+    def make_payment_type_action(self, payment_type):
+        def set_payment_type(modeladmin, request, queryset):
+            num_updated = queryset.set_payment_type(payment_type,
+                request.user)
+            self.message_user(request,
+                "Changed the payment type of %d registration(s)." %
+                num_updated)
+        return set_payment_type
+
+    def record_payment(self, request, queryset):
+        num_updated = queryset.record_payment(request.user)
+        self.message_user(request,
+            "Recorded payment for %d registration(s)." % num_updated)
+    record_payment.short_description = \
+        "Mark selected registrations as paid"
+
+    def clear_payment(self, request, queryset):
+        num_updated = queryset.clear_payment(request.user)
+        self.message_user(request,
+            "Cleared payment for %d registration(s)." % num_updated)
+    clear_payment.short_description = \
+        "Mark selected registrations as not paid"
+
+    def send_register_emails(self, request, queryset):
+        num_sent = queryset.send_register_emails()
+        self.message_user(request,
+            "Sent %d confirmation e-mail(s)." % num_sent)
+    send_register_emails.short_description = \
+        "Resend confirmation e-mails for selected registrations"
 admin.site.register(Registration, RegistrationAdmin)
 
 
-class SessionCadreAdmin(admin.ModelAdmin):
+class NeedsAttentionFilter(admin.SimpleListFilter):
+    """
+    Lists the card payments whose authorization was interrupted (see
+    DJANGO_CONFERENCE_PAYMENT_PENDING_TIMEOUT)
+    """
+    title = "needs attention"
+    parameter_name = 'attention'
+
+    def lookups(self, request, model_admin):
+        return [('stale', "Interrupted while authorizing")]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'stale':
+            return queryset.stale_pending()
+        return queryset
+
+
+class RegistrationPaymentAdmin(admin.ModelAdmin):
+    """
+    Card payments. A payment that was interrupted while the card was being
+    authorized can be fixed by looking it up at the payment gateway and
+    entering its charge ID and status here. process_payments then captures
+    it if it's authorized.
+    """
+    list_display = ('registration', 'amount', 'status', 'charge_id',
+        'date_created', 'date_captured')
+    list_filter = ('status', NeedsAttentionFilter)
+    list_select_related = ('registration__registrant',)
+    search_fields = ('charge_id', 'idempotency_key')
+    raw_id_fields = ('registration',)
+    readonly_fields = ('idempotency_key', 'date_created', 'date_captured',
+        'attempts', 'last_error')
+    date_hierarchy = 'date_created'
+admin.site.register(RegistrationPayment, RegistrationPaymentAdmin)
+
+
+class SessionCadreAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'gender', 'institution', 'email')
     search_fields = ['last_name', 'first_name', 'institution', 'email']
     ordering = ['last_name', 'first_name']
@@ -205,8 +463,9 @@ class PaperForm(forms.ModelForm):
                 url='paper-presenter-autocomplete'),
             'submitter': autocomplete.ModelSelect2(url='user-autocomplete'),
         }
-class PaperAdmin(admin.ModelAdmin):
+class PaperAdmin(EstimatedCountMixin, FullTextSearchMixin, admin.ModelAdmin):
     form = PaperForm
+    search_term_model = PaperSearchTerm
     fieldsets = [
         (None, {'fields': ['title', 'abstract', 'submitter',
             'presenter', 'accepted']}),
@@ -225,6 +484,10 @@ class PaperAdmin(admin.ModelAdmin):
     date_hierarchy = 'creation_time'
     filter_horizontal = ['previous_meetings']
     ordering = ['title']
+
+    def get_queryset(self, request):
+        return super(PaperAdmin, self).get_queryset(request) \
+            .select_related('submitter', 'presenter')
 admin.site.register(Paper, PaperAdmin)
 
 
@@ -244,8 +507,37 @@ class SessionForm(forms.ModelForm):
         widgets = {
             'submitter': autocomplete.ModelSelect2(url='user-autocomplete'),
         }
-class SessionAdmin(admin.ModelAdmin):
+class SessionChangeList(ChangeList):
+    """
+    ChangeList that only joins the registrations of every session when
+    sorting by attendance, and otherwise counts them for the displayed page.
+    """
+    def get_queryset(self, request):
+        ordering = self.get_ordering(request, self.root_queryset)
+        self.attendance_annotated = 'attendance' in \
+            [str(field).lstrip('-') for field in ordering]
+        if self.attendance_annotated:
+            self.root_queryset = self.root_queryset.annotate(
+                attendance=Count('regsessions'))
+        return super(SessionChangeList, self).get_queryset(request)
+
+    def get_results(self, request):
+        super(SessionChangeList, self).get_results(request)
+        if self.attendance_annotated:
+            return
+        sessions = list(self.result_list)
+        through = Registration.sessions.through
+        counts = dict(through.objects
+            .filter(session__in=[session.pk for session in sessions])
+            .values_list('session').annotate(Count('registration')))
+        for session in sessions:
+            session.attendance = counts.get(session.pk, 0)
+        self.result_list = sessions
+
+
+class SessionAdmin(FullTextSearchMixin, admin.ModelAdmin):
     form = SessionForm
+    search_term_model = SessionSearchTerm
     fieldsets = [
         (None, {
             'fields': ['meeting', 'title', 'abstract', 'accepted'],
@@ -257,17 +549,91 @@ class SessionAdmin(admin.ModelAdmin):
             'fields': ['room_no', 'start_time', 'stop_time', 'notes']
         }),
     ]
-    search_fields = ('title', 'abstract', 'notes', 'chairs__first_name',
-        'chairs__last_name', 'chairs__institution',
-        'submitter__first_name', 'submitter__last_name')
+    # The chair and submitter names are in the full-text index, so they
+    # don't need to be listed here (which would join the M2M tables)
+    search_fields = ('title', 'abstract', 'notes')
     ordering = ['title']
     inlines = [SessionPapersInline]
     filter_horizontal = ['chairs', 'organizers', 'commentators']
     list_display = ('title', 'submitter', 'meeting', 'accepted',
-        'get_chair_string', 'start_time', 'stop_time', 'creation_time')
+        'get_chair_string', 'get_attendance', 'start_time', 'stop_time',
+        'creation_time')
     list_filter = ['meeting', 'accepted']
+    actions = ['accept_sessions', 'reject_sessions']
+
+    def get_queryset(self, request):
+        return super(SessionAdmin, self).get_queryset(request) \
+            .select_related('submitter', 'meeting') \
+            .prefetch_related('chairs')
+
+    def get_changelist(self, request, **kwargs):
+        return SessionChangeList
 
     def get_chair_string(self, obj):
         return ', '.join(chair.get_full_name() for chair in obj.chairs.all())
     get_chair_string.short_description = "Chairs"
+
+    def get_attendance(self, obj):
+        return obj.attendance
+    get_attendance.short_description = "Expected attendance"
+    get_attendance.admin_order_field = 'attendance'
+
+    def accept_sessions(self, request, queryset):
+        num_updated = queryset.set_accepted(True)
+        self.message_user(request,
+            "Accepted %d session(s) and their papers." % num_updated)
+    accept_sessions.short_description = \
+        "Accept selected sessions and their papers"
+
+    def reject_sessions(self, request, queryset):
+        num_updated = queryset.set_accepted(False)
+        self.message_user(request,
+            "Rejected %d session(s) and their papers." % num_updated)
+    reject_sessions.short_description = \
+        "Reject selected sessions and their papers"
 admin.site.register(Session, SessionAdmin)
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'date_created',
+        'date_sent')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('date_created', 'date_sent', 'attempts', 'last_error')
+    date_hierarchy = 'date_created'
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        num_updated = queryset.exclude(status=OutgoingEmail.SENT).update(
+            status=OutgoingEmail.PENDING, attempts=0,
+            next_attempt=datetime.now())
+        self.message_user(request,
+            "Queued %d e-mail(s) to be sent again." % num_updated)
+    retry.short_description = "Send selected e-mails again"
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
+
+
+class AnnouncementAdmin(admin.ModelAdmin):
+    """
+    Announcements are written here, then sent with the send_announcement
+    management command.
+    """
+    list_display = ('subject', 'meeting', 'date_created', 'get_progress',
+        'date_finished')
+    readonly_fields = ('date_started', 'date_finished')
+
+    def get_queryset(self, request):
+        return super(AnnouncementAdmin, self).get_queryset(request) \
+            .select_related('meeting') \
+            .annotate(num_recipients=Count('recipients'),
+                      num_sent=Count(Case(
+                          When(recipients__date_sent__isnull=False,
+                               then=Value(1)),
+                          output_field=IntegerField())))
+
+    def get_progress(self, obj):
+        if not obj.date_started:
+            return "Not started"
+        return "Sent %d of %d" % (obj.num_sent, obj.num_recipients)
+    get_progress.short_description = "Progress"
+admin.site.register(Announcement, AnnouncementAdmin)
@@ -7,6 +7,8 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib.admin.views.decorators import staff_member_required
 
 from django_conference.models import Meeting, Registration
+from django_conference.reconciliation import PaymentReconciler
+from django_conference.registration_import import RegistrationImporter
 
 
 class AdminTask(object):
@@ -44,7 +46,8 @@ def generic_task_view(request, meeting, template, formats=["html"],
 
     if not form or (request.POST and form.is_valid()):
         registrations = (meeting.registrations
-                            .select_related()
+                            .with_details()
+                            .select_related('entered_by')
                             .order_by('registrant__last_name')[:limit])
         rendered = render_to_string(template, {
            'meeting': meeting,
@@ -68,6 +71,60 @@ def generic_task_view(request, meeting, template, formats=["html"],
     }, context_instance=RequestContext(request))
 
 
+class ImportRegistrationsForm(forms.Form):
+    """
+    Allows uploading a CSV file of registrations to import.
+    """
+    FILE_HELP = "A CSV file with a header line naming the columns. The "+\
+                "\"email\" and \"option\" columns are required. See "+\
+                "django_conference.registration_import for the rest."
+    csv_file = forms.FileField(label="CSV file", help_text=FILE_HELP)
+
+
+def import_registrations(request, meeting):
+    """
+    Admin task for importing registrations for the meeting from a CSV file.
+    Shows the errors found in the file, if any.
+    """
+    form = ImportRegistrationsForm(request.POST or None, request.FILES or None)
+    importer = None
+    if request.method == 'POST' and form.is_valid():
+        importer = RegistrationImporter(meeting, request.user)
+        importer.run(form.cleaned_data['csv_file'])
+    return render_to_response("django_conference/import_registrations.html", {
+        'form': form,
+        'meeting': meeting,
+        'importer': importer,
+    }, context_instance=RequestContext(request))
+
+
+class ReconcilePaymentsForm(forms.Form):
+    """
+    Allows uploading a CSV export of charges from the payment provider.
+    """
+    FILE_HELP = "A CSV file with a header line naming the columns. The "+\
+                "\"id\", \"amount\" and \"description\" columns are "+\
+                "required. See django_conference.reconciliation for details."
+    csv_file = forms.FileField(label="CSV file", help_text=FILE_HELP)
+
+
+def reconcile_payments(request, meeting):
+    """
+    Admin task for reconciling the card payments for the meeting with a CSV
+    export of charges from the payment provider.
+    """
+    form = ReconcilePaymentsForm(request.POST or None, request.FILES or None)
+    reconciler = None
+    if request.method == 'POST' and form.is_valid():
+        reconciler = PaymentReconciler(meeting)
+        reconciler.run(form.cleaned_data['csv_file'])
+    return render_to_response("django_conference/reconcile_payments.html", {
+        'form': form,
+        'meeting': meeting,
+        'reconciler': reconciler,
+    }, context_instance=RequestContext(request))
+
+
 def get_task_list():
     from django_conference import settings
     return [
@@ -76,6 +133,8 @@ def get_task_list():
             "django_conference/stats.html", show_user_limit=False)),
         AdminTask("Meeting Spreadsheet", lambda r,m: generic_task_view(r, m,
             "django_conference/spreadsheet.html", ["xls"])),
+        AdminTask("Import Registrations", import_registrations),
+        AdminTask("Reconcile Payments", reconcile_payments),
     ] + [
         AdminTask(*args) for args in settings.DJANGO_CONFERENCE_ADMIN_TASKS
     ]
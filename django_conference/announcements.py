@@ -0,0 +1,197 @@
+"""
+Sending of announcements (see the Announcement model) to the registrants
+of a meeting and the people in its accepted sessions.
+"""
+from datetime import datetime, timedelta
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template import Context, Template
+
+from django_conference import settings
+from django_conference.models import (Announcement, AnnouncementRecipient,
+    PaperPresenter, SessionCadre)
+
+
+def get_recipients(announcement):
+    """
+    Returns a list of (email, first_name, last_name) tuples for the people
+    the announcement is for, with one query for each group of people. People
+    in more than one group, or with more than one role in a group, are only
+    included once.
+    """
+    meeting = announcement.meeting
+    accepted_sessions = meeting.sessions.filter(accepted=True)
+    querysets = []
+    if announcement.to_registrants:
+        querysets.append(meeting.registrations.values_list(
+            'registrant__email', 'registrant__first_name',
+            'registrant__last_name'))
+    if announcement.to_presenters:
+        querysets.append(PaperPresenter.objects.filter(
+            paper__sessions__in=accepted_sessions,
+        ).values_list('email', 'first_name', 'last_name'))
+    if announcement.to_session_cadre:
+        for relationship in ['sessions_chaired', 'sessions_organized',
+                             'sessions_commentated']:
+            querysets.append(SessionCadre.objects.filter(**{
+                relationship + '__in': accepted_sessions,
+            }).values_list('email', 'first_name', 'last_name'))
+
+    recipients = []
+    seen = set()
+    for queryset in querysets:
+        for email, first_name, last_name in queryset.distinct():
+            key = (email or u'').strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                recipients.append((email.strip(), first_name, last_name))
+    return recipients
+
+
+def create_recipients(announcement, batch_size=1000):
+    """
+    Saves the recipients of the announcement, so sending it can be resumed
+    where it left off. Does nothing if that has already been done. Returns
+    the number of recipients created.
+
+    The announcement is locked while this is checked and done, so runs of
+    send_announcement that overlap can't both create the recipients.
+    """
+    with transaction.atomic():
+        locked = Announcement.objects.select_for_update().get(
+            pk=announcement.pk)
+        announcement.date_started = locked.date_started
+        if locked.date_started:
+            return 0
+        recipients = [AnnouncementRecipient(announcement=locked,
+                          email=email, first_name=first_name or u'',
+                          last_name=last_name or u'')
+                      for email, first_name, last_name
+                      in get_recipients(locked)]
+        AnnouncementRecipient.objects.bulk_create(recipients, batch_size)
+        locked.date_started = announcement.date_started = datetime.now()
+        locked.save(update_fields=['date_started'])
+    return len(recipients)
+
+
+def claim_recipients(queryset, batch_size):
+    """
+    Claims and returns up to batch_size of the recipients in the given
+    queryset that no other run of send_announcement is sending to. The rows
+    are locked while they're claimed, so a run waiting for them skips the
+    ones this run claims.
+    """
+    now = datetime.now()
+    stale = now - timedelta(
+        seconds=settings.DJANGO_CONFERENCE_ANNOUNCEMENT_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        batch = list(queryset.filter(
+            Q(date_claimed__isnull=True) | Q(date_claimed__lt=stale),
+        ).select_for_update()[:batch_size])
+        AnnouncementRecipient.objects.filter(
+            pk__in=[recipient.pk for recipient in batch],
+        ).update(date_claimed=now)
+    return batch
+
+
+class Throttle(object):
+    """Limits how often wait() returns to max_per_second times a second"""
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second else 0
+        self.next_time = 0
+
+    def wait(self):
+        now = time.time()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+            now = self.next_time
+        self.next_time = now + self.interval
+
+
+def send_announcement(announcement, batch_size=None, max_per_second=None,
+                      connection=None):
+    """
+    Sends the announcement to each of its recipients that it hasn't been
+    sent to yet, over one connection to the mail server, which is reopened
+    if sending fails. The body template is only compiled once.
+
+    The recipients are loaded in batches, and the ones the announcement was
+    sent to are recorded after each batch, so this can be run again to
+    resume sending after a crash, and to retry the recipients it couldn't
+    be sent to. Returns a tuple of the number of e-mails sent and the
+    number that failed.
+
+    Each batch is claimed before it's sent, so runs that overlap send to
+    different recipients. A batch claimed by a run that crashed is sent
+    again once DJANGO_CONFERENCE_ANNOUNCEMENT_CLAIM_TIMEOUT has passed.
+    """
+    batch_size = batch_size or \
+        settings.DJANGO_CONFERENCE_ANNOUNCEMENT_BATCH_SIZE
+    if max_per_second is None:
+        max_per_second = \
+            settings.DJANGO_CONFERENCE_ANNOUNCEMENT_MAX_PER_SECOND
+    create_recipients(announcement)
+    template = Template(announcement.body)
+    sender = settings.DJANGO_CONFERENCE_CONTACT_EMAIL
+    throttle = Throttle(max_per_second)
+    connection = connection or get_connection()
+    unsent = announcement.recipients.filter(date_sent__isnull=True) \
+        .order_by('pk')
+
+    num_sent = num_failed = 0
+    last_pk = 0
+    try:
+        while True:
+            batch = claim_recipients(unsent.filter(pk__gt=last_pk),
+                batch_size)
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            sent = []
+            failed = []
+            for recipient in batch:
+                body = template.render(Context({
+                    'first_name': recipient.first_name,
+                    'last_name': recipient.last_name,
+                    'email': recipient.email,
+                    'meeting': announcement.meeting,
+                }, autoescape=False))
+                message = EmailMessage(subject=announcement.subject,
+                    body=body, from_email=sender, to=[recipient.email],
+                    connection=connection)
+                throttle.wait()
+                try:
+                    # this does nothing if the connection is already open
+                    connection.open()
+                    connection.send_messages([message])
+                except Exception as err:
+                    failed.append((recipient, err))
+                    # start over with a fresh connection
+                    connection.close()
+                else:
+                    sent.append(recipient)
+
+            # record the progress
+            with transaction.atomic():
+                AnnouncementRecipient.objects.filter(
+                    pk__in=[recipient.pk for recipient in sent],
+                ).update(date_sent=datetime.now(), last_error=u'')
+                for recipient, err in failed:
+                    recipient.last_error = u'%s: %s' % (type(err).__name__,
+                                                        err)
+                    # so the next run tries them again
+                    recipient.date_claimed = None
+                    recipient.save(update_fields=['last_error',
+                                                  'date_claimed'])
+            num_sent += len(sent)
+            num_failed += len(failed)
+    finally:
+        connection.close()
+
+    if not num_failed and not unsent.exists():
+        announcement.date_finished = datetime.now()
+        announcement.save(update_fields=['date_finished'])
+    return num_sent, num_failed
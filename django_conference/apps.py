@@ -0,0 +1,45 @@
+from django.apps import AppConfig, apps
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+    pre_delete)
+
+
+class DjangoConferenceConfig(AppConfig):
+    name = 'django_conference'
+    verbose_name = 'Conference'
+
+    def ready(self):
+        from django_conference import autocomplete, search, settings
+        user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
+        post_save.connect(search.update_user_search_tokens_on_save,
+            sender=user_model,
+            dispatch_uid='django_conference_user_search_tokens')
+        for model in search.TRIGRAM_MODELS:
+            post_save.connect(search.update_trigrams_on_save, sender=model,
+                dispatch_uid='django_conference_trigrams')
+        for model in search.TERM_MODELS:
+            post_save.connect(search.update_terms_on_save, sender=model,
+                dispatch_uid='django_conference_search_terms')
+        session_model = apps.get_model('django_conference.Session')
+        cadre_model = apps.get_model('django_conference.SessionCadre')
+        m2m_changed.connect(search.update_session_terms_on_chairs_changed,
+            sender=session_model.chairs.through,
+            dispatch_uid='django_conference_session_chair_terms')
+        post_save.connect(search.update_session_terms_on_chair_save,
+            sender=cadre_model,
+            dispatch_uid='django_conference_session_chair_terms')
+        pre_delete.connect(search.update_session_terms_on_chair_delete,
+            sender=cadre_model,
+            dispatch_uid='django_conference_session_chair_terms')
+        post_save.connect(search.update_session_terms_on_user_save,
+            sender=user_model,
+            dispatch_uid='django_conference_session_submitter_terms')
+
+        for view in [autocomplete.PaperAutocomplete,
+                     autocomplete.PaperPresenterAutocomplete,
+                     autocomplete.UserAutocomplete]:
+            for model_name in view.invalidated_by:
+                for signal in [post_save, post_delete]:
+                    signal.connect(view.invalidate_cache, weak=False,
+                        sender=apps.get_model(model_name),
+                        dispatch_uid='django_conference_cache_%s' %
+                                     view.__name__)
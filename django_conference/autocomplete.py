@@ -1,16 +1,133 @@
+from collections import OrderedDict
+import threading
+import time
+
 from django.apps import apps
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models.functions import Concat
-from django.db.models import Value as V
+from django.http import HttpResponse, JsonResponse
 from django.utils.decorators import method_decorator
 
 from dal import autocomplete
 
-from django_conference import settings
-from django_conference.models import Paper, PaperPresenter
-
+from django_conference import search, settings
+from django_conference.models import (Paper, PaperPresenter,
+    PaperPresenterTrigram, PaperTitleTrigram)
+
+
+class ResultCache(object):
+    """
+    Thread-safe LRU cache for the responses of the autocomplete views, with
+    entries that expire after DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_TTL
+    seconds. Keeps count of hits and misses for each view so that
+    DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE can be tuned.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, key):
+        view_name = key[0]
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses[view_name] = self.misses.get(view_name, 0) + 1
+                return None
+            # re-insert the entry to mark it as the most recently used
+            self.entries[key] = entry
+            self.hits[view_name] = self.hits.get(view_name, 0) + 1
+            return entry[1]
+
+    def set(self, key, value):
+        max_size = settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE
+        if max_size <= 0:
+            return
+        ttl = settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_TTL
+        expires = time.time() + ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, value)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, view_name):
+        """Removes all the entries for the given view"""
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == view_name]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of entries in the cache and the
+        hits, misses and hit ratio for each view.
+        """
+        with self.lock:
+            views = {}
+            for view_name in set(self.hits) | set(self.misses):
+                hits = self.hits.get(view_name, 0)
+                misses = self.misses.get(view_name, 0)
+                views[view_name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': float(hits) / (hits + misses),
+                }
+            return {
+                'size': len(self.entries),
+                'max_size': settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE,
+                'views': views,
+            }
+result_cache = ResultCache()
+
+
+class CachedResultsMixin(object):
+    """
+    Mixin for autocomplete views that caches their responses in result_cache,
+    keyed on the view, normalized query, page and forwarded values. Subclasses
+    must set "invalidated_by" to a list of the models (as "app_label.Model"
+    strings) whose changes should invalidate the cached responses, which
+    django_conference.apps.DjangoConferenceConfig connects to
+    invalidate_cache().
+    """
+    invalidated_by = []
+
+    def get(self, request, *args, **kwargs):
+        key = (self.__class__.__name__,
+               u' '.join(search.normalize(self.q).split()),
+               request.GET.get('page', '1'),
+               request.GET.get('forward', ''))
+        content = result_cache.get(key)
+        if content is not None:
+            return HttpResponse(content, content_type='application/json')
+        response = super(CachedResultsMixin, self).get(
+            request, *args, **kwargs)
+        if response.status_code == 200:
+            result_cache.set(key, response.content)
+        return response
+
+    @classmethod
+    def invalidate_cache(cls, sender, **kwargs):
+        result_cache.invalidate(cls.__name__)
+
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Returns the hit ratio and other statistics for result_cache as JSON.
+    """
+    return JsonResponse(result_cache.get_stats())
+
+
+class PaperAutocomplete(CachedResultsMixin,
+    autocomplete.Select2QuerySetView):
+    invalidated_by = ['django_conference.Paper']
 
-class PaperAutocomplete(autocomplete.Select2QuerySetView):
     @method_decorator(staff_member_required)
     def dispatch(self, *args, **kwargs):
         return super(PaperAutocomplete, self).dispatch(*args, **kwargs)
@@ -19,28 +136,32 @@ class PaperAutocomplete(autocomplete.Select2QuerySetView):
         qs = Paper.objects.all()
 
         if self.q:
-            qs = Paper.objects.filter(title__icontains=self.q)
+            qs = search.search_trigrams(PaperTitleTrigram, qs, self.q)
 
         return qs
 
 
-class PaperPresenterAutocomplete(autocomplete.Select2QuerySetView):
+class PaperPresenterAutocomplete(CachedResultsMixin,
+    autocomplete.Select2QuerySetView):
+    invalidated_by = ['django_conference.PaperPresenter']
+
     @method_decorator(staff_member_required)
     def dispatch(self, *args, **kwargs):
         return super(PaperPresenterAutocomplete, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        qs = PaperPresenter.objects.annotate(
-            full_name=Concat('first_name', V(' '), 'last_name'),
-        )
+        qs = PaperPresenter.objects.all()
 
         if self.q:
-            qs = qs.filter(full_name__icontains=self.q)
+            qs = search.search_trigrams(PaperPresenterTrigram, qs, self.q)
 
         return qs
 
 
-class UserAutocomplete(autocomplete.Select2QuerySetView):
+class UserAutocomplete(CachedResultsMixin,
+    autocomplete.Select2QuerySetView):
+    invalidated_by = [settings.DJANGO_CONFERENCE_USER_MODEL]
+
     @method_decorator(staff_member_required)
     def dispatch(self, *args, **kwargs):
         return super(UserAutocomplete, self).dispatch(*args, **kwargs)
@@ -49,7 +170,9 @@ class UserAutocomplete(autocomplete.Select2QuerySetView):
         user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
         qs = user_model.objects.all()
 
-        if self.q:
+        if self.q and settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX:
+            qs = search.search_users(qs, self.q)
+        elif self.q:
             qs = settings.DJANGO_CONFERENCE_USER_AUTOCOMPLETE_FILTER(qs,
                 self.q)
 
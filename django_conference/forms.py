@@ -2,7 +2,6 @@ from datetime import date, datetime
 from decimal import Decimal
 from calendar import monthrange
 import re
-import stripe
 
 from django import forms
 from django.apps import apps
@@ -11,7 +10,7 @@ from django.utils.encoding import force_unicode
 from django.db.models import get_model
 from django.conf import settings
 
-from django_conference import settings as conf_settings
+from django_conference import payments, settings as conf_settings
 from django_conference.models import (Meeting, Paper, Session, SessionCadre,
     RegistrationDonation, Registration, RegistrationExtra,
     RegistrationGuest, RegistrationOption, PaperPresenter)
@@ -97,7 +96,10 @@ class MeetingSessions(forms.Form):
 
     def set_session_fields(self):
         # adds multi-select fields for choosing which sessions to attend,
-        # with one field for each (start_time, stop_time) combo
+        # with one field for each (start_time, stop_time) combo. The
+        # "sessions" initial value, a list of session IDs, is split between
+        # them.
+        chosen = set(unicode(pk) for pk in self.initial.get('sessions', []))
         meeting_sessions = self.meeting.sessions.filter(accepted=True)
         time_slots = (meeting_sessions.filter(accepted=1).distinct()
                         .values_list("start_time", "stop_time")
@@ -109,6 +111,9 @@ class MeetingSessions(forms.Form):
             field_name = "sessions_%i" % i
             self.fields[field_name] = forms.MultipleChoiceField(label="",
                 choices=choices, required=False, widget=SessionsWidget)
+            if chosen:
+                self.initial.setdefault(field_name, [pk for pk, _ in choices
+                                                     if unicode(pk) in chosen])
 
     def get_sessions(self):
         clean = self.clean()
@@ -425,9 +430,16 @@ class StripePaymentForm(forms.Form):
 
 
 class StripeProcessPayment:
+    """
+    Charges a card through django_conference.payments. "payment_data" must
+    have the "total", "description", and "stripeToken" of the charge, and
+    should have an "idempotency_key" that's the same for repeated
+    submissions of the same payment.
+    """
     def __init__(self, payment_data):
         self.last_error = ''
         self.payment_data = payment_data
+        self.charge_id = None
 
     def is_valid(self):
         result = self.process_payment()
@@ -450,19 +462,58 @@ class StripeProcessPayment:
             return 'success'
         if not self.payment_data or 'stripeToken' not in self.payment_data:
             return False
-        stripe.api_key = conf_settings.DJANGO_CONFERENCE_STRIPE_SECRET_KEY
-        two_places = Decimal('0.01')
-        total_rounded = self.payment_data['total'].quantize(two_places)
-        total_cents = str(total_rounded).replace('.', '')
-        # Create the charge on Stripe's servers - this will charge the user's card
+        token = self.payment_data['stripeToken']
+        idempotency_key = self.payment_data.get('idempotency_key') or \
+            payments.get_idempotency_key(token, self.payment_data['total'])
         try:
-            charge = stripe.Charge.create(
-                currency="usd",
-                amount=total_cents,
-                card=self.payment_data['stripeToken'],
-                description=self.payment_data['description'],
-            )
+            self.charge_id = self.make_charge(self.payment_data['total'],
+                token, self.payment_data['description'], idempotency_key)
             return 'success'
-        except stripe.CardError, e:
-          # The card has been declined
+        except payments.CardDeclined, e:
             return unicode(e)
+        except payments.PaymentUnavailable:
+            # a timeout doesn't mean the charge didn't go through
+            return u'our payment processor is not responding, so your '+\
+                u'card may not have been charged. Please check with your '+\
+                u'card issuer before trying again in a few minutes.'
+        except payments.PaymentError:
+            return False
+
+    def make_charge(self, amount, token, description, idempotency_key):
+        return payments.charge(amount, token, description, idempotency_key)
+
+
+class StripeAuthorizePayment(StripeProcessPayment):
+    """
+    Version of StripeProcessPayment that only authorizes the charge, for
+    DJANGO_CONFERENCE_TWO_PHASE_PAYMENT.
+    """
+    def make_charge(self, amount, token, description, idempotency_key):
+        return payments.authorize(amount, token, description,
+            idempotency_key)
+
+
+def get_m2m_through_rows(instance, field_name, objects):
+    """
+    Returns unsaved instances of the through model of the given M2M field
+    linking the given instance to each of the given objects, which can be
+    saved with bulk_create() to add them all in one query.
+    """
+    field = instance._meta.get_field(field_name)
+    return [field.rel.through(**{
+        field.m2m_field_name(): instance,
+        field.m2m_reverse_field_name(): obj,
+    }) for obj in objects]
+
+
+def get_form_m2m_through_rows(form):
+    """
+    Returns the through model rows for the M2M fields of a ModelForm that was
+    saved with commit=False, to be used instead of form.save_m2m().
+    """
+    return [row
+            for field in form.instance._meta.many_to_many
+            if field.name in form.cleaned_data and
+               field.rel.through._meta.auto_created
+            for row in get_m2m_through_rows(form.instance, field.name,
+                form.cleaned_data[field.name])]
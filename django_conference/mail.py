@@ -0,0 +1,148 @@
+"""
+Sending of the e-mails django_conference generates, either directly or
+through the outbox table (see DJANGO_CONFERENCE_EMAIL_OUTBOX).
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+import threading
+
+from django.apps import apps
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F
+
+from django_conference import settings
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def send_email(message):
+    """
+    Sends the given EmailMessage. If DJANGO_CONFERENCE_EMAIL_OUTBOX is set,
+    it's saved to the outbox instead, as part of the current transaction.
+    Otherwise, if this is called inside a deferred_email() block, it's sent
+    once the block exits.
+    """
+    if settings.DJANGO_CONFERENCE_EMAIL_OUTBOX:
+        outgoing_email_model = apps.get_model('django_conference',
+            'OutgoingEmail')
+        outgoing_email_model.from_message(message).save()
+    elif getattr(_local, 'deferred', None) is not None:
+        _local.deferred.append(message)
+    else:
+        message.send()
+
+
+@contextmanager
+def deferred_email():
+    """
+    Holds the e-mails sent directly by send_email() inside the block until
+    it exits without an exception. Used like this, so e-mails aren't sent
+    for saves that are rolled back, and a slow or failing mail server can't
+    hold up or roll back the transaction:
+
+        with deferred_email(), transaction.atomic():
+            ...
+
+    By then the data is committed, so e-mails that can't be sent are logged
+    rather than raising an exception.
+    """
+    outer = getattr(_local, 'deferred', None)
+    _local.deferred = []
+    try:
+        yield
+        messages = _local.deferred
+    finally:
+        _local.deferred = outer
+    if outer is not None:
+        outer.extend(messages)
+    else:
+        for message in messages:
+            try:
+                message.send()
+            except Exception:
+                logger.exception("Couldn't send the e-mail \"%s\" to %s",
+                    message.subject, u', '.join(message.to))
+
+
+def get_retry_delay(attempts):
+    """
+    Returns how long to wait before trying again to send an e-mail that
+    failed the given number of times.
+    """
+    return timedelta(seconds=settings.DJANGO_CONFERENCE_EMAIL_RETRY_DELAY *
+                     2 ** (attempts - 1))
+
+
+def deliver_queued_email(batch_size=None, connection=None):
+    """
+    Sends the pending e-mails in the outbox that are due, oldest first, over
+    one connection to the mail server. E-mails that can't be sent are tried
+    again later, until DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS is reached.
+    Returns a tuple of the number of e-mails sent and the number that failed.
+
+    The e-mails are claimed by setting their status to "sending" before any
+    are sent, so runs that overlap (e.g. from cron and with --loop) never
+    send the same e-mail. If the process dies while sending, the e-mails it
+    claimed are left as "sending" rather than being sent again, since some
+    of them may have gone out. They can be sent again with the admin's
+    "Send selected e-mails again" action.
+    """
+    outgoing_email_model = apps.get_model('django_conference',
+        'OutgoingEmail')
+    batch_size = batch_size or settings.DJANGO_CONFERENCE_EMAIL_BATCH_SIZE
+    with transaction.atomic():
+        # the rows stay locked until they're claimed, so another run waiting
+        # for them skips the ones this run claims
+        emails = list(outgoing_email_model.objects.select_for_update().filter(
+            status=outgoing_email_model.PENDING,
+            next_attempt__lte=datetime.now(),
+        ).order_by('next_attempt', 'pk')[:batch_size])
+        outgoing_email_model.objects.filter(
+            pk__in=[email.pk for email in emails],
+            status=outgoing_email_model.PENDING,
+        ).update(status=outgoing_email_model.SENDING)
+    if not emails:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = []
+    failed = []
+    try:
+        connection.open()
+    except Exception as err:
+        # none of them can be sent if the mail server is down
+        failed = [(email, err) for email in emails]
+    else:
+        try:
+            for email in emails:
+                try:
+                    connection.send_messages([email.get_message(connection)])
+                except Exception as err:
+                    failed.append((email, err))
+                else:
+                    sent.append(email)
+        finally:
+            connection.close()
+
+    now = datetime.now()
+    with transaction.atomic():
+        outgoing_email_model.objects.filter(
+            pk__in=[email.pk for email in sent],
+        ).update(status=outgoing_email_model.SENT, date_sent=now,
+                 attempts=F('attempts') + 1, last_error=u'')
+        for email, err in failed:
+            email.attempts += 1
+            email.last_error = u'%s: %s' % (type(err).__name__, err)
+            if email.attempts >= settings.DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS:
+                email.status = outgoing_email_model.FAILED
+            else:
+                email.status = outgoing_email_model.PENDING
+                email.next_attempt = now + get_retry_delay(email.attempts)
+            email.save(update_fields=['attempts', 'last_error', 'status',
+                                      'next_attempt'])
+    return len(sent), len(failed)
@@ -0,0 +1,45 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_conference import settings
+from django_conference.models import Meeting
+from django_conference.registration_import import RegistrationImporter
+
+
+class Command(BaseCommand):
+    help = "Imports registrations for a meeting from a CSV file. See "+\
+           "django_conference.registration_import for the format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('meeting_id', type=int)
+        parser.add_argument('csv_file')
+        parser.add_argument('--entered-by', dest='entered_by',
+            help="Username of the staff member to record as having "+\
+                 "entered the registrations.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+            dest='chunk_size',
+            help="Number of registrations to insert per query.")
+
+    def handle(self, *args, **options):
+        if not options['entered_by']:
+            raise CommandError("The --entered-by option is required.")
+        user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
+        try:
+            meeting = Meeting.objects.get(pk=options['meeting_id'])
+        except Meeting.DoesNotExist:
+            raise CommandError("No meeting with ID %d." %
+                options['meeting_id'])
+        try:
+            entered_by = user_model._default_manager.get_by_natural_key(
+                options['entered_by'])
+        except user_model.DoesNotExist:
+            raise CommandError("No user named \"%s\"." % options['entered_by'])
+
+        importer = RegistrationImporter(meeting, entered_by,
+            options['chunk_size'])
+        with open(options['csv_file'], 'rU') as csv_file:
+            if not importer.run(csv_file):
+                for line_number, message in importer.errors:
+                    self.stderr.write(u"Line %d: %s" % (line_number, message))
+                raise CommandError("No registrations were imported.")
+        self.stdout.write("Created %d registrations." % importer.num_created)
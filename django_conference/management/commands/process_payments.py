@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_conference import payments, settings
+from django_conference.models import RegistrationPayment
+
+
+class Command(BaseCommand):
+    help = "Captures authorized payments and processes the events "+\
+           "received by the payment webhook. See "+\
+           "DJANGO_CONFERENCE_TWO_PHASE_PAYMENT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+            default=settings.DJANGO_CONFERENCE_PAYMENT_BATCH_SIZE,
+            dest='batch_size',
+            help="Number of payments or events to process at a time.")
+        parser.add_argument('--loop', action='store_true', default=False,
+            dest='loop',
+            help="Keep checking for new payments and events instead of "+\
+                 "exiting once there are none left.")
+        parser.add_argument('--interval', type=float, default=5,
+            dest='interval',
+            help="Seconds to wait between checks with --loop.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total_events = total_captured = total_failed = 0
+        while True:
+            num_events = payments.process_payment_events(batch_size)
+            num_captured, num_failed = payments.capture_payments(batch_size)
+            total_events += num_events
+            total_captured += num_captured
+            total_failed += num_failed
+            if num_events == batch_size or \
+               num_captured + num_failed == batch_size:
+                # there may be more waiting
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write("Captured %d payments. %d failed. "
+                          "Processed %d events." % (total_captured,
+                          total_failed, total_events))
+        num_stale = RegistrationPayment.objects.stale_pending().count()
+        if num_stale:
+            self.stderr.write("%d payments were interrupted while the card "
+                "was being authorized. Check them at the payment gateway "
+                "and update them in the admin." % num_stale)
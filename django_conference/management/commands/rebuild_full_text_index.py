@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from django_conference import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text indexes used by the admin to search "+\
+           "papers and sessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help="Number of rows to insert per query.")
+
+    def handle(self, *args, **options):
+        for term_model in search.TERM_MODELS.values():
+            num_created = search.rebuild_terms(term_model,
+                options['batch_size'])
+            self.stdout.write("Created %d %s rows." % (num_created,
+                term_model._meta.verbose_name))
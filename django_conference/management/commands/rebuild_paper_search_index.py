@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from django_conference import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the indexes used to search papers and paper presenters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help="Number of rows to insert per query.")
+
+    def handle(self, *args, **options):
+        for trigram_model in search.TRIGRAM_MODELS.values():
+            num_created = search.rebuild_trigrams(trigram_model,
+                options['batch_size'])
+            self.stdout.write("Created %d %s rows." % (num_created,
+                trigram_model._meta.verbose_name))
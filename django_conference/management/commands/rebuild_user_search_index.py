@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from django_conference import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the index of user names and e-mails used by the "+\
+           "user autocomplete when DJANGO_CONFERENCE_USER_SEARCH_INDEX is "+\
+           "enabled."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help="Number of tokens to insert per query.")
+
+    def handle(self, *args, **options):
+        num_created = search.rebuild_user_search_tokens(options['batch_size'])
+        self.stdout.write("Created %d search tokens." % num_created)
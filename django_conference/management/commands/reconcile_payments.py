@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_conference.models import Meeting
+from django_conference.reconciliation import PaymentReconciler
+
+
+class Command(BaseCommand):
+    help = "Reconciles card payments with a CSV export of charges from "+\
+           "the payment provider. See django_conference.reconciliation "+\
+           "for the format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--meeting', type=int, dest='meeting_id',
+            help="ID of the meeting whose payments should be in the file. "+\
+                 "By default, all payments should be.")
+
+    def handle(self, *args, **options):
+        meeting = None
+        if options['meeting_id'] is not None:
+            try:
+                meeting = Meeting.objects.get(pk=options['meeting_id'])
+            except Meeting.DoesNotExist:
+                raise CommandError("No meeting with ID %d." %
+                    options['meeting_id'])
+
+        reconciler = PaymentReconciler(meeting)
+        with open(options['csv_file'], 'rU') as csv_file:
+            if not reconciler.run(csv_file):
+                for line_number, message in reconciler.errors:
+                    self.stderr.write(u"Line %d: %s" % (line_number, message))
+                raise CommandError("The file couldn't be reconciled.")
+
+        for mismatch in reconciler.mismatched:
+            self.stdout.write(u"Mismatched: line %d, charge %s, "
+                u"registration %d: %s" % (mismatch.charge.line_number,
+                mismatch.charge.charge_id, mismatch.registration_id,
+                u" ".join(mismatch.problems)))
+        for charge in reconciler.unmatched_charges:
+            self.stdout.write(u"No payment: line %d, charge %s, %s" % (
+                charge.line_number, charge.charge_id, charge.amount))
+        for payment in reconciler.missing_payments:
+            self.stdout.write(u"Missing from file: charge %s, "
+                u"registration %d, %s" % (payment.charge_id,
+                payment.registration_id, payment.amount))
+        self.stdout.write("%d matched, %d mismatched, %d with no payment, "
+            "%d missing from file." % (reconciler.num_matched,
+            len(reconciler.mismatched), len(reconciler.unmatched_charges),
+            len(reconciler.missing_payments)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_conference import announcements
+from django_conference.models import Announcement
+
+
+class Command(BaseCommand):
+    help = "Sends an announcement to the recipients it hasn't been sent "+\
+           "to yet. Run it again to resume after an interruption or to "+\
+           "retry failed recipients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('announcement_id', type=int)
+        parser.add_argument('--batch-size', type=int, dest='batch_size',
+            help="Number of recipients to load and record as sent at a "+\
+                 "time.")
+        parser.add_argument('--max-per-second', type=float,
+            dest='max_per_second',
+            help="Maximum number of e-mails to send per second.")
+
+    def handle(self, *args, **options):
+        try:
+            announcement = Announcement.objects.select_related('meeting') \
+                .get(pk=options['announcement_id'])
+        except Announcement.DoesNotExist:
+            raise CommandError("No announcement with ID %d." %
+                options['announcement_id'])
+        num_sent, num_failed = announcements.send_announcement(announcement,
+            options['batch_size'], options['max_per_second'])
+        self.stdout.write("Sent %d e-mails. %d failed." % (num_sent,
+            num_failed))
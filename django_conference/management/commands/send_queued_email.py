@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_conference import mail, settings
+
+
+class Command(BaseCommand):
+    help = "Sends the e-mails waiting in the outbox. See "+\
+           "DJANGO_CONFERENCE_EMAIL_OUTBOX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+            default=settings.DJANGO_CONFERENCE_EMAIL_BATCH_SIZE,
+            dest='batch_size',
+            help="Number of e-mails to send over each connection.")
+        parser.add_argument('--loop', action='store_true', default=False,
+            dest='loop',
+            help="Keep checking for new e-mails instead of exiting once "+\
+                 "the outbox is empty.")
+        parser.add_argument('--interval', type=float, default=5,
+            dest='interval',
+            help="Seconds to wait between checks with --loop.")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            num_sent, num_failed = mail.deliver_queued_email(
+                options['batch_size'])
+            total_sent += num_sent
+            total_failed += num_failed
+            if num_sent + num_failed == options['batch_size']:
+                # there may be more waiting
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write("Sent %d e-mails. %d failed." % (total_sent,
+            total_failed))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from django_conference import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0002_meetingextra_admin_only'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('token', models.CharField(max_length=40, db_index=True)),
+                ('user', models.ForeignKey(related_name='search_tokens', to=settings.DJANGO_CONFERENCE_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# The text processing functions below are copies of the ones in
+# django_conference.search when this migration was written, so that later
+# changes to them don't change what this migration does.
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    """
+    Lowercases the given text and strips any accents from it,
+    e.g. u"Ren\xe9e" => u"renee"
+    """
+    text = unicodedata.normalize('NFKD', unicode(text or u''))
+    return u''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def get_trigrams(text):
+    """
+    Returns the set of trigrams for the normalized words in the given text,
+    each padded with two spaces at the start and one at the end.
+    """
+    trigrams = set()
+    for word in WORD_RE.findall(normalize(text)):
+        padded = u'  ' + word + u' '
+        trigrams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return trigrams
+
+
+def index_existing(apps, schema_editor):
+    """
+    Creates trigrams for the papers and presenters entered before the
+    trigram tables existed.
+    """
+    Paper = apps.get_model('django_conference', 'Paper')
+    PaperTitleTrigram = apps.get_model('django_conference',
+        'PaperTitleTrigram')
+    PaperPresenter = apps.get_model('django_conference', 'PaperPresenter')
+    PaperPresenterTrigram = apps.get_model('django_conference',
+        'PaperPresenterTrigram')
+    PaperTitleTrigram.objects.bulk_create([
+        PaperTitleTrigram(paper_id=pk, trigram=trigram)
+        for pk, title in Paper.objects.values_list('pk', 'title')
+        for trigram in get_trigrams(title)
+    ], batch_size=1000)
+    PaperPresenterTrigram.objects.bulk_create([
+        PaperPresenterTrigram(presenter_id=pk, trigram=trigram)
+        for pk, first_name, last_name in PaperPresenter.objects.values_list(
+            'pk', 'first_name', 'last_name')
+        for trigram in get_trigrams(first_name + ' ' + last_name)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0003_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaperPresenterTrigram',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('trigram', models.CharField(max_length=3, db_index=True)),
+                ('presenter', models.ForeignKey(related_name='name_trigrams', to='django_conference.PaperPresenter')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PaperTitleTrigram',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('trigram', models.CharField(max_length=3, db_index=True)),
+                ('paper', models.ForeignKey(related_name='title_trigrams', to='django_conference.Paper')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
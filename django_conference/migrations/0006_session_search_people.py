@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import Counter, defaultdict
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# The text processing functions below are copies of the ones in
+# django_conference.search when this migration was written, so that later
+# changes to them don't change what this migration does.
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+TERM_LENGTH = 40
+
+STOP_WORDS = frozenset(u"""
+    a an and are as at be but by for from has have in is it its of on or that
+    the their this to was were which will with
+""".split())
+
+
+def normalize(text):
+    """
+    Lowercases the given text and strips any accents from it,
+    e.g. u"Ren\xe9e" => u"renee"
+    """
+    text = unicodedata.normalize('NFKD', unicode(text or u''))
+    return u''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def _is_consonant(word, i):
+    if word[i] in u'aeiou':
+        return False
+    if word[i] == u'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(word):
+    """
+    Returns the number of vowel-consonant sequences in the given word
+    (Porter's "m").
+    """
+    m = 0
+    previous_vowel = False
+    for i in range(len(word)):
+        vowel = not _is_consonant(word, i)
+        if previous_vowel and not vowel:
+            m += 1
+        previous_vowel = vowel
+    return m
+
+
+def _has_vowel(word):
+    return any(not _is_consonant(word, i) for i in range(len(word)))
+
+
+def _ends_cvc(word):
+    i = len(word) - 1
+    return (i >= 2 and _is_consonant(word, i) and
+            not _is_consonant(word, i - 1) and _is_consonant(word, i - 2) and
+            word[i] not in u'wxy')
+
+
+def stem(word):
+    """
+    Reduces the given normalized word to its stem with step 1 of the Porter
+    stemming algorithm, which takes care of plurals and -ed/-ing endings,
+    e.g. "histories" => "histori", "studied" => "studi".
+    """
+    if len(word) <= 2:
+        return word
+    # step 1a
+    if word.endswith(u'sses') or word.endswith(u'ies'):
+        word = word[:-2]
+    elif word.endswith(u's') and not word.endswith(u'ss'):
+        word = word[:-1]
+    # step 1b
+    if word.endswith(u'eed'):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in (u'ed', u'ing'):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith((u'at', u'bl', u'iz')):
+                    word += u'e'
+                elif (len(word) > 1 and word[-1] == word[-2] and
+                      _is_consonant(word, len(word) - 1) and
+                      word[-1] not in u'lsz'):
+                    word = word[:-1]
+                elif _measure(word) == 1 and _ends_cvc(word):
+                    word += u'e'
+                break
+    # step 1c
+    if word.endswith(u'y') and _has_vowel(word[:-1]):
+        word = word[:-1] + u'i'
+    return word
+
+
+def get_terms(text):
+    """
+    Returns a Counter mapping the stemmed terms in the given text to the
+    number of times they occur, leaving out stop words.
+    """
+    terms = Counter()
+    for word in WORD_RE.findall(normalize(text)):
+        if word not in STOP_WORDS:
+            terms[stem(word)[:TERM_LENGTH]] += 1
+    return terms
+
+
+def reindex_sessions(apps, schema_editor):
+    """
+    Rebuilds the session full-text index so it includes the names and
+    institutions of the chairs and the name of the submitter.
+    """
+    Session = apps.get_model('django_conference', 'Session')
+    SessionSearchTerm = apps.get_model('django_conference',
+        'SessionSearchTerm')
+    lines = defaultdict(list)
+    for row in Session.objects.values_list('pk', 'title', 'abstract', 'notes',
+            'submitter__first_name', 'submitter__last_name'):
+        lines[row[0]].extend(row[1:])
+    for row in Session.chairs.through.objects.values_list('session_id',
+            'sessioncadre__first_name', 'sessioncadre__last_name',
+            'sessioncadre__institution'):
+        lines[row[0]].extend(row[1:])
+    SessionSearchTerm.objects.all().delete()
+    SessionSearchTerm.objects.bulk_create([
+        SessionSearchTerm(session_id=pk, term=term, frequency=frequency)
+        for pk, values in lines.items()
+        for term, frequency in get_terms(
+            '\n'.join(value or '' for value in values)).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0005_full_text_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+
+from django_conference import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0006_session_search_people'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationPaymentChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date_changed', models.DateTimeField(default=datetime.datetime.now)),
+                ('old_payment_type', models.CharField(max_length=2, choices=[(b'na', b'Not Applicable'), (b'cc', b'Credit Card'), (b'ch', b'Check'), (b'ca', b'Cash'), (b'mo', b'Money Order')])),
+                ('payment_type', models.CharField(max_length=2, choices=[(b'na', b'Not Applicable'), (b'cc', b'Credit Card'), (b'ch', b'Check'), (b'ca', b'Cash'), (b'mo', b'Money Order')])),
+                ('old_payment_received', models.DateTimeField(null=True, blank=True)),
+                ('payment_received', models.DateTimeField(null=True, blank=True)),
+                ('changed_by', models.ForeignKey(related_name='+', to=settings.DJANGO_CONFERENCE_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date_changed'],
+            },
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='payment_received',
+            field=models.DateTimeField(help_text=b"When payment was received. Leave blank if it hasn't been received yet.", null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='registrationpaymentchange',
+            name='registration',
+            field=models.ForeignKey(related_name='payment_changes', to='django_conference.Registration'),
+        ),
+    ]
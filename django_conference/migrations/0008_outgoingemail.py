@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0007_registration_payment_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('html_body', models.TextField(blank=True)),
+                ('from_email', models.CharField(max_length=254)),
+                ('to', models.TextField(help_text=b'One address per line')),
+                ('status', models.CharField(default=b'pending', max_length=7, choices=[(b'pending', b'Pending'), (b'sent', b'Sent'), (b'failed', b'Failed')])),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('date_created', models.DateTimeField(default=datetime.datetime.now)),
+                ('next_attempt', models.DateTimeField(default=datetime.datetime.now)),
+                ('date_sent', models.DateTimeField(null=True, blank=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outgoingemail',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
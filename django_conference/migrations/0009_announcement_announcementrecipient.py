@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django_conference.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0008_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Announcement',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField(help_text=b'Django template for the text of the e-mail. It can use {{ first_name }}, {{ last_name }}, {{ email }}, and {{ meeting }}.')),
+                ('to_registrants', models.BooleanField(default=True, verbose_name=b'Send to registrants')),
+                ('to_presenters', models.BooleanField(default=False, verbose_name=b'Send to presenters of papers in accepted sessions')),
+                ('to_session_cadre', models.BooleanField(default=False, verbose_name=b'Send to chairs, organizers, and commentators of accepted sessions')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(null=True, editable=False, blank=True)),
+                ('date_finished', models.DateTimeField(null=True, editable=False, blank=True)),
+                ('meeting', models.ForeignKey(related_name='announcements', default=django_conference.models.current_meeting_or_none, to='django_conference.Meeting')),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnnouncementRecipient',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('email', models.CharField(max_length=254)),
+                ('first_name', models.CharField(max_length=100, blank=True)),
+                ('last_name', models.CharField(max_length=100, blank=True)),
+                ('date_sent', models.DateTimeField(null=True, blank=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('announcement', models.ForeignKey(related_name='recipients', to='django_conference.Announcement')),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0009_announcement_announcementrecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('event_id', models.CharField(unique=True, max_length=255)),
+                ('type', models.CharField(max_length=10, choices=[(b'captured', b'Captured'), (b'failed', b'Failed'), (b'refunded', b'Refunded')])),
+                ('charge_id', models.CharField(max_length=255)),
+                ('date_received', models.DateTimeField(default=datetime.datetime.now)),
+                ('date_processed', models.DateTimeField(db_index=True, null=True, blank=True)),
+            ],
+            options={
+                'ordering': ['-date_received'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RegistrationPayment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('amount', models.DecimalField(max_digits=8, decimal_places=2)),
+                ('charge_id', models.CharField(help_text=b'ID of the charge at the payment gateway', max_length=255, db_index=True, blank=True)),
+                ('idempotency_key', models.CharField(unique=True, max_length=100)),
+                ('status', models.CharField(default=b'pending', max_length=10, choices=[(b'pending', b'Pending'), (b'authorized', b'Authorized'), (b'captured', b'Captured'), (b'failed', b'Failed'), (b'refunded', b'Refunded')])),
+                ('send_confirmation', models.BooleanField(default=False, help_text=b'Send the registration confirmation e-mail once the payment is captured')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text=b'Number of failed tries to capture the payment')),
+                ('date_created', models.DateTimeField(default=datetime.datetime.now)),
+                ('next_attempt', models.DateTimeField(default=datetime.datetime.now)),
+                ('date_captured', models.DateTimeField(null=True, blank=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('registration', models.ForeignKey(related_name='card_payments', to='django_conference.Registration')),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='registrationpayment',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0010_registrationpayment_paymentevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrationpayment',
+            name='description',
+            field=models.TextField(help_text=b'Description of the charge sent to the payment gateway', blank=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0011_registrationpayment_description'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='status',
+            field=models.CharField(default=b'pending', max_length=7, choices=[(b'pending', b'Pending'), (b'sending', b'Sending'), (b'sent', b'Sent'), (b'failed', b'Failed')]),
+        ),
+    ]
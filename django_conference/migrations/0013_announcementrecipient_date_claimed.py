@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_conference', '0012_outgoingemail_sending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcementrecipient',
+            name='date_claimed',
+            field=models.DateTimeField(help_text=b'When a run of send_announcement started sending to them', null=True, blank=True),
+        ),
+    ]
@@ -1,13 +1,14 @@
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 import re
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.template.loader import render_to_string
 
 from django_conference import settings
+from django_conference.mail import send_email
 
 
 def meeting_stat(stat_func):
@@ -103,6 +104,53 @@ class Meeting(models.Model):
     def current():
         return Meeting.objects.filter(is_active=1).order_by('-end_date')[0]
 
+    def clone(self, days=0, price_percent=0, location=None):
+        """
+        Creates an inactive copy of this meeting along with its registration
+        options, extras, donations, and institutions, which are copied with
+        one bulk INSERT per model. All dates are moved forward by the given
+        number of days, and the prices of the registration options and
+        extras are changed by the given percentage (rounded to the cent).
+        Returns the new meeting.
+        """
+        shift = timedelta(days=days)
+        factor = 1 + Decimal(price_percent) / 100
+        adjust = lambda price: (price * factor).quantize(Decimal('0.01'))
+        fields = [field for field in self._meta.concrete_fields
+                  if not field.primary_key]
+
+        with transaction.atomic():
+            meeting = Meeting(**dict(
+                (field.attname, getattr(self, field.attname))
+                for field in fields))
+            meeting.is_active = False
+            if location:
+                meeting.location = location
+            for field in fields:
+                # DateTimeField is a subclass of DateField
+                if isinstance(field, models.DateField):
+                    setattr(meeting, field.attname,
+                        getattr(meeting, field.attname) + shift)
+            meeting.save()
+
+            for related_name, price_fields in [
+                ('regoptions', ('early_price', 'regular_price',
+                                'onsite_price')),
+                ('extras', ('price',)),
+                ('donations', ()),
+                ('institutions', ()),
+            ]:
+                objects = list(getattr(self, related_name).all())
+                for obj in objects:
+                    obj.pk = None
+                    obj.meeting = meeting
+                    for field_name in price_fields:
+                        setattr(obj, field_name,
+                            adjust(getattr(obj, field_name)))
+                if objects:
+                    type(objects[0]).objects.bulk_create(objects)
+        return meeting
+
     @staticmethod
     def get_past_meetings(years_ago):
         """
@@ -353,7 +401,7 @@ class Paper(models.Model):
         msg = EmailMultiAlternatives(subject=subject, from_email=sender,
             body=txt_body, to=[self.submitter.email])
         msg.attach_alternative(html_body, "text/html")
-        msg.send()
+        send_email(msg)
 
 
 class FieldType(models.Model):
@@ -460,6 +508,100 @@ class RegistrationOption(models.Model):
         unique_together = ("meeting", "option_name")
 
 
+class RegistrationQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Returns this queryset with everything registration_details.html and
+        register_email.html use loaded by select_related() and
+        prefetch_related(), so rendering them for any number of
+        registrations takes a fixed number of queries.
+        """
+        return self.select_related('meeting', 'type', 'registrant') \
+            .prefetch_related(
+                'meeting__institutions',
+                'guests',
+                models.Prefetch('regextras', queryset=RegistrationExtra \
+                    .objects.select_related('extra__extra_type')),
+                models.Prefetch('regdonations', queryset=RegistrationDonation \
+                    .objects.select_related('donate_type__donate_type')),
+                'sessions',
+            )
+
+    def send_register_emails(self):
+        """
+        Sends the registration confirmation e-mail for each registration in
+        this queryset. Returns the number of e-mails sent.
+        """
+        registrations = list(self.with_details())
+        for registration in registrations:
+            subject = unicode(registration.meeting.start_date.year) + \
+                " Meeting Registration"
+            text = render_to_string("django_conference/register_email.html", {
+                "meeting": registration.meeting,
+                "registration": registration,
+            })
+            sender = settings.DJANGO_CONFERENCE_CONTACT_EMAIL
+            msg = EmailMessage(subject=subject, body=text,
+                from_email=sender, to=[registration.registrant.email])
+            send_email(msg)
+        return len(registrations)
+
+    def set_payment_type(self, payment_type, changed_by):
+        """
+        Changes the payment type of all the registrations in this queryset
+        with one UPDATE, and records the change for each registration that
+        had a different payment type with one bulk INSERT. Like
+        QuerySet.update(), this doesn't call save() or send signals. Returns
+        the number of registrations changed.
+        """
+        return self._change_payment(changed_by,
+            self.exclude(payment_type=payment_type),
+            payment_type=payment_type)
+
+    def record_payment(self, changed_by, payment_received=None):
+        """
+        Records that payment was received (by default, now) for all the
+        registrations in this queryset that haven't been marked as paid yet,
+        in the same way as set_payment_type(). Returns the number of
+        registrations changed.
+        """
+        return self._change_payment(changed_by,
+            self.filter(payment_received__isnull=True),
+            payment_received=payment_received or datetime.now())
+
+    def clear_payment(self, changed_by):
+        """
+        Clears the date payment was received for all the registrations in
+        this queryset that were marked as paid. Returns the number of
+        registrations changed.
+        """
+        return self._change_payment(changed_by,
+            self.filter(payment_received__isnull=False),
+            payment_received=None)
+
+    def _change_payment(self, changed_by, queryset, **changes):
+        with transaction.atomic():
+            # lock the rows so the recorded changes match what was updated
+            rows = list(queryset.order_by().select_for_update().values_list(
+                'pk', 'payment_type', 'payment_received'))
+            if not rows:
+                return 0
+            num_updated = Registration.objects.filter(
+                pk__in=[pk for pk, _, _ in rows]).update(**changes)
+            date_changed = datetime.now()
+            RegistrationPaymentChange.objects.bulk_create([
+                RegistrationPaymentChange(registration_id=pk,
+                    changed_by=changed_by, date_changed=date_changed,
+                    old_payment_type=payment_type,
+                    payment_type=changes.get('payment_type', payment_type),
+                    old_payment_received=payment_received,
+                    payment_received=changes.get('payment_received',
+                                                 payment_received))
+                for pk, payment_type, payment_received in rows
+            ])
+        return num_updated
+
+
 class Registration(models.Model):
     """Model to store registrations"""
     PAYMENT_TYPES = (
@@ -476,6 +618,9 @@ class Registration(models.Model):
     date_entered = models.DateTimeField()
     payment_type = models.CharField(max_length=2, choices=PAYMENT_TYPES,
         default="cc")
+    payment_received = models.DateTimeField(blank=True, null=True,
+        help_text="When payment was received. Leave blank if it hasn't "+\
+                  "been received yet.")
     registrant = models.ForeignKey(settings.DJANGO_CONFERENCE_USER_MODEL,
         related_name="registrations")
     entered_by = models.ForeignKey(settings.DJANGO_CONFERENCE_USER_MODEL,
@@ -483,13 +628,15 @@ class Registration(models.Model):
     sessions = models.ManyToManyField("Session", blank=True,
         related_name="regsessions")
 
+    objects = RegistrationQuerySet.as_manager()
+
     def __unicode__(self):
         return self.registrant.get_full_name()+": "+unicode(self.date_entered)
 
     def save(self, *args, **kwargs):
         if not self.id:
             self.date_entered = datetime.now()
-        super(Registration, self).save(args, kwargs)
+        super(Registration, self).save(*args, **kwargs)
 
     def get_meeting_cost(self):
         """Calculates total cost for the meeting registration only
@@ -512,18 +659,12 @@ class Registration(models.Model):
 
     def send_register_email(self):
         """
-        Sends e-mail to registrant with registration details. E-mail will
-        contain both an HTML and text version.
+        Sends e-mail to registrant with registration details. The
+        registration is reloaded with RegistrationQuerySet.with_details(),
+        so this takes the same number of queries however many extras,
+        donations, guests, and sessions it has.
         """
-        subject = unicode(self.meeting.start_date.year)+" Meeting Registration"
-        text = render_to_string("django_conference/register_email.html", {
-            "meeting": self.meeting,
-            "registration": self,
-        })
-        sender = settings.DJANGO_CONFERENCE_CONTACT_EMAIL
-        msg = EmailMessage(subject=subject, body=text,
-            from_email=sender, to=[self.registrant.email])
-        msg.send()
+        Registration.objects.filter(pk=self.pk).send_register_emails()
 
     def has_special_needs(self):
         """
@@ -540,6 +681,178 @@ class Registration(models.Model):
         ordering = ["-meeting", "registrant"]
 
 
+class RegistrationPaymentChange(models.Model):
+    """
+    Audit record of a change to the payment type or payment date of a
+    registration made with one of the bulk actions in RegistrationQuerySet.
+    """
+    registration = models.ForeignKey(Registration,
+        related_name="payment_changes")
+    changed_by = models.ForeignKey(settings.DJANGO_CONFERENCE_USER_MODEL,
+        related_name="+")
+    date_changed = models.DateTimeField(default=datetime.now)
+    old_payment_type = models.CharField(max_length=2,
+        choices=Registration.PAYMENT_TYPES)
+    payment_type = models.CharField(max_length=2,
+        choices=Registration.PAYMENT_TYPES)
+    old_payment_received = models.DateTimeField(blank=True, null=True)
+    payment_received = models.DateTimeField(blank=True, null=True)
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.registration_id, self.date_changed)
+
+    class Meta:
+        ordering = ['-date_changed']
+
+
+class RegistrationPaymentQuerySet(models.QuerySet):
+    def stale_pending(self):
+        """
+        Returns the payments in this queryset that have been pending for
+        longer than DJANGO_CONFERENCE_PAYMENT_PENDING_TIMEOUT, whose
+        authorization was interrupted
+        """
+        timeout = settings.DJANGO_CONFERENCE_PAYMENT_PENDING_TIMEOUT
+        return self.filter(status=RegistrationPayment.PENDING,
+            date_created__lt=datetime.now() - timedelta(seconds=timeout))
+
+    def mark_captured(self, date_captured=None):
+        """
+        Marks the payments in this queryset that are pending or authorized as
+        captured, records that payment was received for their registrations,
+        and sends the confirmation e-mail for the ones that were new
+        registrations. A payment is only marked once, however many times this
+        is called for it, so the worker and the webhook can both call it.
+        Returns the number of payments marked.
+        """
+        date_captured = date_captured or datetime.now()
+        with transaction.atomic():
+            rows = list(self
+                .filter(status__in=[RegistrationPayment.PENDING,
+                                    RegistrationPayment.AUTHORIZED])
+                .order_by().select_for_update()
+                .values_list('pk', 'registration_id', 'send_confirmation'))
+            if not rows:
+                return 0
+            RegistrationPayment.objects.filter(
+                pk__in=[pk for pk, _, _ in rows],
+            ).update(status=RegistrationPayment.CAPTURED,
+                     date_captured=date_captured, last_error=u'')
+            Registration.objects.filter(
+                pk__in=[registration_id for _, registration_id, _ in rows],
+                payment_received__isnull=True,
+            ).update(payment_received=date_captured)
+            Registration.objects.filter(
+                pk__in=[registration_id
+                        for _, registration_id, send_confirmation in rows
+                        if send_confirmation],
+            ).send_register_emails()
+        return len(rows)
+
+    def mark_failed(self, error):
+        """
+        Marks the payments in this queryset that are pending or authorized as
+        failed with the given error. Returns the number of payments marked.
+        """
+        return self.filter(status__in=[RegistrationPayment.PENDING,
+                                       RegistrationPayment.AUTHORIZED]) \
+            .update(status=RegistrationPayment.FAILED, last_error=error)
+
+    def mark_refunded(self):
+        """
+        Marks the captured payments in this queryset as refunded, and clears
+        the date payment was received for their registrations. Only meant for
+        full refunds. Returns the number of payments marked.
+        """
+        with transaction.atomic():
+            rows = list(self.filter(status=RegistrationPayment.CAPTURED)
+                .order_by().select_for_update()
+                .values_list('pk', 'registration_id'))
+            if not rows:
+                return 0
+            RegistrationPayment.objects.filter(
+                pk__in=[pk for pk, _ in rows],
+            ).update(status=RegistrationPayment.REFUNDED)
+            Registration.objects.filter(
+                pk__in=[registration_id for _, registration_id in rows],
+            ).update(payment_received=None)
+        return len(rows)
+
+
+class RegistrationPayment(models.Model):
+    """
+    A card payment for a registration. Payments made in two phases (see
+    DJANGO_CONFERENCE_TWO_PHASE_PAYMENT) are saved as pending before the card
+    is authorized, then captured by the process_payments management command
+    or marked by the events the payment gateway sends to the webhook.
+    Payments made in one step are saved as captured once the card is charged.
+    """
+    PENDING = "pending"
+    AUTHORIZED = "authorized"
+    CAPTURED = "captured"
+    FAILED = "failed"
+    REFUNDED = "refunded"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (AUTHORIZED, "Authorized"),
+        (CAPTURED, "Captured"),
+        (FAILED, "Failed"),
+        (REFUNDED, "Refunded"),
+    )
+    registration = models.ForeignKey(Registration,
+        related_name="card_payments")
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    description = models.TextField(blank=True,
+        help_text="Description of the charge sent to the payment gateway")
+    charge_id = models.CharField(max_length=255, blank=True, db_index=True,
+        help_text="ID of the charge at the payment gateway")
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES,
+        default=PENDING)
+    send_confirmation = models.BooleanField(default=False,
+        help_text="Send the registration confirmation e-mail once the "+\
+                  "payment is captured")
+    attempts = models.PositiveSmallIntegerField(default=0,
+        help_text="Number of failed tries to capture the payment")
+    date_created = models.DateTimeField(default=datetime.now)
+    next_attempt = models.DateTimeField(default=datetime.now)
+    date_captured = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    objects = RegistrationPaymentQuerySet.as_manager()
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.registration_id, self.amount)
+
+    class Meta:
+        ordering = ['-date_created']
+        index_together = [('status', 'next_attempt')]
+
+
+class PaymentEvent(models.Model):
+    """
+    An event received from the payment gateway by the payment webhook,
+    waiting to be processed by the process_payments management command.
+    """
+    TYPES = (
+        (RegistrationPayment.CAPTURED, "Captured"),
+        (RegistrationPayment.FAILED, "Failed"),
+        (RegistrationPayment.REFUNDED, "Refunded"),
+    )
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=10, choices=TYPES)
+    charge_id = models.CharField(max_length=255)
+    date_received = models.DateTimeField(default=datetime.now)
+    date_processed = models.DateTimeField(blank=True, null=True,
+        db_index=True)
+
+    def __unicode__(self):
+        return self.event_id
+
+    class Meta:
+        ordering = ['-date_received']
+
+
 class RegistrationExtra(models.Model):
     registration = models.ForeignKey(Registration, related_name="regextras")
     extra = models.ForeignKey(MeetingExtra)
@@ -639,6 +952,27 @@ class SessionCadre(models.Model):
         verbose_name_plural = "Session cadre"
 
 
+class SessionQuerySet(models.QuerySet):
+    def set_accepted(self, accepted):
+        """
+        Accepts or rejects all the sessions in this queryset along with their
+        papers, using one UPDATE for the sessions and one for the papers.
+        Like QuerySet.update(), this doesn't call save() or send signals.
+        Returns the number of sessions updated.
+        """
+        with transaction.atomic():
+            session_ids = list(self.order_by().values_list('pk', flat=True))
+            num_updated = Session.objects.filter(pk__in=session_ids) \
+                .update(accepted=accepted)
+            # a subquery rather than a join, which would make backends that
+            # can't UPDATE a table while selecting from it (MySQL) SELECT
+            # the paper IDs first
+            Paper.objects.filter(pk__in=SessionPapers.objects.filter(
+                session__in=session_ids).values('paper')) \
+                .update(accepted=accepted)
+        return num_updated
+
+
 class Session(models.Model):
     submitter = models.ForeignKey(settings.DJANGO_CONFERENCE_USER_MODEL,
         blank=True, null=True)
@@ -660,6 +994,14 @@ class Session(models.Model):
         related_name="sessions_commentated")
     papers = models.ManyToManyField("Paper", blank=True, through="SessionPapers")
 
+    objects = SessionQuerySet.as_manager()
+
+    def __init__(self, *args, **kwargs):
+        super(Session, self).__init__(*args, **kwargs)
+        # Used by save() to tell whether "accepted" has changed. This is None
+        # if the field was deferred.
+        self._saved_accepted = self.__dict__.get('accepted')
+
     def __unicode__(self):
         return self.title
 
@@ -696,17 +1038,20 @@ class Session(models.Model):
             {"session": self})
         msg = EmailMessage(subject=subject, from_email=sender,
             body=body, to=[o.email for o in self.organizers.all()])
-        msg.send()
+        send_email(msg)
 
     def save(self, *args, **kwargs):
         """
-        When a session is saved, all papers should have their "accepted" field
-        adjusted accordingly
+        When a session is accepted or rejected, all papers should have their
+        "accepted" field adjusted accordingly
         """
-        super(Session, self).save(args, kwargs)
-        for paper in self.papers.all():
-            paper.accepted = self.accepted
-            paper.save()
+        super(Session, self).save(*args, **kwargs)
+        if self.accepted != self._saved_accepted:
+            # a subquery rather than a join; see SessionQuerySet.set_accepted()
+            Paper.objects.filter(pk__in=SessionPapers.objects.filter(
+                session=self).values('paper')) \
+                .update(accepted=self.accepted)
+            self._saved_accepted = self.accepted
 
     class Meta:
         ordering = ['-meeting', 'start_time', 'stop_time']
@@ -719,3 +1064,224 @@ class SessionPapers(models.Model):
 
     def __unicode__(self):
         return "session paper #%i" % self.position
+
+
+class Announcement(models.Model):
+    """
+    An e-mail to send to the registrants of a meeting and/or the people in
+    its accepted sessions, using the send_announcement management command.
+    """
+    BODY_HELP = "Django template for the text of the e-mail. It can use "+\
+                "{{ first_name }}, {{ last_name }}, {{ email }}, and "+\
+                "{{ meeting }}."
+    meeting = models.ForeignKey(Meeting, related_name="announcements",
+        default=current_meeting_or_none)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(help_text=BODY_HELP)
+    to_registrants = models.BooleanField("Send to registrants", default=True)
+    to_presenters = models.BooleanField(
+        "Send to presenters of papers in accepted sessions", default=False)
+    to_session_cadre = models.BooleanField(
+        "Send to chairs, organizers, and commentators of accepted sessions",
+        default=False)
+    date_created = models.DateTimeField(auto_now_add=True, editable=False)
+    date_started = models.DateTimeField(blank=True, null=True,
+        editable=False)
+    date_finished = models.DateTimeField(blank=True, null=True,
+        editable=False)
+
+    def __unicode__(self):
+        return self.subject
+
+    class Meta:
+        ordering = ['-date_created']
+
+
+class AnnouncementRecipient(models.Model):
+    """
+    A recipient of an announcement, and whether it has been sent to them.
+    """
+    announcement = models.ForeignKey(Announcement, related_name="recipients")
+    email = models.CharField(max_length=254)
+    first_name = models.CharField(max_length=100, blank=True)
+    last_name = models.CharField(max_length=100, blank=True)
+    date_sent = models.DateTimeField(blank=True, null=True)
+    date_claimed = models.DateTimeField(blank=True, null=True,
+        help_text="When a run of send_announcement started sending to them")
+    last_error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return self.email
+
+
+class UserSearchToken(models.Model):
+    """
+    Normalized (lowercased and accent-stripped) word from the name or e-mail
+    of a user, used by django_conference.search.search_users() to do indexed
+    prefix lookups. Only maintained if DJANGO_CONFERENCE_USER_SEARCH_INDEX is
+    enabled.
+    """
+    TOKEN_LENGTH = 40
+    USER_FIELDS = ('first_name', 'last_name', 'email')
+
+    user = models.ForeignKey(settings.DJANGO_CONFERENCE_USER_MODEL,
+        related_name="search_tokens")
+    token = models.CharField(max_length=TOKEN_LENGTH, db_index=True)
+
+    def __unicode__(self):
+        return self.token
+
+
+class SearchTrigram(models.Model):
+    """
+    Abstract model for a three-character sequence from the normalized text
+    of an object, used by django_conference.search.search_trigrams() for
+    typo-tolerant searches. Subclasses must add a foreign key to the object,
+    set "object_field" to its name, and set "source_fields" to the names of
+    the fields on the object that are indexed.
+    """
+    trigram = models.CharField(max_length=3, db_index=True)
+
+    def __unicode__(self):
+        return self.trigram
+
+    class Meta:
+        abstract = True
+
+
+class PaperTitleTrigram(SearchTrigram):
+    object_field = 'paper'
+    source_fields = ('title',)
+    paper = models.ForeignKey(Paper, related_name="title_trigrams")
+
+
+class PaperPresenterTrigram(SearchTrigram):
+    object_field = 'presenter'
+    source_fields = ('first_name', 'last_name')
+    presenter = models.ForeignKey(PaperPresenter, related_name="name_trigrams")
+
+
+class SearchTerm(models.Model):
+    """
+    Abstract model for an entry in a full-text index: a stemmed term from the
+    text of an object and the number of times it occurs, used by
+    django_conference.search.get_terms_q() and rank_by_terms().
+    Subclasses must add a foreign key to the object, set "object_field" to
+    its name, and set "source_fields" to the names of the fields on the
+    object that are indexed. Subclasses that index more than those fields
+    should override get_text() and get_indexed_objects().
+    """
+    TERM_LENGTH = 40
+
+    term = models.CharField(max_length=TERM_LENGTH, db_index=True)
+    frequency = models.PositiveIntegerField(default=1)
+
+    @classmethod
+    def get_text(cls, obj):
+        """Returns the text that should be indexed for the given object"""
+        return u'\n'.join(unicode(getattr(obj, field) or u'')
+                          for field in cls.source_fields)
+
+    @classmethod
+    def get_indexed_objects(cls):
+        """
+        Returns a queryset of all the objects that are indexed, with
+        everything needed by get_text() selected.
+        """
+        return cls._meta.get_field(cls.object_field).rel.to.objects.all()
+
+    def __unicode__(self):
+        return self.term
+
+    class Meta:
+        abstract = True
+
+
+class PaperSearchTerm(SearchTerm):
+    object_field = 'paper'
+    source_fields = ('title', 'abstract', 'notes', 'coauthor')
+    paper = models.ForeignKey(Paper, related_name="search_terms")
+
+
+class SessionSearchTerm(SearchTerm):
+    """
+    Full-text index for sessions. Besides the text fields, the names and
+    institutions of the chairs and the name of the submitter are indexed, so
+    the admin can search them without joining the M2M tables.
+    """
+    object_field = 'session'
+    source_fields = ('title', 'abstract', 'notes', 'submitter')
+    session = models.ForeignKey(Session, related_name="search_terms")
+
+    @classmethod
+    def get_text(cls, obj):
+        lines = [obj.title, obj.abstract, obj.notes]
+        if obj.submitter_id:
+            lines.extend([obj.submitter.first_name, obj.submitter.last_name])
+        for chair in obj.chairs.all():
+            lines.extend([chair.first_name, chair.last_name,
+                chair.institution])
+        return u'\n'.join(unicode(line or u'') for line in lines)
+
+    @classmethod
+    def get_indexed_objects(cls):
+        return Session.objects.select_related('submitter') \
+            .prefetch_related('chairs')
+
+
+class OutgoingEmail(models.Model):
+    """
+    An e-mail in the outbox, waiting to be sent by the send_queued_email
+    management command (see DJANGO_CONFERENCE_EMAIL_OUTBOX).
+    """
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.TextField(help_text="One address per line")
+    status = models.CharField(max_length=7, choices=STATUSES,
+        default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    date_created = models.DateTimeField(default=datetime.now)
+    next_attempt = models.DateTimeField(default=datetime.now)
+    date_sent = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return self.subject
+
+    @classmethod
+    def from_message(cls, message):
+        """Returns an unsaved OutgoingEmail for the given EmailMessage"""
+        html_bodies = [content
+                       for content, mimetype in getattr(message,
+                                                        'alternatives', [])
+                       if mimetype == "text/html"]
+        now = datetime.now()
+        return cls(subject=message.subject, body=message.body,
+            html_body=html_bodies[0] if html_bodies else u'',
+            from_email=message.from_email, to=u'\n'.join(message.to),
+            date_created=now, next_attempt=now)
+
+    def get_message(self, connection=None):
+        """Returns an EmailMultiAlternatives for sending this e-mail"""
+        message = EmailMultiAlternatives(subject=self.subject,
+            body=self.body, from_email=self.from_email,
+            to=self.to.splitlines(), connection=connection)
+        if self.html_body:
+            message.attach_alternative(self.html_body, "text/html")
+        return message
+
+    class Meta:
+        ordering = ['-date_created']
+        index_together = [('status', 'next_attempt')]
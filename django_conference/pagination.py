@@ -0,0 +1,152 @@
+"""
+Pagination for admin changelists of large tables. Instead of running
+COUNT(*) queries on every page view, these use the database's estimate of
+the number of rows once a table is big enough for the exact number not to
+matter, and briefly cache exact counts and date hierarchy buckets.
+"""
+import hashlib
+import re
+
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import DateTimeField
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from django_conference import settings
+
+
+EXPLAIN_ROWS_RE = re.compile(r'\brows=(\d+)')
+
+
+def estimate_count(queryset):
+    """
+    Returns the database's estimate of the number of rows in the given
+    queryset, or None if it can't provide one. On PostgreSQL this comes from
+    the statistics in pg_class or the query plan, and on MySQL from
+    information_schema (for unfiltered querysets only).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    is_filtered = bool(queryset.query.where)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if is_filtered:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN ' + sql, params)
+                match = EXPLAIN_ROWS_RE.search(cursor.fetchone()[0])
+                return int(match.group(1)) if match else None
+            cursor.execute("SELECT reltuples FROM pg_class "
+                "WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'mysql' and not is_filtered:
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        # tables that have never been analyzed have no estimate
+        return None
+    return int(row[0])
+
+
+def get_cached(prefix, queryset, compute):
+    """
+    Returns the result of calling compute(), which should be derived from the
+    given queryset, caching it for DJANGO_CONFERENCE_ADMIN_COUNT_CACHE_TTL
+    seconds under a key made from the queryset's SQL.
+    """
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return compute()
+    key = 'django_conference.%s.%s' % (prefix,
+        hashlib.md5(repr((queryset.db, sql, params))).hexdigest())
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result,
+            settings.DJANGO_CONFERENCE_ADMIN_COUNT_CACHE_TTL)
+    return result
+
+
+def get_count(queryset):
+    """
+    Returns a (count, is_estimate) tuple for the given queryset. The count is
+    the database's estimate if that's at least
+    DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD, or else the (cached)
+    exact count.
+    """
+    threshold = settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD
+    if threshold is not None:
+        estimate = estimate_count(queryset)
+        if estimate is not None and estimate >= threshold:
+            return estimate, True
+    return get_cached('count', queryset, queryset.count), False
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that gets the number of objects from get_count(). If that's an
+    estimate, "is_estimate" is set to True and pages are no longer cut off at
+    the estimated count.
+    """
+    is_estimate = False
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count, self.is_estimate = get_count(self.object_list)
+        return self._count
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.is_estimate:
+            return super(EstimatedCountPaginator, self).page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page],
+            number, self)
+
+
+class _CountOnly(object):
+    """Stands in for a queryset that's only used to get its count"""
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def count(self):
+        return get_count(self.queryset)[0]
+
+
+class EstimatedCountChangeList(ChangeList):
+    """
+    ChangeList that gets the unfiltered number of objects from get_count(),
+    and computes the date hierarchy from one cached query.
+    """
+    def get_results(self, request):
+        # This relies on the internals of Django 1.8's ChangeList, whose
+        # get_results() only uses root_queryset to count it (for the
+        # "N total" link when the list is filtered, e.g. by a date
+        # hierarchy drilldown). Check it when upgrading Django.
+        root_queryset = self.root_queryset
+        self.root_queryset = _CountOnly(root_queryset)
+        try:
+            super(EstimatedCountChangeList, self).get_results(request)
+        finally:
+            self.root_queryset = root_queryset
+        self.count_is_estimate = self.paginator.is_estimate
+
+    def get_date_buckets(self):
+        """
+        Returns the sorted list of distinct days in the date_hierarchy field
+        of the filtered objects, from which the estimated_date_hierarchy tag
+        builds the year, month, and day links.
+        """
+        field = self.opts.get_field(self.date_hierarchy)
+        if isinstance(field, DateTimeField):
+            get_days = lambda: list(
+                self.queryset.datetimes(self.date_hierarchy, 'day'))
+        else:
+            get_days = lambda: list(
+                self.queryset.dates(self.date_hierarchy, 'day'))
+        return get_cached('date_buckets', self.queryset, get_days)
@@ -0,0 +1,477 @@
+"""
+Charging credit cards through the gateway chosen by
+DJANGO_CONFERENCE_PAYMENT_GATEWAY. charge() limits how long a charge can
+take. It uses timeouts, a bounded number of retries with jittered backoff,
+and a circuit breaker that fails fast while the gateway is down. Every try
+of a charge sends the same idempotency key, so retries and double
+submissions can't charge a card twice.
+
+With DJANGO_CONFERENCE_TWO_PHASE_PAYMENT, the card is only authorized while
+the registrant waits. capture_payments() and process_payment_events(), run
+by the process_payments management command, then finish the payment in the
+background.
+"""
+from collections import defaultdict, OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+import hashlib
+import json
+import random
+import time
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+
+from django_conference import mail, settings
+from django_conference.models import PaymentEvent, RegistrationPayment
+
+
+FAILURES_KEY = 'django_conference.payment_failures'
+CIRCUIT_OPEN_KEY = 'django_conference.payment_circuit_open'
+
+
+class PaymentError(Exception):
+    """The charge failed for a reason that trying again won't fix"""
+
+
+class CardDeclined(PaymentError):
+    """The card was declined. The message says why."""
+
+
+class PaymentUnavailable(PaymentError):
+    """The gateway couldn't be reached or had a temporary error"""
+
+
+class PaymentGateway(object):
+    def charge(self, amount, token, description, idempotency_key):
+        """
+        Charges the card represented by the given token the given amount (a
+        Decimal, in dollars) and returns the ID of the charge. Should raise
+        PaymentUnavailable for errors that are worth retrying, CardDeclined
+        if the card is declined, and PaymentError for other errors.
+        """
+        raise NotImplementedError
+
+    def authorize(self, amount, token, description, idempotency_key):
+        """
+        Like charge(), but only authorizes the charge, so it can be captured
+        later.
+        """
+        raise NotImplementedError
+
+    def capture(self, charge_id, idempotency_key):
+        """
+        Captures the authorized charge with the given ID. Raises the same
+        exceptions as charge().
+        """
+        raise NotImplementedError
+
+    def parse_webhook(self, request):
+        """
+        Returns the events in the request sent to the payment webhook as a
+        list of dictionaries with the "id" of the event, the "charge_id" of
+        the charge it's for, and its "type", which is one of the types of
+        PaymentEvent. Events of other types are left out. Raises ValueError
+        if the request isn't a valid webhook request from the gateway.
+        """
+        raise NotImplementedError
+
+
+class StripeGateway(PaymentGateway):
+    """Charges cards through Stripe"""
+    _http_client = None
+
+    @classmethod
+    def get_http_client(cls):
+        if cls._http_client is None:
+            import stripe
+            try:
+                cls._http_client = stripe.http_client.RequestsClient(timeout=(
+                    settings.DJANGO_CONFERENCE_PAYMENT_CONNECT_TIMEOUT,
+                    settings.DJANGO_CONFERENCE_PAYMENT_READ_TIMEOUT))
+            except (AttributeError, TypeError):
+                # Stripe's other HTTP clients can't be given timeouts, so
+                # falling back to them would let a charge hang
+                raise ImproperlyConfigured("Charging cards with Stripe "
+                    "requires the \"requests\" library and stripe>=1.62.0.")
+        return cls._http_client
+
+    # the Stripe events for the types of PaymentEvent
+    EVENT_TYPES = {
+        'charge.captured': RegistrationPayment.CAPTURED,
+        'charge.failed': RegistrationPayment.FAILED,
+        'charge.expired': RegistrationPayment.FAILED,
+        'charge.refunded': RegistrationPayment.REFUNDED,
+    }
+
+    def call_stripe(self, func, *args, **kwargs):
+        """
+        Calls the given function of the Stripe library with the configured
+        HTTP client, converting Stripe's exceptions.
+        """
+        import stripe
+        stripe.default_http_client = self.get_http_client()
+        try:
+            return func(*args, **kwargs)
+        except stripe.error.CardError as err:
+            raise CardDeclined(unicode(err))
+        except (stripe.error.APIConnectionError, stripe.error.APIError,
+                stripe.error.RateLimitError) as err:
+            raise PaymentUnavailable(unicode(err))
+        except stripe.error.StripeError as err:
+            raise PaymentError(unicode(err))
+
+    def charge(self, amount, token, description, idempotency_key,
+               capture=True):
+        import stripe
+        return self.call_stripe(stripe.Charge.create,
+            api_key=settings.DJANGO_CONFERENCE_STRIPE_SECRET_KEY,
+            idempotency_key=idempotency_key,
+            currency="usd",
+            amount=get_cents(amount),
+            card=token,
+            description=description,
+            capture=capture,
+        ).id
+
+    def authorize(self, amount, token, description, idempotency_key):
+        return self.charge(amount, token, description, idempotency_key,
+            capture=False)
+
+    def capture(self, charge_id, idempotency_key):
+        import stripe
+        charge = self.call_stripe(stripe.Charge.retrieve, charge_id,
+            api_key=settings.DJANGO_CONFERENCE_STRIPE_SECRET_KEY)
+        if not charge.captured:
+            self.call_stripe(charge.capture, idempotency_key=idempotency_key)
+        return charge.id
+
+    def parse_webhook(self, request):
+        import stripe
+        secret = settings.DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET
+        if not secret:
+            raise ValueError("DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET "+\
+                             "isn't set.")
+        try:
+            event = stripe.Webhook.construct_event(request.body,
+                request.META.get('HTTP_STRIPE_SIGNATURE', ''), secret)
+        except stripe.error.SignatureVerificationError as err:
+            raise ValueError(unicode(err))
+        if event.type not in self.EVENT_TYPES:
+            return []
+        charge = event.data.object
+        if event.type == 'charge.refunded' and \
+           charge.amount_refunded < charge.amount:
+            # a partial refund leaves the registration paid for
+            return []
+        return [{
+            'id': event.id,
+            'type': self.EVENT_TYPES[event.type],
+            'charge_id': charge.id,
+        }]
+
+
+class FakeGateway(PaymentGateway):
+    """
+    Gateway that doesn't charge anything, for tests and benchmarks. Cards
+    are declined if the token starts with "tok_declined". Set "outages" to
+    make that many of the following calls fail as if the gateway was down,
+    and "latency" to make calls take that many seconds.
+
+    Its webhook takes a JSON list of events in the format returned by
+    parse_webhook(), without checking where they came from, so it must only
+    be used for testing.
+    """
+    charges = {}
+    outages = 0
+    latency = 0
+    num_calls = 0
+
+    @classmethod
+    def reset(cls):
+        cls.charges = {}
+        cls.outages = cls.latency = cls.num_calls = 0
+
+    def call(self):
+        cls = type(self)
+        cls.num_calls += 1
+        if cls.latency:
+            time.sleep(cls.latency)
+        if cls.outages:
+            cls.outages -= 1
+            raise PaymentUnavailable("The fake gateway is down.")
+
+    def charge(self, amount, token, description, idempotency_key,
+               capture=True):
+        self.call()
+        if token.startswith("tok_declined"):
+            raise CardDeclined("Your card was declined.")
+        charges = type(self).charges
+        if idempotency_key not in charges:
+            charges[idempotency_key] = {
+                'id': 'ch_fake_%d' % (len(charges) + 1),
+                'amount': amount,
+                'token': token,
+                'description': description,
+                'captured': capture,
+            }
+        return charges[idempotency_key]['id']
+
+    def authorize(self, amount, token, description, idempotency_key):
+        return self.charge(amount, token, description, idempotency_key,
+            capture=False)
+
+    def capture(self, charge_id, idempotency_key):
+        self.call()
+        for charge in type(self).charges.values():
+            if charge['id'] == charge_id:
+                charge['captured'] = True
+                return charge_id
+        raise PaymentError("No such charge: %s" % charge_id)
+
+    def parse_webhook(self, request):
+        events = json.loads(request.body)
+        if not isinstance(events, list) or \
+           not all(isinstance(event, dict) and
+                   set(event) >= set(['id', 'type', 'charge_id'])
+                   for event in events):
+            raise ValueError("Expected a list of events.")
+        return events
+
+
+def get_gateway():
+    return import_string(settings.DJANGO_CONFERENCE_PAYMENT_GATEWAY)()
+
+
+def get_cents(amount):
+    """Returns the given amount in dollars as a whole number of cents"""
+    return int(amount.quantize(Decimal('0.01')) * 100)
+
+
+def get_idempotency_key(*parts):
+    """
+    Returns an idempotency key for a charge made from the given parts, which
+    should identify the payment, so charging the same payment twice gives
+    the same key.
+    """
+    data = u'\x1f'.join(unicode(part) for part in parts)
+    return 'django-conference-' + \
+        hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def is_circuit_open():
+    return cache.get(CIRCUIT_OPEN_KEY) is not None
+
+
+def record_failure():
+    threshold = settings.DJANGO_CONFERENCE_PAYMENT_CIRCUIT_THRESHOLD
+    reset = settings.DJANGO_CONFERENCE_PAYMENT_CIRCUIT_RESET
+    cache.add(FAILURES_KEY, 0, reset * 10)
+    try:
+        num_failures = cache.incr(FAILURES_KEY)
+    except ValueError:
+        # the key expired in the meantime
+        num_failures = 1
+        cache.set(FAILURES_KEY, num_failures, reset * 10)
+    if num_failures >= threshold:
+        cache.set(CIRCUIT_OPEN_KEY, True, reset)
+        # one more failure once the circuit closes opens it again
+        cache.set(FAILURES_KEY, threshold - 1, reset * 10)
+
+
+def record_success():
+    cache.delete(FAILURES_KEY)
+
+
+def get_retry_delay(retry):
+    """Returns a random number of seconds to wait before the given retry"""
+    return random.uniform(0, settings.DJANGO_CONFERENCE_PAYMENT_RETRY_BACKOFF *
+                             2 ** retry)
+
+
+def call_gateway(method, *args):
+    """
+    Calls the given method of a payment gateway, retrying if the gateway is
+    unavailable, and returns what it returns. Raises one of the PaymentError
+    exceptions if it fails.
+    """
+    max_retries = settings.DJANGO_CONFERENCE_PAYMENT_MAX_RETRIES
+    for retry in range(max_retries + 1):
+        if is_circuit_open():
+            raise PaymentUnavailable("The payment gateway is unavailable.")
+        if retry:
+            time.sleep(get_retry_delay(retry - 1))
+        try:
+            result = method(*args)
+        except PaymentUnavailable:
+            record_failure()
+            if retry == max_retries:
+                raise
+        except PaymentError:
+            # the gateway is working, even if the call isn't
+            record_success()
+            raise
+        else:
+            record_success()
+            return result
+
+
+def charge(amount, token, description, idempotency_key, gateway=None):
+    """
+    Charges the card represented by the given token with the payment
+    gateway, retrying if it's unavailable. Returns the ID of the charge, or
+    raises one of the PaymentError exceptions.
+    """
+    gateway = gateway or get_gateway()
+    return call_gateway(gateway.charge, amount, token, description,
+        idempotency_key)
+
+
+def authorize(amount, token, description, idempotency_key, gateway=None):
+    """
+    Like charge(), but only authorizes the charge, so it can be captured
+    later with capture().
+    """
+    gateway = gateway or get_gateway()
+    return call_gateway(gateway.authorize, amount, token, description,
+        idempotency_key)
+
+
+def capture(charge_id, idempotency_key, gateway=None):
+    """
+    Captures the authorized charge with the given ID, retrying if the
+    gateway is unavailable.
+    """
+    gateway = gateway or get_gateway()
+    return call_gateway(gateway.capture, charge_id, idempotency_key)
+
+
+def get_capture_retry_delay(attempts):
+    """
+    Returns how long to wait before trying again to capture a payment that
+    failed to be captured the given number of times.
+    """
+    return timedelta(
+        seconds=settings.DJANGO_CONFERENCE_PAYMENT_CAPTURE_RETRY_DELAY *
+                2 ** (attempts - 1))
+
+
+def capture_payments(batch_size=None, gateway=None):
+    """
+    Captures the authorized payments that are due, oldest first, and sends
+    the confirmation e-mails for them. Payments that can't be captured
+    because the gateway is unavailable are tried again later, until
+    DJANGO_CONFERENCE_PAYMENT_CAPTURE_MAX_ATTEMPTS is reached. Only one
+    process should run this at a time. Returns a tuple of the number of
+    payments captured and the number that failed.
+    """
+    batch_size = batch_size or settings.DJANGO_CONFERENCE_PAYMENT_BATCH_SIZE
+    gateway = gateway or get_gateway()
+    batch = list(RegistrationPayment.objects.filter(
+        status=RegistrationPayment.AUTHORIZED,
+        next_attempt__lte=datetime.now(),
+    ).order_by('next_attempt', 'pk')[:batch_size])
+
+    captured = []
+    failed = []
+    for payment in batch:
+        try:
+            capture(payment.charge_id,
+                get_idempotency_key('capture', payment.idempotency_key),
+                gateway)
+        except PaymentError as err:
+            failed.append((payment, err))
+        else:
+            captured.append(payment)
+
+    now = datetime.now()
+    with mail.deferred_email(), transaction.atomic():
+        RegistrationPayment.objects.filter(
+            pk__in=[payment.pk for payment in captured],
+        ).mark_captured(now)
+        for payment, err in failed:
+            payment.attempts += 1
+            payment.last_error = u'%s: %s' % (type(err).__name__, err)
+            max_attempts = \
+                settings.DJANGO_CONFERENCE_PAYMENT_CAPTURE_MAX_ATTEMPTS
+            if not isinstance(err, PaymentUnavailable) or \
+               payment.attempts >= max_attempts:
+                payment.status = RegistrationPayment.FAILED
+            else:
+                payment.next_attempt = now + \
+                    get_capture_retry_delay(payment.attempts)
+            # the webhook may have changed the status in the meantime
+            RegistrationPayment.objects.filter(pk=payment.pk,
+                status=RegistrationPayment.AUTHORIZED,
+            ).update(attempts=payment.attempts,
+                     last_error=payment.last_error, status=payment.status,
+                     next_attempt=payment.next_attempt)
+    return len(captured), len(failed)
+
+
+def save_events(events):
+    """
+    Saves the given events from PaymentGateway.parse_webhook() to be
+    processed by process_payment_events(), ignoring the ones that were
+    already received. Takes one query to find those and one to insert the
+    rest. Returns the number of events saved.
+    """
+    new_events = OrderedDict((event['id'], event) for event in events)
+    received = PaymentEvent.objects.filter(
+        event_id__in=new_events.keys()).values_list('event_id', flat=True)
+    for event_id in received:
+        del new_events[event_id]
+    rows = [PaymentEvent(event_id=event['id'], type=event['type'],
+                         charge_id=event['charge_id'])
+            for event in new_events.values()]
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.bulk_create(rows)
+    except IntegrityError:
+        # another request saved some of them at the same time
+        num_saved = 0
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    row.save()
+                num_saved += 1
+            except IntegrityError:
+                pass
+        return num_saved
+    return len(rows)
+
+
+def process_payment_events(batch_size=None):
+    """
+    Applies the unprocessed events received by the payment webhook, oldest
+    first, to the payments they're for, with one query for each type of
+    event in the batch. Returns the number of events processed.
+    """
+    batch_size = batch_size or settings.DJANGO_CONFERENCE_PAYMENT_BATCH_SIZE
+    events = list(PaymentEvent.objects.filter(date_processed__isnull=True)
+                  .order_by('pk')[:batch_size])
+    if not events:
+        return 0
+    charge_ids = defaultdict(set)
+    for event in events:
+        charge_ids[event.type].add(event.charge_id)
+
+    def get_payments(event_type):
+        return RegistrationPayment.objects.filter(
+            charge_id__in=charge_ids[event_type])
+
+    with mail.deferred_email(), transaction.atomic():
+        # in the order they happen to a charge
+        if charge_ids[RegistrationPayment.CAPTURED]:
+            get_payments(RegistrationPayment.CAPTURED).mark_captured()
+        if charge_ids[RegistrationPayment.FAILED]:
+            get_payments(RegistrationPayment.FAILED).mark_failed(
+                u"The payment gateway reported that the charge failed.")
+        if charge_ids[RegistrationPayment.REFUNDED]:
+            get_payments(RegistrationPayment.REFUNDED).mark_refunded()
+        PaymentEvent.objects.filter(
+            pk__in=[event.pk for event in events],
+        ).update(date_processed=datetime.now())
+    return len(events)
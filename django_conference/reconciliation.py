@@ -0,0 +1,220 @@
+"""
+Reconciliation of card payments against a CSV export of charges from the
+payment provider, used by the "Reconcile Payments" admin task and the
+reconcile_payments management command.
+
+The first line of the file is a header naming the columns, which can be in
+any order and are matched regardless of case, so Stripe's export of
+payments can be used as is. These columns are used, and the rest ignored:
+
+    id              ID of the charge
+    amount          Amount charged in dollars, e.g. "20.00"
+    description     Description of the charge
+    status          Optional. Charges whose status is "failed" are skipped.
+
+Each charge is matched to the RegistrationPayment with the same charge ID,
+then its amount and description are compared with the ones recorded when
+the card was charged (see RegistrationContainer.get_description()).
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections
+
+from django_conference.models import RegistrationPayment
+from django_conference.registration_import import LOOKUP_CHUNK_SIZE, chunked
+
+
+REQUIRED_COLUMNS = ('id', 'amount', 'description')
+SKIPPED_STATUSES = ('failed',)
+
+
+def get_cents(amount):
+    """
+    Returns the given amount in dollars, as returned by the database for a
+    DecimalField, as a whole number of cents
+    """
+    if isinstance(amount, float):
+        # SQLite stores decimals as floating point numbers
+        return int(round(amount * 100))
+    return int(Decimal(amount) * 100)
+
+
+def iter_raw_rows(queryset):
+    """
+    Yields the rows of the given values_list() queryset as returned by the
+    database, without the conversions Django does for each value. For
+    DecimalFields, those take most of the time when loading tens of
+    thousands of rows.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        for rows in iter(lambda: cursor.fetchmany(1000), []):
+            for row in rows:
+                yield row
+
+
+class ExportedCharge(object):
+    """A charge from the provider's export file"""
+    def __init__(self, line_number, charge_id, amount, description):
+        self.line_number = line_number
+        self.charge_id = charge_id
+        self.amount = amount
+        self.cents = get_cents(amount)
+        self.description = description
+
+
+class Mismatch(object):
+    """
+    A charge in the export file whose amount or description doesn't match
+    the payment with the same charge ID. "problems" is a list of messages.
+    """
+    def __init__(self, charge, registration_id, problems):
+        self.charge = charge
+        self.registration_id = registration_id
+        self.problems = problems
+
+
+class PaymentReconciler(object):
+    """
+    Matches the charges in a CSV export file (see the module docstring for
+    the format) to the recorded card payments. Both are loaded into dicts
+    keyed by charge ID, so matching takes two queries however many charges
+    there are, apart from loading the details of payments that are missing
+    from the export. The payments are loaded with iter_raw_rows(), which
+    makes reconciling 50,000 charges take a couple of seconds.
+
+    If a meeting is given, only its payments are reported as missing from
+    the export. After run():
+
+        errors              List of (line number, message) tuples for rows
+                            that couldn't be read. Nothing else is reported
+                            if there are any.
+        num_matched         Number of charges that matched their payment
+        mismatched          List of Mismatch objects
+        unmatched_charges   List of ExportedCharge objects for charges with
+                            no recorded payment
+        missing_payments    List of captured RegistrationPayment objects
+                            with no charge in the export
+    """
+    def __init__(self, meeting=None):
+        self.meeting = meeting
+        self.reset()
+
+    def reset(self):
+        self.errors = []
+        self.num_matched = 0
+        self.mismatched = []
+        self.unmatched_charges = []
+        self.missing_payments = []
+
+    def run(self, csv_file):
+        """
+        Reconciles the charges in the given file, which can be anything that
+        iterates over the lines of a UTF-8 encoded CSV file. Returns True if
+        the file could be read, False if there were errors.
+        """
+        self.reset()
+        charges = self.read_charges(csv_file)
+        if self.errors:
+            return False
+        self.match(charges)
+        return True
+
+    def decode(self, value):
+        return value.decode('utf-8', 'replace')
+
+    def add_error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+    def read_charges(self, csv_file):
+        """
+        Returns a dict mapping the charge IDs in the given file to
+        ExportedCharge objects.
+        """
+        reader = csv.reader(csv_file)
+        try:
+            header = [self.decode(col).lstrip(u'\ufeff').strip().lower()
+                      for col in next(reader)]
+        except StopIteration:
+            header = []
+        for column in REQUIRED_COLUMNS:
+            if column not in header:
+                self.add_error(1, u'Missing the "%s" column.' % column)
+        if self.errors:
+            return {}
+        id_index, amount_index, description_index = \
+            [header.index(column) for column in REQUIRED_COLUMNS]
+        status_index = header.index('status') if 'status' in header else None
+        num_columns = len(header)
+
+        charges = {}
+        for line_number, values in enumerate(reader, 2):
+            if not any(value.strip() for value in values):
+                continue
+            if len(values) < num_columns:
+                self.add_error(line_number, u'The row has %d columns '
+                    u'instead of %d.' % (len(values), num_columns))
+                continue
+            if status_index is not None and \
+               values[status_index].strip().lower() in SKIPPED_STATUSES:
+                continue
+            charge_id = self.decode(values[id_index]).strip()
+            amount = values[amount_index].strip().lstrip('$').replace(',', '')
+            try:
+                amount = Decimal(amount)
+            except InvalidOperation:
+                self.add_error(line_number, u'"%s" is not a valid amount.' %
+                    self.decode(values[amount_index]))
+                continue
+            if not charge_id:
+                self.add_error(line_number, u'The charge ID is missing.')
+            elif charge_id in charges:
+                self.add_error(line_number, u'The charge "%s" is also on '
+                    u'line %d.' % (charge_id,
+                                   charges[charge_id].line_number))
+            else:
+                charges[charge_id] = ExportedCharge(line_number, charge_id,
+                    amount, self.decode(values[description_index]).strip())
+        return charges
+
+    def match(self, charges):
+        # only the columns that are compared are loaded, since there can be
+        # tens of thousands of payments
+        payments = dict((row[0], row) for row in iter_raw_rows(
+            RegistrationPayment.objects.exclude(charge_id=u'').values_list(
+                'charge_id', 'registration_id', 'amount', 'description')))
+
+        for charge in sorted(charges.values(),
+                             key=lambda charge: charge.line_number):
+            payment = payments.get(charge.charge_id)
+            if payment is None:
+                self.unmatched_charges.append(charge)
+                continue
+            _, registration_id, amount, description = payment
+            problems = []
+            cents = get_cents(amount)
+            if charge.cents != cents:
+                problems.append(u'The amount is %s instead of %d.%02d.' % (
+                    charge.amount, cents // 100, cents % 100))
+            if description and charge.description != description:
+                problems.append(u'The description is "%s" instead of "%s".' %
+                    (charge.description, description))
+            if problems:
+                self.mismatched.append(Mismatch(charge, registration_id,
+                    problems))
+            else:
+                self.num_matched += 1
+
+        captured = RegistrationPayment.objects.filter(
+            status=RegistrationPayment.CAPTURED).exclude(charge_id=u'')
+        if self.meeting:
+            captured = captured.filter(registration__meeting=self.meeting)
+        missing_ids = [charge_id for charge_id in
+                       captured.values_list('charge_id', flat=True)
+                       if charge_id not in charges]
+        for chunk in chunked(missing_ids, LOOKUP_CHUNK_SIZE):
+            self.missing_payments.extend(captured.filter(
+                charge_id__in=chunk,
+            ).select_related('registration__registrant'))
@@ -0,0 +1,336 @@
+"""
+Bulk import of registrations from CSV files, used by the "Import
+Registrations" admin task and the import_registrations management command.
+
+The first line of the file is a header naming the columns, which can be in
+any order. "email" and "option" are required; the rest are optional:
+
+    email           E-mail address of an existing user, who is the registrant
+    option          Name of one of the meeting's registration options
+    payment_type    One of the codes in Registration.PAYMENT_TYPES
+                    (e.g. "ch" for check)
+    date_entered    "YYYY-MM-DD" or "YYYY-MM-DD HH:MM". Defaults to now.
+    special_needs   Free text
+    guests          Names of guests separated by semicolons, e.g.
+                    "Jane Smith; John Smith"
+    extra:NAME      Quantity of the meeting extra whose type is named NAME
+    donation:NAME   Amount donated to the meeting donation whose type is
+                    named NAME
+"""
+from collections import OrderedDict
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.apps import apps
+from django.db import transaction
+
+from django_conference import settings
+from django_conference.models import (Meeting, Registration,
+    RegistrationDonation, RegistrationExtra, RegistrationGuest)
+
+
+REQUIRED_COLUMNS = ('email', 'option')
+OPTIONAL_COLUMNS = ('payment_type', 'date_entered', 'special_needs', 'guests')
+EXTRA_PREFIX = 'extra:'
+DONATION_PREFIX = 'donation:'
+DATE_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%d')
+# RegistrationDonation.total has four digits before the decimal point
+MAX_DONATION = Decimal('10000')
+
+# Number of values to put in one "IN (...)" lookup, which keeps SQLite under
+# its limit on the number of query parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+def chunked(items, size):
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ImportedRow(object):
+    """
+    A valid row from the CSV file, with the unsaved registration and the
+    extras, donations and guests that go with it
+    """
+    def __init__(self, line_number, email, registration, related_objects):
+        self.line_number = line_number
+        self.email = email
+        self.registration = registration
+        self.related_objects = related_objects
+
+
+class ImportConflict(Exception):
+    """
+    Raised by RegistrationImporter.save() to roll back the import when a
+    registrant was registered for the meeting while it was running
+    """
+
+
+class RegistrationImporter(object):
+    """
+    Validates and imports registrations for the given meeting from a CSV file
+    (see the module docstring for the format). Everything the rows are
+    checked against is loaded into dicts up front, so validating a row
+    doesn't need any queries.
+
+    Nothing is imported if any row is invalid, or if one of the registrants
+    registers for the meeting while the import is running. Otherwise, the
+    rows are inserted in chunks of "chunk_size" with bulk_create() inside a
+    transaction (see save()). After run(), "errors" is a list of (line
+    number, message) tuples and "num_created" is the number of
+    registrations imported.
+    """
+    def __init__(self, meeting, entered_by, chunk_size=500):
+        self.meeting = meeting
+        self.entered_by = entered_by
+        self.chunk_size = chunk_size
+        self.options = dict((option.option_name.lower(), option)
+                            for option in meeting.regoptions.all())
+        self.extras = dict((extra.extra_type_id.lower(), extra)
+                           for extra in meeting.extras.all())
+        self.donations = dict((donation.donate_type_id.lower(), donation)
+                              for donation in meeting.donations.all())
+        self.payment_types = dict(Registration.PAYMENT_TYPES)
+        self.errors = []
+        self.num_created = 0
+
+    def run(self, csv_file):
+        """
+        Imports the registrations in the given file, which can be anything
+        that iterates over the lines of a UTF-8 encoded CSV file. Returns
+        True if they were imported, False if there were errors.
+        """
+        self.errors = []
+        self.num_created = 0
+        reader = csv.reader(csv_file)
+        try:
+            header = [self.decode(col).lstrip(u'\ufeff').strip().lower()
+                      for col in next(reader)]
+        except StopIteration:
+            header = []
+        if not self.check_header(header):
+            return False
+
+        rows = []
+        for line_number, values in enumerate(reader, 2):
+            if not any(value.strip() for value in values):
+                continue
+            values = [self.decode(value).strip() for value in values]
+            row = self.parse_row(line_number,
+                OrderedDict(zip(header, values)))
+            if row:
+                rows.append(row)
+        self.check_registrants(rows)
+        if self.errors:
+            return False
+
+        return self.save(rows)
+
+    def decode(self, value):
+        return value.decode('utf-8', 'replace')
+
+    def add_error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+    def check_header(self, header):
+        for column in REQUIRED_COLUMNS:
+            if column not in header:
+                self.add_error(1, u'Missing the "%s" column.' % column)
+        for column in header:
+            if column in REQUIRED_COLUMNS or column in OPTIONAL_COLUMNS:
+                continue
+            if column.startswith(EXTRA_PREFIX):
+                if column[len(EXTRA_PREFIX):] not in self.extras:
+                    self.add_error(1, u'"%s" is not an extra for this '
+                        u'meeting.' % column[len(EXTRA_PREFIX):])
+            elif column.startswith(DONATION_PREFIX):
+                if column[len(DONATION_PREFIX):] not in self.donations:
+                    self.add_error(1, u'"%s" is not a donation for this '
+                        u'meeting.' % column[len(DONATION_PREFIX):])
+            else:
+                self.add_error(1, u'Unknown column "%s".' % column)
+        return not self.errors
+
+    def parse_row(self, line_number, data):
+        """
+        Returns an ImportedRow for the given dict mapping column names to
+        values, or None if the row is invalid. The registrant is looked up
+        later by check_registrants().
+        """
+        num_errors = len(self.errors)
+        error = lambda message: self.add_error(line_number, message)
+
+        if not data.get('email'):
+            error(u'The e-mail address is missing.')
+        option = self.options.get(data.get('option', u'').lower())
+        if not option:
+            error(u'"%s" is not a registration option for this meeting.' %
+                data.get('option', u''))
+
+        payment_type = data.get('payment_type') or \
+            Registration._meta.get_field('payment_type').default
+        if payment_type not in self.payment_types:
+            error(u'"%s" is not a valid payment type. Must be one of: %s.' % (
+                payment_type, u', '.join(sorted(self.payment_types))))
+
+        date_entered = datetime.now()
+        if data.get('date_entered'):
+            for date_format in DATE_FORMATS:
+                try:
+                    date_entered = datetime.strptime(data['date_entered'],
+                        date_format)
+                    break
+                except ValueError:
+                    pass
+            else:
+                error(u'"%s" is not a valid date.' % data['date_entered'])
+
+        related_objects = []
+        for column, value in data.items():
+            if not value:
+                continue
+            if column.startswith(EXTRA_PREFIX):
+                extra = self.extras[column[len(EXTRA_PREFIX):]]
+                if not value.isdigit() or int(value) > extra.max_quantity:
+                    error(u'The quantity for "%s" must be a whole number '
+                        u'between 0 and %d.' % (extra.extra_type_id,
+                        extra.max_quantity))
+                elif int(value):
+                    related_objects.append(RegistrationExtra(extra=extra,
+                        quantity=int(value)))
+            elif column.startswith(DONATION_PREFIX):
+                donation = self.donations[column[len(DONATION_PREFIX):]]
+                try:
+                    total = Decimal(value.lstrip(u'$'))
+                except InvalidOperation:
+                    total = None
+                if total is None or not 0 <= total < MAX_DONATION or \
+                    total != total.quantize(Decimal('0.01')):
+                    error(u'The donation to "%s" must be an amount between '
+                        u'0 and %s.' % (donation.donate_type_id,
+                        MAX_DONATION - Decimal('0.01')))
+                elif total:
+                    related_objects.append(RegistrationDonation(
+                        donate_type=donation, total=total))
+        for name in data.get('guests', u'').split(u';'):
+            if not name.strip():
+                continue
+            first_name, _, last_name = name.strip().rpartition(u' ')
+            if not first_name:
+                error(u'Guests must have a first and last name.')
+            else:
+                related_objects.append(RegistrationGuest(
+                    first_name=first_name, last_name=last_name))
+
+        if len(self.errors) > num_errors:
+            return None
+        registration = Registration(meeting=self.meeting, type=option,
+            payment_type=payment_type, date_entered=date_entered,
+            special_needs=data.get('special_needs', u''),
+            entered_by=self.entered_by)
+        return ImportedRow(line_number, data['email'], registration,
+            related_objects)
+
+    def check_registrants(self, rows):
+        """
+        Sets the registrant of each row from the e-mail addresses, and
+        reports rows whose registrant doesn't exist or is already registered,
+        and rows whose address is shared by more than one user (ignoring
+        case).
+        """
+        user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
+        # also look up the lowercased addresses, since that's how they're
+        # usually stored
+        emails = list(set(row.email for row in rows) |
+                      set(row.email.lower() for row in rows))
+        user_ids = {}
+        ambiguous = set()
+        for chunk in chunked(emails, LOOKUP_CHUNK_SIZE):
+            for pk, email in user_model._default_manager.filter(
+                    email__in=chunk).values_list('pk', 'email'):
+                if user_ids.setdefault(email.lower(), pk) != pk:
+                    ambiguous.add(email.lower())
+        registered = set()
+        for chunk in chunked(user_ids.values(), LOOKUP_CHUNK_SIZE):
+            registered.update(self.meeting.registrations.filter(
+                registrant__in=chunk).values_list('registrant_id', flat=True))
+
+        for row in rows:
+            registrant_id = user_ids.get(row.email.lower())
+            if row.email.lower() in ambiguous:
+                self.add_error(row.line_number,
+                    u'More than one user has the e-mail address "%s".' %
+                    row.email)
+            elif registrant_id is None:
+                self.add_error(row.line_number,
+                    u'There is no user with the e-mail address "%s".' %
+                    row.email)
+            elif registrant_id in registered:
+                self.add_error(row.line_number,
+                    u'"%s" is already registered for this meeting.' %
+                    row.email)
+            else:
+                row.registration.registrant_id = registrant_id
+                registered.add(registrant_id)
+
+    def save(self, rows):
+        """
+        Saves the given valid rows, and returns True if they were saved. The
+        meeting is locked, so imports for it run one at a time, and the rows
+        are checked again for registrants who have registered since
+        check_registrants(). If any have, nothing is saved and False is
+        returned.
+        """
+        rows_by_registrant = dict((row.registration.registrant_id, row)
+                                  for row in rows)
+        try:
+            with transaction.atomic():
+                list(Meeting.objects.select_for_update().filter(
+                    pk=self.meeting.pk).values_list('pk'))
+                for chunk in chunked(rows_by_registrant.keys(),
+                                     LOOKUP_CHUNK_SIZE):
+                    registered = list(self.meeting.registrations.filter(
+                        registrant__in=chunk).values_list('registrant_id',
+                                                          flat=True))
+                    if registered:
+                        self.add_conflicts(
+                            [rows_by_registrant[pk] for pk in registered])
+                for chunk in chunked(rows, self.chunk_size):
+                    self.save_chunk(chunk)
+        except ImportConflict:
+            self.num_created = 0
+            return False
+        return True
+
+    def add_conflicts(self, rows):
+        for row in sorted(rows, key=lambda row: row.line_number):
+            self.add_error(row.line_number, u'"%s" was registered for this '
+                u'meeting while the import was running.' % row.email)
+        raise ImportConflict
+
+    def save_chunk(self, chunk):
+        Registration.objects.bulk_create([row.registration for row in chunk])
+        # bulk_create() doesn't set the primary keys, but there's only one
+        # registration per registrant for a meeting, unless someone
+        # registered in the meantime
+        registration_ids = {}
+        conflicts = set()
+        for registrant_id, pk in self.meeting.registrations.filter(
+                registrant__in=[row.registration.registrant_id
+                                for row in chunk],
+        ).values_list('registrant_id', 'pk'):
+            if registration_ids.setdefault(registrant_id, pk) != pk:
+                conflicts.add(registrant_id)
+        if conflicts:
+            self.add_conflicts([row for row in chunk
+                if row.registration.registrant_id in conflicts])
+        objects_by_model = OrderedDict()
+        for row in chunk:
+            for obj in row.related_objects:
+                obj.registration_id = registration_ids[
+                    row.registration.registrant_id]
+                objects_by_model.setdefault(type(obj), []).append(obj)
+        for model, objects in objects_by_model.items():
+            model.objects.bulk_create(objects)
+        self.num_created += len(chunk)
@@ -0,0 +1,583 @@
+"""
+Indexed search backends for the autocomplete views and admin. Rather than
+scanning whole tables with icontains, these keep side tables of normalized
+tokens, trigrams (for typo-tolerant searches) or stemmed terms (for
+full-text searches) that can be searched with indexed lookups.
+"""
+from collections import Counter
+import math
+import operator
+import re
+import unicodedata
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import (Case, Count, F, FloatField, IntegerField, Max, Q,
+    Sum, Value, When)
+
+from django_conference import settings
+from django_conference.models import (Paper, PaperPresenter,
+    PaperPresenterTrigram, PaperSearchTerm, PaperTitleTrigram, SearchTerm,
+    Session, SessionSearchTerm, UserSearchToken)
+
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Fraction of the trigrams in a query that an object must share to be
+# considered a match by search_trigrams()
+TRIGRAM_THRESHOLD = 0.4
+
+# search_trigrams() ranks this many candidates for every result returned
+TRIGRAM_CANDIDATES_PER_RESULT = 5
+
+# Maps models to the SearchTrigram subclass that indexes them
+TRIGRAM_MODELS = {
+    Paper: PaperTitleTrigram,
+    PaperPresenter: PaperPresenterTrigram,
+}
+
+# Maps models to the SearchTerm subclass that is their full-text index
+TERM_MODELS = {
+    Paper: PaperSearchTerm,
+    Session: SessionSearchTerm,
+}
+
+# Words that are too common to be worth putting in the full-text index
+STOP_WORDS = frozenset(u"""
+    a an and are as at be but by for from has have in is it its of on or that
+    the their this to was were which will with
+""".split())
+
+
+def normalize(text):
+    """
+    Lowercases the given text and strips any accents from it,
+    e.g. u"Ren\xe9e" => u"renee"
+    """
+    text = unicodedata.normalize('NFKD', unicode(text or u''))
+    return u''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text, max_length):
+    """
+    Returns the list of normalized words in the given text, each truncated
+    to max_length.
+    """
+    return [word[:max_length] for word in WORD_RE.findall(normalize(text))]
+
+
+def get_user_tokens(user):
+    """
+    Returns the set of tokens that the given user should be found by.
+    """
+    max_length = UserSearchToken.TOKEN_LENGTH
+    tokens = set()
+    for field in UserSearchToken.USER_FIELDS:
+        tokens.update(tokenize(getattr(user, field, ''), max_length))
+    return tokens
+
+
+def update_user_search_tokens(user):
+    """
+    Brings the search tokens for the given user up to date, only writing to
+    the database if they've changed.
+    """
+    tokens = get_user_tokens(user)
+    existing = set(user.search_tokens.values_list('token', flat=True))
+    if tokens == existing:
+        return
+    with transaction.atomic():
+        user.search_tokens.filter(token__in=existing - tokens).delete()
+        UserSearchToken.objects.bulk_create([
+            UserSearchToken(user=user, token=token)
+            for token in tokens - existing
+        ])
+
+
+def update_user_search_tokens_on_save(sender, instance, raw=False, **kwargs):
+    """
+    post_save receiver for the user model that keeps its search tokens up to
+    date if DJANGO_CONFERENCE_USER_SEARCH_INDEX is enabled.
+    """
+    if raw or not settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX:
+        return
+    update_user_search_tokens(instance)
+
+
+def rebuild_user_search_tokens(batch_size=1000):
+    """
+    Deletes and recreates the search tokens for every user. Returns the
+    number of tokens created.
+    """
+    user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
+    num_created = 0
+    with transaction.atomic():
+        UserSearchToken.objects.all().delete()
+        batch = []
+        for user in user_model.objects.order_by('pk').iterator():
+            batch.extend(UserSearchToken(user=user, token=token)
+                         for token in get_user_tokens(user))
+            if len(batch) >= batch_size:
+                UserSearchToken.objects.bulk_create(batch)
+                num_created += len(batch)
+                batch = []
+        UserSearchToken.objects.bulk_create(batch)
+        num_created += len(batch)
+    return num_created
+
+
+def rank_by_tokens(token_queryset, words, object_field, limit):
+    """
+    Returns the IDs (from object_field) of the objects in token_queryset
+    that have a token starting with every one of the given words, ordered by
+    relevance and capped at limit. Tokens that match a word exactly count
+    for more than ones that only match as a prefix.
+    """
+    matches = token_queryset.filter(reduce(operator.or_,
+        [Q(token__startswith=word) for word in words]))
+    annotations = {'relevance': Sum(Case(
+        When(token__in=words, then=Value(2)),
+        default=Value(1),
+        output_field=IntegerField()))}
+    for i, word in enumerate(words):
+        annotations['word%d' % i] = Max(Case(
+            When(token__startswith=word, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()))
+    rows = (matches.values(object_field)
+            .annotate(**annotations)
+            .filter(**dict(('word%d' % i, 1) for i in range(len(words))))
+            .order_by('-relevance', object_field))
+    return [row[object_field] for row in rows[:limit]]
+
+
+def order_by_ids(queryset, ids):
+    """
+    Filters the given queryset to the given primary keys, preserving their
+    order.
+    """
+    if not ids:
+        return queryset.none()
+    order = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(ids)],
+        output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(order)
+
+
+def search_users(queryset, query, limit=None):
+    """
+    Filters the given queryset on the user model to the users whose name or
+    e-mail contain words starting with each of the words in query, ordered
+    by relevance.
+    """
+    limit = limit or settings.DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS
+    words = tokenize(query, UserSearchToken.TOKEN_LENGTH)
+    if not words:
+        return queryset.none()
+    ids = rank_by_tokens(UserSearchToken.objects.all(), words, 'user', limit)
+    return order_by_ids(queryset, ids)
+
+
+def get_trigrams(text, partial=False):
+    """
+    Returns the set of trigrams for the normalized words in the given text.
+    Like PostgreSQL's pg_trgm, each word is padded with two spaces at the
+    start and one at the end, so "cat" => "  c", " ca", "cat", "at ".
+
+    If partial is True, the last word is assumed to be incomplete (i.e. the
+    user is still typing it), so the trigram for its end is left out.
+    """
+    trigrams = set()
+    words = WORD_RE.findall(normalize(text))
+    for i, word in enumerate(words):
+        padded = u'  ' + word
+        if not partial or i < len(words) - 1:
+            padded += u' '
+        trigrams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return trigrams
+
+
+def get_object_trigrams(trigram_model, obj):
+    text = u' '.join(unicode(getattr(obj, field) or u'')
+                     for field in trigram_model.source_fields)
+    return get_trigrams(text)
+
+
+def update_trigrams(trigram_model, obj):
+    """
+    Brings the trigrams in the given SearchTrigram subclass up to date for
+    the given object, only writing to the database if they've changed.
+    """
+    field = trigram_model.object_field
+    trigrams = get_object_trigrams(trigram_model, obj)
+    existing_qs = trigram_model.objects.filter(**{field: obj})
+    existing = set(existing_qs.values_list('trigram', flat=True))
+    if trigrams == existing:
+        return
+    with transaction.atomic():
+        existing_qs.filter(trigram__in=existing - trigrams).delete()
+        trigram_model.objects.bulk_create([
+            trigram_model(trigram=trigram, **{field: obj})
+            for trigram in trigrams - existing
+        ])
+
+
+def update_trigrams_on_save(sender, instance, raw=False, update_fields=None,
+        **kwargs):
+    """
+    post_save receiver that keeps the trigrams for Paper and PaperPresenter
+    objects up to date.
+    """
+    trigram_model = TRIGRAM_MODELS[sender]
+    if raw:
+        return
+    if update_fields is not None and \
+        not set(update_fields) & set(trigram_model.source_fields):
+        return
+    update_trigrams(trigram_model, instance)
+
+
+def rebuild_trigrams(trigram_model, batch_size=1000):
+    """
+    Deletes and recreates all the trigrams in the given SearchTrigram
+    subclass, inserting at most batch_size rows per query. Returns the
+    number of trigrams created.
+    """
+    field = trigram_model.object_field
+    object_model = trigram_model._meta.get_field(field).rel.to
+    num_created = 0
+    with transaction.atomic():
+        trigram_model.objects.all().delete()
+        batch = []
+        objects = (object_model.objects.order_by('pk')
+                   .only(*trigram_model.source_fields))
+        for obj in objects.iterator():
+            batch.extend(
+                trigram_model(trigram=trigram, **{field: obj})
+                for trigram in get_object_trigrams(trigram_model, obj))
+            if len(batch) >= batch_size:
+                trigram_model.objects.bulk_create(batch, batch_size)
+                num_created += len(batch)
+                batch = []
+        trigram_model.objects.bulk_create(batch, batch_size)
+        num_created += len(batch)
+    return num_created
+
+
+def search_trigrams(trigram_model, queryset, query, limit=None,
+        threshold=TRIGRAM_THRESHOLD):
+    """
+    Filters the given queryset to the objects indexed in the given
+    SearchTrigram subclass that are similar to query, ordered by similarity.
+
+    Candidates are found with an indexed lookup on the trigrams in the
+    query, and must share at least the given fraction of them. They're then
+    ranked by the fraction of the query trigrams they share, with ties broken
+    by the overall similarity (shared trigrams divided by the trigrams in
+    both), so closer and shorter matches come first.
+    """
+    limit = limit or settings.DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS
+    query_trigrams = get_trigrams(query, partial=True)
+    if not query_trigrams:
+        return queryset.none()
+    field = trigram_model.object_field
+    min_shared = threshold * len(query_trigrams)
+    candidates = (trigram_model.objects
+                  .filter(trigram__in=query_trigrams)
+                  .values(field)
+                  .annotate(shared=Count('id'))
+                  .filter(shared__gte=min_shared)
+                  .order_by('-shared', field))
+    candidates = candidates[:limit * TRIGRAM_CANDIDATES_PER_RESULT]
+    candidate_ids = [row[field] for row in candidates]
+    if not candidate_ids:
+        return queryset.none()
+
+    ranked = []
+    objects = (queryset.filter(pk__in=candidate_ids)
+               .only(*trigram_model.source_fields))
+    for obj in objects:
+        trigrams = get_object_trigrams(trigram_model, obj)
+        shared = len(query_trigrams & trigrams)
+        score = (float(shared) / len(query_trigrams),
+                 float(shared) / len(query_trigrams | trigrams))
+        ranked.append((score, obj.pk))
+    ranked.sort(key=lambda r: (-r[0][0], -r[0][1], r[1]))
+    return order_by_ids(queryset, [pk for score, pk in ranked[:limit]])
+
+
+def _is_consonant(word, i):
+    if word[i] in u'aeiou':
+        return False
+    if word[i] == u'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(word):
+    """
+    Returns the number of vowel-consonant sequences in the given word
+    (Porter's "m").
+    """
+    m = 0
+    previous_vowel = False
+    for i in range(len(word)):
+        vowel = not _is_consonant(word, i)
+        if previous_vowel and not vowel:
+            m += 1
+        previous_vowel = vowel
+    return m
+
+
+def _has_vowel(word):
+    return any(not _is_consonant(word, i) for i in range(len(word)))
+
+
+def _ends_cvc(word):
+    i = len(word) - 1
+    return (i >= 2 and _is_consonant(word, i) and
+            not _is_consonant(word, i - 1) and _is_consonant(word, i - 2) and
+            word[i] not in u'wxy')
+
+
+def stem(word):
+    """
+    Reduces the given normalized word to its stem with step 1 of the Porter
+    stemming algorithm, which takes care of plurals and -ed/-ing endings,
+    e.g. "histories" => "histori", "studied" => "studi".
+    """
+    if len(word) <= 2:
+        return word
+    # step 1a
+    if word.endswith(u'sses') or word.endswith(u'ies'):
+        word = word[:-2]
+    elif word.endswith(u's') and not word.endswith(u'ss'):
+        word = word[:-1]
+    # step 1b
+    if word.endswith(u'eed'):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in (u'ed', u'ing'):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith((u'at', u'bl', u'iz')):
+                    word += u'e'
+                elif (len(word) > 1 and word[-1] == word[-2] and
+                      _is_consonant(word, len(word) - 1) and
+                      word[-1] not in u'lsz'):
+                    word = word[:-1]
+                elif _measure(word) == 1 and _ends_cvc(word):
+                    word += u'e'
+                break
+    # step 1c
+    if word.endswith(u'y') and _has_vowel(word[:-1]):
+        word = word[:-1] + u'i'
+    return word
+
+
+def get_terms(text):
+    """
+    Returns a Counter mapping the stemmed terms in the given text to the
+    number of times they occur, leaving out stop words.
+    """
+    terms = Counter()
+    for word in WORD_RE.findall(normalize(text)):
+        if word not in STOP_WORDS:
+            terms[stem(word)[:SearchTerm.TERM_LENGTH]] += 1
+    return terms
+
+
+def get_query_terms(query):
+    """Returns the list of distinct stemmed terms in a search query"""
+    terms = []
+    for term in get_terms(query):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def update_terms(term_model, obj):
+    """
+    Brings the full-text index in the given SearchTerm subclass up to date
+    for the given object, only writing to the database if it's changed.
+    """
+    field = term_model.object_field
+    terms = get_terms(term_model.get_text(obj))
+    existing_qs = term_model.objects.filter(**{field: obj})
+    existing = dict(existing_qs.values_list('term', 'frequency'))
+    if terms == existing:
+        return
+    changed = [t for t, freq in existing.items() if terms.get(t) != freq]
+    with transaction.atomic():
+        existing_qs.filter(term__in=changed).delete()
+        term_model.objects.bulk_create([
+            term_model(term=term, frequency=freq, **{field: obj})
+            for term, freq in terms.items()
+            if existing.get(term) != freq
+        ])
+
+
+def update_terms_on_save(sender, instance, raw=False, update_fields=None,
+        **kwargs):
+    """
+    post_save receiver that keeps the full-text index for Paper and Session
+    objects up to date.
+    """
+    term_model = TERM_MODELS[sender]
+    if raw:
+        return
+    if update_fields is not None and \
+        not set(update_fields) & set(term_model.source_fields):
+        return
+    update_terms(term_model, instance)
+
+
+def update_session_terms(session_ids):
+    """
+    Brings the full-text index up to date for the sessions with the given
+    IDs, e.g. after one of their chairs or their submitter has changed.
+    """
+    for session in SessionSearchTerm.get_indexed_objects().filter(
+            pk__in=list(session_ids)):
+        update_terms(SessionSearchTerm, session)
+
+
+def update_session_terms_on_chairs_changed(sender, instance, action, reverse,
+        pk_set, **kwargs):
+    """
+    m2m_changed receiver for Session.chairs that keeps the chair names in
+    the session full-text index up to date.
+    """
+    if action == 'pre_clear' and reverse:
+        # the sessions are gone by the time post_clear is sent
+        instance._cleared_session_ids = list(
+            instance.sessions_chaired.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            update_session_terms([instance.pk])
+        elif action == 'post_clear':
+            update_session_terms(instance._cleared_session_ids)
+        else:
+            update_session_terms(pk_set)
+
+
+def update_session_terms_on_chair_save(sender, instance, raw=False,
+        **kwargs):
+    """
+    post_save receiver for SessionCadre that re-indexes the sessions the
+    saved person chairs.
+    """
+    if raw or kwargs.get('created'):
+        return
+    update_session_terms(instance.sessions_chaired.values_list('pk',
+        flat=True))
+
+
+def update_session_terms_on_chair_delete(sender, instance, **kwargs):
+    """
+    pre_delete receiver for SessionCadre that removes the deleted person from
+    the index of the sessions they chair. Deleting the M2M rows doesn't
+    send m2m_changed, so this clears them first.
+    """
+    instance.sessions_chaired.clear()
+
+
+def update_session_terms_on_user_save(sender, instance, raw=False,
+        **kwargs):
+    """
+    post_save receiver for the user model that re-indexes the sessions
+    submitted by the saved user.
+    """
+    if raw or kwargs.get('created'):
+        return
+    update_session_terms(Session.objects.filter(submitter=instance)
+        .values_list('pk', flat=True))
+
+
+def rebuild_terms(term_model, batch_size=1000):
+    """
+    Deletes and recreates the full-text index in the given SearchTerm
+    subclass, inserting at most batch_size rows per query. Returns the
+    number of rows created.
+    """
+    field = term_model.object_field
+    objects = term_model.get_indexed_objects().order_by('pk')
+    num_created = 0
+    last_pk = None
+    with transaction.atomic():
+        term_model.objects.all().delete()
+        while True:
+            # fetch the objects a page at a time rather than with
+            # iterator(), which would ignore prefetch_related() in
+            # get_indexed_objects(), and by pk rather than with OFFSET,
+            # which gets slower with each page
+            page = objects if last_pk is None else \
+                objects.filter(pk__gt=last_pk)
+            page = list(page[:batch_size])
+            if not page:
+                break
+            batch = [term_model(term=term, frequency=freq, **{field: obj})
+                     for obj in page
+                     for term, freq in get_terms(
+                         term_model.get_text(obj)).items()]
+            term_model.objects.bulk_create(batch, batch_size)
+            num_created += len(batch)
+            last_pk = page[-1].pk
+    return num_created
+
+
+def get_terms_q(term_model, terms):
+    """
+    Returns a Q object matching the objects that have an indexed term
+    starting with each of the given terms. Each term becomes an indexed
+    "pk IN (SELECT ...)" subquery, so no joins or DISTINCT are needed.
+    """
+    field = term_model.object_field
+    return reduce(operator.and_, [
+        Q(pk__in=term_model.objects.filter(term__startswith=term)
+            .values(field))
+        for term in terms
+    ])
+
+
+def filter_by_terms(term_model, queryset, query):
+    """
+    Filters the given queryset to the objects matching every term in the
+    given search query.
+    """
+    terms = get_query_terms(query)
+    if not terms:
+        return queryset
+    return queryset.filter(get_terms_q(term_model, terms))
+
+
+def rank_by_terms(term_model, queryset, terms, limit):
+    """
+    Returns the IDs of the objects in the given queryset that best match the
+    given terms in the index in the given SearchTerm subclass, ranked by
+    TF-IDF and capped at limit. Each term's document frequency is counted
+    among the objects in the queryset that match any of the terms, so the
+    ranking takes two queries and never counts the whole table.
+    """
+    field = term_model.object_field
+    matches = term_model.objects.filter(
+        reduce(operator.or_, [Q(term__startswith=term) for term in terms]),
+        **{field + '__in': queryset.order_by().values('pk')})
+    counts = matches.aggregate(num_objects=Count(field, distinct=True),
+        **dict(('term%d' % i, Count(Case(When(term__startswith=term,
+                                              then=F(field))),
+                                    distinct=True))
+               for i, term in enumerate(terms)))
+    weights = []
+    for i, term in enumerate(terms):
+        num_matching = counts['term%d' % i]
+        if not num_matching:
+            return []
+        idf = math.log(1 + float(counts['num_objects']) / num_matching)
+        weights.append(When(term__startswith=term,
+            then=F('frequency') * Value(idf)))
+    rows = (matches.values(field)
+            .annotate(score=Sum(Case(*weights, default=Value(0),
+                output_field=FloatField())))
+            .order_by('-score', field))
+    return [row[field] for row in rows[:limit]]
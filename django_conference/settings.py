@@ -45,6 +45,134 @@ DJANGO_CONFERENCE_USER_AUTOCOMPLETE_FILTER = getattr(settings,
     ).filter(full_name__icontains=query))
 
 
+"""
+If set to True, an index of the normalized words in the names and e-mail
+addresses of users is kept up to date whenever a user is saved, and
+UserAutocomplete uses it for indexed prefix lookups instead of
+DJANGO_CONFERENCE_USER_AUTOCOMPLETE_FILTER. Run the
+"rebuild_user_search_index" management command after enabling this.
+"""
+DJANGO_CONFERENCE_USER_SEARCH_INDEX = getattr(settings,
+    'DJANGO_CONFERENCE_USER_SEARCH_INDEX',
+    False)
+
+
+"""
+Maximum number of results returned by autocomplete views that search an
+index.
+"""
+DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS = getattr(settings,
+    'DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS',
+    50)
+
+
+"""
+Maximum number of responses the autocomplete views keep in their in-process
+LRU cache. Set to 0 to disable the cache. The hit ratio for each view can be
+checked at the "autocomplete-cache-stats" URL.
+"""
+DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE = getattr(settings,
+    'DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE',
+    1000)
+
+
+"""
+Number of seconds responses are kept in the autocomplete cache. Saving a
+paper, presenter or user clears the affected entries in the process that
+saved it, so this bounds how stale results can be in other processes.
+"""
+DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_TTL = getattr(settings,
+    'DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_TTL',
+    60)
+
+
+"""
+Row count above which admin changelists using EstimatedCountMixin show the
+database's estimate of the number of rows instead of running COUNT(*).
+Estimates are available on PostgreSQL and, for unfiltered lists, MySQL.
+Set to None to always count exactly.
+"""
+DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD = getattr(settings,
+    'DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD',
+    100000)
+
+
+"""
+Number of seconds exact row counts and date hierarchy buckets are cached for
+by admin changelists using EstimatedCountMixin.
+"""
+DJANGO_CONFERENCE_ADMIN_COUNT_CACHE_TTL = getattr(settings,
+    'DJANGO_CONFERENCE_ADMIN_COUNT_CACHE_TTL',
+    30)
+
+
+"""
+If set to True, the confirmation e-mails for registrations and paper and
+session submissions are saved to an outbox table in the same transaction as
+what they confirm, instead of being sent while the visitor waits. Run the
+"send_queued_email" management command (e.g. with --loop, or from cron) to
+deliver them.
+"""
+DJANGO_CONFERENCE_EMAIL_OUTBOX = getattr(settings,
+    'DJANGO_CONFERENCE_EMAIL_OUTBOX',
+    False)
+
+
+"""
+Maximum number of queued e-mails sent over one SMTP connection by each run
+of the "send_queued_email" management command.
+"""
+DJANGO_CONFERENCE_EMAIL_BATCH_SIZE = getattr(settings,
+    'DJANGO_CONFERENCE_EMAIL_BATCH_SIZE',
+    100)
+
+
+"""
+Number of times to try sending a queued e-mail before marking it as failed.
+The delay between tries starts at DJANGO_CONFERENCE_EMAIL_RETRY_DELAY seconds
+and doubles after each one.
+"""
+DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS = getattr(settings,
+    'DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS',
+    5)
+
+DJANGO_CONFERENCE_EMAIL_RETRY_DELAY = getattr(settings,
+    'DJANGO_CONFERENCE_EMAIL_RETRY_DELAY',
+    60)
+
+
+"""
+Number of announcement recipients the "send_announcement" management command
+claims and records as sent at a time. If the command is interrupted, at most
+this many recipients can get the announcement twice when it's run again after
+DJANGO_CONFERENCE_ANNOUNCEMENT_CLAIM_TIMEOUT.
+"""
+DJANGO_CONFERENCE_ANNOUNCEMENT_BATCH_SIZE = getattr(settings,
+    'DJANGO_CONFERENCE_ANNOUNCEMENT_BATCH_SIZE',
+    100)
+
+
+"""
+Maximum number of announcement e-mails to send per second, to stay within
+the mail server's limits. Set to None for no limit.
+"""
+DJANGO_CONFERENCE_ANNOUNCEMENT_MAX_PER_SECOND = getattr(settings,
+    'DJANGO_CONFERENCE_ANNOUNCEMENT_MAX_PER_SECOND',
+    50)
+
+
+"""
+Number of seconds after which a batch of announcement recipients claimed by
+a run of the "send_announcement" management command that hasn't recorded
+them as sent is assumed to have been abandoned (e.g. because the run
+crashed), so another run can send to them. Should be longer than it takes to
+send a batch.
+"""
+DJANGO_CONFERENCE_ANNOUNCEMENT_CLAIM_TIMEOUT = getattr(settings,
+    'DJANGO_CONFERENCE_ANNOUNCEMENT_CLAIM_TIMEOUT',
+    3600)
+
+
 """
 List of tuples to pass to Migration.depedencies for django_conference
 migrations.
@@ -79,6 +207,120 @@ DJANGO_CONFERENCE_STRIPE_SECRET_KEY = getattr(settings,
     '')
 
 
+"""
+Dotted path to the payment gateway class used to charge cards. The default
+charges them through Stripe. django_conference.payments.FakeGateway charges
+nothing, and is meant for tests and benchmarks.
+"""
+DJANGO_CONFERENCE_PAYMENT_GATEWAY = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_GATEWAY',
+    'django_conference.payments.StripeGateway')
+
+
+"""
+Seconds to wait for the payment gateway to accept a connection and to send
+a response. The Stripe gateway needs the "requests" library installed for
+these to take effect.
+"""
+DJANGO_CONFERENCE_PAYMENT_CONNECT_TIMEOUT = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_CONNECT_TIMEOUT',
+    3.05)
+
+DJANGO_CONFERENCE_PAYMENT_READ_TIMEOUT = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_READ_TIMEOUT',
+    10)
+
+
+"""
+Number of times to retry a charge when the payment gateway can't be reached
+or reports a temporary error. Retries wait a random time of up to
+DJANGO_CONFERENCE_PAYMENT_RETRY_BACKOFF seconds, doubling with each retry.
+Every try uses the same idempotency key, so a charge is never made twice.
+"""
+DJANGO_CONFERENCE_PAYMENT_MAX_RETRIES = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_MAX_RETRIES',
+    2)
+
+DJANGO_CONFERENCE_PAYMENT_RETRY_BACKOFF = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_RETRY_BACKOFF',
+    0.5)
+
+
+"""
+After this many tries in a row fail because the payment gateway can't be
+reached, charges fail immediately for DJANGO_CONFERENCE_PAYMENT_CIRCUIT_RESET
+seconds instead of tying up workers. The count is kept in the cache, so it's
+shared by all processes using the same cache.
+"""
+DJANGO_CONFERENCE_PAYMENT_CIRCUIT_THRESHOLD = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_CIRCUIT_THRESHOLD',
+    5)
+
+DJANGO_CONFERENCE_PAYMENT_CIRCUIT_RESET = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_CIRCUIT_RESET',
+    30)
+
+
+"""
+If True, the payment page only authorizes the card, after saving the
+registration with a pending payment. The process_payments management command
+then captures the payment and sends the confirmation e-mail in the
+background, so a slow payment gateway doesn't hold up registration. It also
+processes the events the gateway sends to the payment webhook. Ignored if
+DJANGO_CONFERENCE_DISABLE_PAYMENT_PROCESSING is set.
+"""
+DJANGO_CONFERENCE_TWO_PHASE_PAYMENT = getattr(settings,
+    'DJANGO_CONFERENCE_TWO_PHASE_PAYMENT',
+    False)
+
+
+"""
+Number of payments to capture, and of webhook events to process, at a time
+in the process_payments management command.
+"""
+DJANGO_CONFERENCE_PAYMENT_BATCH_SIZE = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_BATCH_SIZE',
+    50)
+
+
+"""
+Number of times process_payments tries to capture a payment while the
+payment gateway is unavailable before marking it as failed, and the number
+of seconds it waits before the first retry. The wait doubles with each
+retry.
+"""
+DJANGO_CONFERENCE_PAYMENT_CAPTURE_MAX_ATTEMPTS = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_CAPTURE_MAX_ATTEMPTS',
+    5)
+
+DJANGO_CONFERENCE_PAYMENT_CAPTURE_RETRY_DELAY = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_CAPTURE_RETRY_DELAY',
+    60)
+
+
+"""
+Number of seconds after which a two-phase payment that is still pending is
+assumed to have been interrupted while the card was being authorized, e.g.
+by the process dying. The card may or may not have been authorized, so these
+payments need to be checked at the payment gateway. They're listed under
+"Needs attention" in the admin's list of card payments and reported by the
+process_payments management command.
+"""
+DJANGO_CONFERENCE_PAYMENT_PENDING_TIMEOUT = getattr(settings,
+    'DJANGO_CONFERENCE_PAYMENT_PENDING_TIMEOUT',
+    600)
+
+
+"""
+Signing secret of the Stripe webhook endpoint, used to check that the events
+sent to the payment webhook came from Stripe. The webhook rejects all events
+if this isn't set.
+"""
+DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET = getattr(settings,
+    'DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET',
+    None)
+
+
 """
 List of additional admin tasks. Each item in the list can must be a tuple of
 the following form: ("description", view_func)
@@ -1,4 +1,5 @@
 from django.template.defaultfilters import stringfilter
+from django.utils.lru_cache import lru_cache
 from django import template
 
 import textwrap
@@ -16,27 +17,46 @@ def columnize(textblock, width):
 col1: foo
 a really long term: bar
 l: baz
-    
+
     Output of columnize:10
 col1:       foo
 
-a really  
+a really
 long term:  bar
 
 l:          baz
     """
     lines = unicode(textblock).split("\n")
-    return columnize_helper(lines, width)
+    return columnize_helper(lines, int(width))
 
 def columnize_helper(lines, width):
-    out = ""
+    return u"".join(iter_columnize(lines, width))
+
+def iter_columnize(lines, width):
+    """
+    Generator that yields the formatted output of columnize for each line,
+    so the output can be joined together once instead of being built up by
+    repeated concatenation.
+    """
     for line in lines:
         if ":" in line:
             label, value = line.split(':', 1)
-            label_lines = textwrap.wrap(label, width)
-            label_lines[-1] += ':'
-            out += columnize_helper(label_lines[:-1], width)
-            out += "%s %s\n\n" % (label_lines[-1].ljust(width), value)
+            yield u"%s %s\n\n" % (wrap_label(label, width), value)
         else:
-            out += line.ljust(width) + "\n"
-    return out
+            yield line.ljust(width) + u"\n"
+
+@lru_cache(maxsize=16)
+def get_wrapper(width):
+    """Returns a TextWrapper for the given width that can be reused"""
+    return textwrap.TextWrapper(width)
+
+@lru_cache(maxsize=1024)
+def wrap_label(label, width):
+    """
+    Returns the given label wrapped to the given width, with a colon added
+    to the end and every line padded to the width. Labels are usually the
+    same handful of strings (e.g. "Title", "Abstract"), so this is memoized.
+    """
+    label_lines = get_wrapper(width).wrap(label) or [u""]
+    label_lines[-1] += ':'
+    return u"\n".join(l.ljust(width) for l in label_lines)
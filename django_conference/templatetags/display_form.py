@@ -18,33 +18,81 @@ def display_form(parser, token):
 class FormFieldNode(template.Node):
     """
     Does all HTML outputting for the form.
+
+    The markup surrounding each field (container, label and help text) only
+    depends on how the form's fields are configured, not on the submitted
+    data, so it's built once and cached in FormFieldNode.shell_cache. Only
+    the widgets and errors are rendered for every request.
     """
+    # Maps the result of get_shell_key() to a list of (head, tail) tuples,
+    # one for each field in the form.
+    shell_cache = {}
+    # Number of entries allowed in shell_cache before it's cleared. Forms
+    # built from meeting-specific data (e.g. MeetingExtras) get a new entry
+    # each time the meeting is changed.
+    max_cache_size = 100
+    error_template_name = 'django_conference/errors.html'
+
     def __init__(self, form_name):
-        self.form_name = form_name
+        self.form = template.Variable(form_name)
+        self.error_template = None
 
     def render(self, context):
-        form = template.Variable(self.form_name).resolve(context)
-        output = u'<div class="form-row">'
+        form = self.form.resolve(context)
+        output = [u'<div class="form-row">']
         if form.errors:
-            #convert keys to human-readable form,
-            #e.g. "first_name" => "First Name"
-            errors = map(lambda x: (x[0].replace("_", " ").title(), x[1]),
-                         form.errors.items())
-            error_template = 'django_conference/errors.html'
-            output += template.loader.render_to_string(error_template, {
-                'error_dict': errors,
-            })
-        for field in form:
-            output += u"""
+            output.append(self.render_errors(form))
+        for field, (head, tail) in zip(form, self.get_shell(form)):
+            output.extend([head, unicode(field), tail])
+        output.append(u"</div>")
+        return u''.join(output)
+
+    def render_errors(self, form):
+        if self.error_template is None:
+            self.error_template = template.loader.get_template(
+                self.error_template_name)
+        #convert keys to human-readable form,
+        #e.g. "first_name" => "First Name"
+        errors = [(name.replace("_", " ").title(), error_list)
+                  for name, error_list in form.errors.items()]
+        return self.error_template.render({'error_dict': errors})
+
+    def get_shell(self, form):
+        key = self.get_shell_key(form)
+        shell = self.shell_cache.get(key)
+        if shell is None:
+            if len(self.shell_cache) >= self.max_cache_size:
+                self.shell_cache.clear()
+            shell = [self.build_field_shell(field) for field in form]
+            self.shell_cache[key] = shell
+        return shell
+
+    def get_shell_key(self, form):
+        """
+        Returns a hashable key identifying everything that goes into the
+        markup built by build_field_shell() for the given form.
+        """
+        fields = tuple((name, field.label, field.required, field.help_text,
+                        field.label_suffix, field.widget.__class__,
+                        field.widget.attrs.get('id'))
+                       for name, field in form.fields.items())
+        return (form.__class__, form.prefix, form.auto_id, form.label_suffix,
+                fields)
+
+    def build_field_shell(self, field):
+        """
+        Returns a tuple of the markup that should precede and follow the
+        widget for the given BoundField.
+        """
+        head = u"""
                 <div class='container container_%s' id='%s_container'>""" % (
                     field.name, field.auto_id)
-            if field.field.required:
-                output += u"<b>%s</b>" % field.label_tag(field.label)
-            else:
-                output += field.label_tag(field.label)
-            output += unicode(field)
-            if field.help_text:
-                output += u"<p class='help_text'>%s</p>" % field.help_text
-            output += u"</div>\n"
-        output += u"</div>"
-        return output
+        if field.field.required:
+            head += u"<b>%s</b>" % field.label_tag(field.label)
+        else:
+            head += field.label_tag(field.label)
+        tail = u""
+        if field.help_text:
+            tail += u"<p class='help_text'>%s</p>" % field.help_text
+        tail += u"</div>\n"
+        return (head, tail)
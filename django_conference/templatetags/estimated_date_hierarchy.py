@@ -0,0 +1,96 @@
+import datetime
+
+from django import template
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import ugettext as _
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def estimated_date_hierarchy(cl):
+    """
+    Replacement for the admin's date_hierarchy tag for use with
+    EstimatedCountChangeList. Rather than running a query for the date range
+    and another for each level of links, every level is built from the
+    cached list of distinct days returned by cl.get_date_buckets().
+    """
+    if not cl.date_hierarchy:
+        return
+    field_name = cl.date_hierarchy
+    year_field = '%s__year' % field_name
+    month_field = '%s__month' % field_name
+    day_field = '%s__day' % field_name
+    field_generic = '%s__' % field_name
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    day_lookup = cl.params.get(day_field)
+
+    link = lambda filters: cl.get_query_string(filters, [field_generic])
+    days = cl.get_date_buckets()
+
+    if not (year_lookup or month_lookup or day_lookup) and days:
+        # select appropriate start level
+        if days[0].year == days[-1].year:
+            year_lookup = days[0].year
+            if days[0].month == days[-1].month:
+                month_lookup = days[0].month
+
+    if year_lookup and month_lookup and day_lookup:
+        day = datetime.date(int(year_lookup), int(month_lookup),
+            int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup,
+                    month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day,
+                    'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{
+                'title': capfirst(formats.date_format(day,
+                    'MONTH_DAY_FORMAT')),
+            }],
+        }
+    elif year_lookup and month_lookup:
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup}),
+                'title': str(year_lookup),
+            },
+            'choices': [{
+                'link': link({year_field: year_lookup,
+                    month_field: month_lookup, day_field: day.day}),
+                'title': capfirst(formats.date_format(day,
+                    'MONTH_DAY_FORMAT')),
+            } for day in days
+              if day.year == int(year_lookup) and
+                 day.month == int(month_lookup)],
+        }
+    elif year_lookup:
+        months = sorted(set(datetime.date(day.year, day.month, 1)
+                            for day in days if day.year == int(year_lookup)))
+        return {
+            'show': True,
+            'back': {
+                'link': link({}),
+                'title': _('All dates'),
+            },
+            'choices': [{
+                'link': link({year_field: year_lookup,
+                    month_field: month.month}),
+                'title': capfirst(formats.date_format(month,
+                    'YEAR_MONTH_FORMAT')),
+            } for month in months],
+        }
+    else:
+        years = sorted(set(day.year for day in days))
+        return {
+            'show': True,
+            'choices': [{
+                'link': link({year_field: str(year)}),
+                'title': str(year),
+            } for year in years],
+        }
@@ -4,29 +4,56 @@ from django import template
 
 register = template.Library()
 
+
+TWO_PLACES = Decimal('0.01')
+
+
+def _format_decimal(value):
+    text = str(value)
+    # Values from DecimalFields with decimal_places=2 already end in ".XX",
+    # so only quantize when necessary since it's relatively expensive
+    if text[-3:-2] != '.':
+        text = str(value.quantize(TWO_PLACES))
+    sign = u''
+    if text[0] == '-':
+        text = text[1:]
+        if text != '0.00':
+            sign = u'-'
+    return u'%s$%s%s' % (sign, u'{:,}'.format(int(text[:-3])), text[-3:])
+
+
+def _format_int(value):
+    if value < 0:
+        return u'-${:,}.00'.format(-value)
+    return u'${:,}.00'.format(value)
+
+
+def _format_float(value):
+    # go through str() so the rounding matches the value that's displayed
+    # for the float, e.g. 2.675 => $2.68 instead of $2.67
+    return _format_decimal(Decimal(str(value)))
+
+
+def _format_other(value):
+    return _format_decimal(Decimal(str(value)))
+
+
+# Maps input types to the function that formats them
+FORMATTERS = {
+    Decimal: _format_decimal,
+    int: _format_int,
+    long: _format_int,
+    float: _format_float,
+}
+
+
 @register.filter
 def money_format(value):
     """
-    Display float in money-style format with specified decimal places and
-    comma-grouped thousands.
-    Adapted from https://docs.python.org/2/library/decimal.html#recipes
+    Display number in money-style format with two decimal places and
+    comma-grouped thousands, e.g. 1234.5 => "$1,234.50" and -5 => "-$5.00".
+    Accepts Decimals, ints, floats, and anything else that can be converted
+    to a Decimal via str().
     """
-    q = Decimal(10) ** -2      # 2 places --> '0.01'
-    _, digits, exp = Decimal(str(value)).quantize(q).as_tuple()
-    result = []
-    digits = map(str, digits)
-    build, next = result.append, digits.pop
-    for i in range(2):
-        build(next() if digits else '0')
-    build('.')
-    if not digits:
-        build('0')
-    i = 0
-    while digits:
-        build(next())
-        i += 1
-        if i == 3 and digits:
-            i = 0
-            build(',')
-    build('$')
-    return ''.join(reversed(result))
+    return FORMATTERS.get(type(value), _format_other)(value)
+
@@ -1,37 +1,58 @@
 from django import template
 
-from django_conference.models import DonationType, RegistrationDonation
+from django_conference.models import DonationType
 
 register = template.Library()
 
 
-@register.tag()
-def num_donated(registration, donate_type_name):
+def get_donation_type_names(context):
+    """
+    Returns the set of valid DonationType names. The names are looked up once
+    per template render and cached in the render context, so using the
+    donation tags in a loop over many registrations only costs one query.
+    """
+    cache = context.render_context
+    if 'donation_type_names' not in cache:
+        cache['donation_type_names'] = set(
+            DonationType.objects.values_list('name', flat=True))
+    return cache['donation_type_names']
+
+
+def get_donation_totals(registration):
+    """
+    Returns a dictionary mapping DonationType names to the total amount that
+    the given registration donated for that type. Only reads from
+    registration.regdonations.all(), so no queries are made if the
+    registration was fetched with prefetch_related('regdonations__donate_type')
+    """
+    totals = {}
+    for regdonation in registration.regdonations.all():
+        # MeetingDonation.donate_type is keyed on DonationType.name
+        name = regdonation.donate_type.donate_type_id
+        totals[name] = totals.get(name, 0) + regdonation.total
+    return totals
+
+
+@register.simple_tag(takes_context=True)
+def num_donated(context, registration, donate_type_name):
     """
     Helper tag that returns the amount that the given registration donated
     to a given cause. First argument must be the registration, second must be
     the name of the donation type.
     """
-    try:
-        donate_type = DonationType.objects.get(name = donate_type_name)
-    except DonationType.DoesNotExist:
+    if donate_type_name not in get_donation_type_names(context):
         err = 'num_donated received invalid donation type'
         raise template.TemplateSyntaxError(err)
-    try:
-        regdonation = registration.regdonations.get(
-            donate_type__donate_type = donate_type)
-        return regdonation.quantity
-    except RegistrationDonation.DoesNotExist:
-        return 0
+    return get_donation_totals(registration).get(donate_type_name, 0)
 
 
-@register.simple_tag
-def has_donated(registration, donate_type_name):
+@register.simple_tag(takes_context=True)
+def has_donated(context, registration, donate_type_name):
     """
     Same as num_donated, except it returns "Yes" if given registration donated
     more than $0 for the given donation type, else returns "No"
     """
-    num = num_donated(registration, donate_type_name) 
+    num = num_donated(context, registration, donate_type_name)
     if num > 0:
         return "Yes"
     return "No"
@@ -0,0 +1,338 @@
+from datetime import datetime
+
+from django.apps import apps
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from django_conference import pagination, settings
+from django_conference.models import *
+from django_conference.templatetags.estimated_date_hierarchy import \
+    estimated_date_hierarchy
+from django_conference.tests.test_views import BaseTestCase
+
+
+class AdminTestCase(BaseTestCase):
+    "Base class for admin tests"
+    def setUp(self):
+        super(AdminTestCase, self).setUp()
+        superuser = self.create_user("admin@bar.com")
+        superuser.is_staff = True
+        superuser.is_superuser = True
+        superuser.save()
+        self.login(superuser)
+        self.meeting = self.create_active_meeting()
+        cache.clear()
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class SessionAdminTestCase(AdminTestCase):
+    "Tests the Session changelist"
+    url = '/admin/django_conference/session/'
+
+    def setUp(self):
+        super(SessionAdminTestCase, self).setUp()
+        self.option = self.create_registration_option(self.meeting, 'OPT', 0)
+        self.num_sessions = 0
+
+    def create_sessions(self, num_sessions):
+        for i in range(self.num_sessions, self.num_sessions + num_sessions):
+            session = Session.objects.create(meeting=self.meeting,
+                title="SESSION %d" % i,
+                submitter=self.create_user("submitter%d@bar.com" % i))
+            session.chairs.add(SessionCadre.objects.create(first_name="CHAIR",
+                last_name=str(i), email="foo@bar.com", institution="UF"))
+            for j in range(i % 3):
+                registration = Registration(meeting=self.meeting,
+                    type=self.option,
+                    registrant=self.create_user("user%d.%d@bar.com" % (i, j)),
+                    entered_by=self.create_user("by%d.%d@bar.com" % (i, j)))
+                registration.save()
+                registration.sessions.add(session)
+        self.num_sessions += num_sessions
+
+    def test_query_count_independent_of_page_size(self):
+        self.create_sessions(2)
+        num_queries = self.count_queries(self.url)
+        self.create_sessions(20)
+        self.assertEqual(self.count_queries(self.url), num_queries)
+
+    def test_accept_and_reject_actions(self):
+        self.create_sessions(2)
+        paper = Paper.objects.create(title="PAPER", abstract="ABSTRACT",
+            presenter=PaperPresenter.objects.create(first_name="FIRST",
+                last_name="LAST", email="foo@bar.com"))
+        session = Session.objects.get(title="SESSION 0")
+        SessionPapers.objects.create(session=session, paper=paper, position=1)
+        for action, accepted in [('accept_sessions', True),
+                                 ('reject_sessions', False)]:
+            response = self.client.post(self.url, {'action': action,
+                '_selected_action': [session.pk]}, follow=True)
+            self.assertEqual(Session.objects.get(pk=session.pk).accepted,
+                accepted)
+            self.assertEqual(Paper.objects.get().accepted, accepted)
+            self.assertEqual(
+                [unicode(m) for m in response.context['messages']],
+                ["%s 1 session(s) and their papers." %
+                 ("Accepted" if accepted else "Rejected")])
+
+    def test_attendance_column(self):
+        self.create_sessions(3)
+        # columns are 1-indexed, with "attendance" as the sixth
+        response = self.client.get(self.url, {'o': '-6.1'})
+        results = response.context['cl'].result_list
+        self.assertEqual([(s.title, s.attendance) for s in results],
+            [("SESSION 2", 2), ("SESSION 1", 1), ("SESSION 0", 0)])
+
+    def test_attendance_counted_for_displayed_page_only(self):
+        self.create_sessions(3)
+        table = connection.ops.quote_name(
+            Registration.sessions.through._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        results = response.context['cl'].result_list
+        self.assertEqual([(s.title, s.attendance) for s in results],
+            [("SESSION 0", 0), ("SESSION 1", 1), ("SESSION 2", 2)])
+        joins = [q['sql'] for q in queries if table in q['sql']]
+        self.assertEqual(len(joins), 1)
+        self.assertIn(' IN (', joins[0])
+
+
+class MeetingAdminTestCase(AdminTestCase):
+    "Tests the clone action of the Meeting changelist"
+    url = '/admin/django_conference/meeting/'
+
+    def test_clone_action(self):
+        self.create_registration_option(self.meeting, 'OPT', 100)
+        data = {'action': 'clone_meetings',
+                '_selected_action': [self.meeting.pk]}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, "Days to move dates forward")
+        self.assertEqual(Meeting.objects.count(), 1)
+
+        data.update(days=7, price_percent=-50, location="", apply="Clone")
+        response = self.client.post(self.url, data, follow=True)
+        self.assertEqual([unicode(m) for m in response.context['messages']],
+            ["Cloned 1 meeting(s). The copies are inactive."])
+        clone = Meeting.objects.exclude(pk=self.meeting.pk).get()
+        self.assertEqual(clone.location, self.meeting.location)
+        self.assertEqual((clone.start_date - self.meeting.start_date).days, 7)
+        self.assertEqual(clone.regoptions.get().regular_price, 50)
+
+    def test_clone_action_rejects_prices_too_large(self):
+        self.create_registration_option(self.meeting, 'OPT', 600)
+        response = self.client.post(self.url, {'action': 'clone_meetings',
+            '_selected_action': [self.meeting.pk], 'days': 7,
+            'price_percent': 100, 'location': "", 'apply': "Clone"})
+        self.assertFormError(response, 'form', 'price_percent',
+            "This would raise the early price of registration options to "
+            "1200.00, but it must be less than 1000.")
+        self.assertEqual(Meeting.objects.count(), 1)
+
+
+class RegistrationAdminTestCase(AdminTestCase):
+    "Tests the bulk payment actions of the Registration changelist"
+    url = '/admin/django_conference/registration/'
+
+    def setUp(self):
+        super(RegistrationAdminTestCase, self).setUp()
+        option = self.create_registration_option(self.meeting, 'OPT', 0)
+        entered_by = self.create_user("by@bar.com")
+        self.registrations = [
+            Registration.objects.create(meeting=self.meeting, type=option,
+                payment_type="ch", entered_by=entered_by,
+                registrant=self.create_user("user%d@bar.com" % i))
+            for i in range(3)
+        ]
+
+    def do_action(self, action, registrations):
+        response = self.client.post(self.url, {'action': action,
+            '_selected_action': [r.pk for r in registrations]}, follow=True)
+        return [unicode(m) for m in response.context['messages']]
+
+    def test_set_payment_type_action(self):
+        self.assertEqual(
+            self.do_action('set_payment_type_mo', self.registrations[:2]),
+            ["Changed the payment type of 2 registration(s)."])
+        self.assertEqual(
+            list(Registration.objects.order_by('pk')
+                 .values_list('payment_type', flat=True)),
+            ["mo", "mo", "ch"])
+        self.assertEqual(RegistrationPaymentChange.objects.filter(
+            changed_by__username="admin@bar.com").count(), 2)
+
+    def test_payment_actions(self):
+        self.assertEqual(self.do_action('record_payment', self.registrations),
+            ["Recorded payment for 3 registration(s)."])
+        self.assertFalse(Registration.objects.filter(
+            payment_received__isnull=True).exists())
+        self.assertEqual(
+            self.do_action('clear_payment', self.registrations[:1]),
+            ["Cleared payment for 1 registration(s)."])
+        self.assertEqual(
+            self.registrations[0].payment_changes.count(), 2)
+        # the history is shown on the change page
+        response = self.client.get('%s%d/' % (self.url,
+            self.registrations[0].pk))
+        self.assertContains(response, "Registration payment changes")
+
+
+class ChangelistQueryBudgetTestCase(AdminTestCase):
+    """
+    Checks that the changelists run a fixed number of queries, no matter how
+    many rows are displayed on a page
+    """
+    page_sizes = [100, 1000]
+
+    def create_users(self, prefix, num_users):
+        user_model = apps.get_model(settings.DJANGO_CONFERENCE_USER_MODEL)
+        usernames = ["%s%d@bar.com" % (prefix, i) for i in range(num_users)]
+        user_model.objects.bulk_create([
+            user_model(username=username, email=username,
+                first_name="FIRST", last_name=username)
+            for username in usernames
+        ])
+        return list(user_model.objects.filter(username__in=usernames)
+                    .order_by('pk'))
+
+    def create_registrations(self, num_rows):
+        option = self.create_registration_option(self.meeting, 'OPT', 0)
+        entered_by = self.create_user("OnlineRegistration")
+        Registration.objects.bulk_create([
+            Registration(meeting=self.meeting, type=option, registrant=user,
+                entered_by=entered_by, date_entered=datetime.now())
+            for user in self.create_users("registrant", num_rows)
+        ])
+
+    def create_papers(self, num_rows):
+        presenter = PaperPresenter.objects.create(first_name="FIRST",
+            last_name="LAST", email="foo@bar.com")
+        Paper.objects.bulk_create([
+            Paper(title="PAPER %d" % i, abstract="ABSTRACT", submitter=user,
+                presenter=presenter)
+            for i, user in enumerate(self.create_users("submitter", num_rows))
+        ])
+
+    def create_sessions(self, num_rows):
+        Session.objects.bulk_create([
+            Session(title="SESSION %d" % i, submitter=user,
+                meeting=self.meeting)
+            for i, user in enumerate(self.create_users("submitter", num_rows))
+        ])
+        chair = SessionCadre.objects.create(first_name="FIRST",
+            last_name="LAST", email="foo@bar.com", institution="UF")
+        Session.chairs.through.objects.bulk_create([
+            Session.chairs.through(session_id=pk, sessioncadre=chair)
+            for pk in Session.objects.values_list('pk', flat=True)
+        ])
+
+    def assertQueryBudget(self, model, create_rows, budget):
+        """
+        Asserts that the changelist for the given model runs at most "budget"
+        queries for each page size in self.page_sizes. "create_rows" is
+        called with the number of rows to create.
+        """
+        model_admin = admin.site._registry[model]
+        url = '/admin/django_conference/%s/' % model._meta.model_name
+        old_list_per_page = model_admin.list_per_page
+        try:
+            create_rows(max(self.page_sizes))
+            for page_size in self.page_sizes:
+                model_admin.list_per_page = page_size
+                num_queries = self.count_queries(url)
+                self.assertTrue(num_queries <= budget,
+                    "%d queries for %d %s rows, expected at most %d" % (
+                    num_queries, page_size, model.__name__, budget))
+        finally:
+            model_admin.list_per_page = old_list_per_page
+
+    def test_registration_changelist(self):
+        self.assertQueryBudget(Registration, self.create_registrations, 6)
+
+    def test_paper_changelist(self):
+        self.assertQueryBudget(Paper, self.create_papers, 6)
+
+    def test_session_changelist(self):
+        # one more than the others to count the attendance of the page
+        self.assertQueryBudget(Session, self.create_sessions, 7)
+
+
+class EstimatedCountTestCase(AdminTestCase):
+    "Tests the changelists of ModelAdmins using EstimatedCountMixin"
+    url = '/admin/django_conference/registration/'
+
+    def setUp(self):
+        super(EstimatedCountTestCase, self).setUp()
+        option = self.create_registration_option(self.meeting, 'OPT', 0)
+        entered_by = self.create_user("OnlineRegistration")
+        for i, date_entered in enumerate([
+            datetime(2010, 1, 5), datetime(2010, 1, 20), datetime(2010, 3, 1),
+            datetime(2011, 6, 1),
+        ]):
+            registration = Registration.objects.create(meeting=self.meeting,
+                type=option, registrant=self.create_user("user%d@bar.com" % i),
+                entered_by=entered_by)
+            # save() always sets date_entered to the current time
+            Registration.objects.filter(pk=registration.pk).update(
+                date_entered=date_entered)
+        self.old_estimate_count = pagination.estimate_count
+        self.old_THRESHOLD = \
+            settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD
+
+    def tearDown(self):
+        super(EstimatedCountTestCase, self).tearDown()
+        pagination.estimate_count = self.old_estimate_count
+        settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD = \
+            self.old_THRESHOLD
+
+    def get_choices(self, params=None):
+        response = self.client.get(self.url, params or {})
+        hierarchy = estimated_date_hierarchy(response.context['cl'])
+        return [choice['title'] for choice in hierarchy['choices']]
+
+    def test_counts_and_dates_cached(self):
+        num_queries = self.count_queries(self.url)
+        # the count and date hierarchy queries aren't repeated
+        self.assertEqual(self.count_queries(self.url), num_queries - 2)
+
+    def test_date_hierarchy(self):
+        self.assertEqual(self.get_choices(), ["2010", "2011"])
+        self.assertEqual(self.get_choices({'date_entered__year': '2010'}),
+            ["January 2010", "March 2010"])
+        self.assertEqual(self.get_choices({'date_entered__year': '2010',
+            'date_entered__month': '1'}), ["January 5", "January 20"])
+
+    def test_date_hierarchy_counts(self):
+        # drilling down filters the list, so the unfiltered count comes
+        # from the root queryset the changelist swaps out
+        response = self.client.get(self.url, {'date_entered__year': '2010'})
+        cl = response.context['cl']
+        self.assertEqual((cl.result_count, cl.full_result_count), (3, 4))
+        self.assertEqual(len(cl.result_list), 3)
+        self.assertEqual(cl.root_queryset.count(), 4)
+
+        pagination.estimate_count = lambda queryset: 1000
+        settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD = 500
+        response = self.client.get(self.url, {'date_entered__year': '2010'})
+        self.assertEqual(response.context['cl'].full_result_count, 1000)
+
+    def test_estimated_count(self):
+        pagination.estimate_count = lambda queryset: 1000
+        settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD = 500
+        response = self.client.get(self.url)
+        cl = response.context['cl']
+        self.assertEqual((cl.result_count, cl.full_result_count),
+            (1000, 1000))
+        self.assertEqual(len(cl.result_list), 4)
+        self.assertContains(response, "number of results is an estimate")
+
+        settings.DJANGO_CONFERENCE_ADMIN_COUNT_ESTIMATE_THRESHOLD = 2000
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 4)
+        self.assertNotContains(response, "number of results is an estimate")
@@ -0,0 +1,135 @@
+from StringIO import StringIO
+
+from django.core import mail as django_mail
+from django.core.management import call_command
+
+from django_conference import announcements
+from django_conference.models import *
+from django_conference.tests.test_views import BaseTestCase, FlakyBackend
+
+
+class AnnouncementTestCase(BaseTestCase):
+    "Tests sending announcements"
+    def setUp(self):
+        super(AnnouncementTestCase, self).setUp()
+        self.meeting = self.create_active_meeting()
+        option = self.create_registration_option(self.meeting, 'OPT', 0)
+        entered_by = self.create_user("by@bar.com")
+        for username in ["reg1@bar.com", "both@bar.com", "reg2@bad.com"]:
+            user = self.create_user(username)
+            user.first_name = "FIRST"
+            user.save()
+            Registration.objects.create(meeting=self.meeting, type=option,
+                registrant=user, entered_by=entered_by)
+
+        accepted = Session.objects.create(meeting=self.meeting,
+            title="ACCEPTED", accepted=True)
+        rejected = Session.objects.create(meeting=self.meeting,
+            title="REJECTED")
+        for session, email in [(accepted, "presenter@bar.com"),
+                               (accepted, "Both@bar.com"),
+                               (rejected, "rejected@bar.com")]:
+            paper = Paper.objects.create(title="PAPER", abstract="ABSTRACT",
+                presenter=PaperPresenter.objects.create(first_name="P",
+                    last_name="P", email=email))
+            SessionPapers.objects.create(session=session, paper=paper,
+                position=1)
+        chair = SessionCadre.objects.create(first_name="C", last_name="C",
+            email="chair@bar.com")
+        accepted.chairs.add(chair)
+        accepted.organizers.add(chair)
+
+        self.announcement = Announcement.objects.create(meeting=self.meeting,
+            subject="SUBJECT", body="Dear {{ first_name }} <{{ email }}>, "
+                "see you at {{ meeting }}.",
+            to_presenters=True, to_session_cadre=True)
+
+    def test_get_recipients(self):
+        with self.assertNumQueries(5):
+            recipients = announcements.get_recipients(self.announcement)
+        self.assertEqual(sorted(email for email, _, _ in recipients),
+            ["both@bar.com", "chair@bar.com", "presenter@bar.com",
+             "reg1@bar.com", "reg2@bad.com"])
+        self.announcement.to_registrants = False
+        self.assertEqual(
+            [email for email, _, _ in
+             announcements.get_recipients(self.announcement)],
+            ["presenter@bar.com", "Both@bar.com", "chair@bar.com"])
+
+    def test_send_and_resume(self):
+        self.assertEqual(announcements.send_announcement(self.announcement,
+            batch_size=2, max_per_second=0, connection=FlakyBackend()),
+            (4, 1))
+        self.assertEqual(len(django_mail.outbox), 4)
+        message = [m for m in django_mail.outbox
+                   if m.to == ["reg1@bar.com"]][0]
+        self.assertEqual(message.subject, "SUBJECT")
+        self.assertEqual(message.body,
+            "Dear FIRST <reg1@bar.com>, see you at SOMEWHERE 2010.")
+        failed = self.announcement.recipients.get(date_sent__isnull=True)
+        self.assertEqual(failed.email, "reg2@bad.com")
+        self.assertEqual(failed.last_error, "IOError: Connection reset")
+        self.assertIsNone(
+            Announcement.objects.get(pk=self.announcement.pk).date_finished)
+
+        # running it again only tries the recipients that weren't sent to
+        django_mail.outbox = []
+        failed.email = "reg2@bar.com"
+        failed.save()
+        stdout = StringIO()
+        call_command('send_announcement', str(self.announcement.pk),
+            max_per_second=0, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Sent 1 e-mails. 0 failed.\n")
+        self.assertEqual([m.to for m in django_mail.outbox],
+            [["reg2@bar.com"]])
+        self.assertEqual(self.announcement.recipients.count(), 5)
+        self.assertIsNotNone(
+            Announcement.objects.get(pk=self.announcement.pk).date_finished)
+
+    def test_recipients_created_once(self):
+        # another run's copy of the announcement, loaded before this one
+        # created the recipients
+        stale = Announcement.objects.get(pk=self.announcement.pk)
+        self.assertEqual(
+            announcements.create_recipients(self.announcement), 5)
+        self.assertEqual(announcements.create_recipients(stale), 0)
+        self.assertIsNotNone(stale.date_started)
+        self.assertEqual(self.announcement.recipients.count(), 5)
+
+    def test_claimed_recipients_skipped(self):
+        announcements.create_recipients(self.announcement)
+        # as if another run had claimed them
+        claimed = self.announcement.recipients.filter(
+            email__in=["reg1@bar.com", "chair@bar.com"])
+        claimed.update(date_claimed=datetime.now())
+        self.assertEqual(announcements.send_announcement(self.announcement,
+            max_per_second=0), (3, 0))
+        self.assertEqual(len(django_mail.outbox), 3)
+        self.assertFalse([m for m in django_mail.outbox
+                          if m.to == ["reg1@bar.com"]])
+        self.assertIsNone(
+            Announcement.objects.get(pk=self.announcement.pk).date_finished)
+
+        # until the other run is assumed to have crashed
+        claimed.update(date_claimed=datetime.now() - timedelta(hours=2))
+        self.assertEqual(announcements.send_announcement(self.announcement,
+            max_per_second=0), (2, 0))
+        self.assertIsNotNone(
+            Announcement.objects.get(pk=self.announcement.pk).date_finished)
+
+    def test_throttle(self):
+        class FakeTime(object):
+            now = 100.0
+            def time(self):
+                return self.now
+            def sleep(self, seconds):
+                self.now += seconds
+        old_time = announcements.time
+        announcements.time = fake_time = FakeTime()
+        try:
+            throttle = announcements.Throttle(20)
+            for i in range(3):
+                throttle.wait()
+            self.assertAlmostEqual(fake_time.now, 100.1)
+        finally:
+            announcements.time = old_time
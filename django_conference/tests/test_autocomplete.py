@@ -0,0 +1,171 @@
+import json
+
+from django_conference import settings as conf_settings
+from django_conference.autocomplete import result_cache
+from django_conference.models import *
+from django_conference.tests.test_views import BaseTestCase
+
+
+class AutocompleteTestCase(BaseTestCase):
+    "Base class for autocomplete view tests"
+    def setUp(self):
+        super(AutocompleteTestCase, self).setUp()
+        result_cache.clear()
+        staff = self.create_user("staff@bar.com")
+        staff.is_staff = True
+        staff.save()
+        self.login(staff)
+
+    def get_results(self, url, query):
+        response = self.client.get(url, {'q': query})
+        return [r['text'] for r in json.loads(response.content)['results']]
+
+
+class UserAutocompleteTestCase(AutocompleteTestCase):
+    "Tests UserAutocomplete with and without the user search index"
+    def setUp(self):
+        self.old_DJANGO_CONFERENCE_USER_SEARCH_INDEX = \
+            conf_settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX
+        conf_settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX = True
+        super(UserAutocompleteTestCase, self).setUp()
+        for first_name, last_name, email in [
+            (u"Ren\xe9e", u"Smith", "rsmith@ufl.edu"),
+            (u"Reno", u"Jones", "reno@example.com"),
+            (u"Ann", u"Renfrew", "ann@example.com"),
+        ]:
+            user = self.create_user(email)
+            user.first_name = first_name
+            user.last_name = last_name
+            user.save()
+
+    def tearDown(self):
+        super(UserAutocompleteTestCase, self).tearDown()
+        conf_settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX = \
+            self.old_DJANGO_CONFERENCE_USER_SEARCH_INDEX
+
+    def get_results(self, query):
+        return super(UserAutocompleteTestCase, self).get_results(
+            '/conference/user-autocomplete/', query)
+
+    def test_tokens_maintained_on_save(self):
+        user = UserSearchToken.objects.get(token="jones").user
+        user.last_name = "Jonas"
+        user.save()
+        self.assertEqual(
+            sorted(user.search_tokens.values_list('token', flat=True)),
+            ["com", "example", "jonas", "reno"])
+
+    def test_accent_folded_prefix_search(self):
+        self.assertEqual(self.get_results("REN"),
+            ["rsmith@ufl.edu", "reno@example.com", "ann@example.com"])
+        self.assertEqual(self.get_results(u"ren\xe9e sm"), ["rsmith@ufl.edu"])
+        self.assertEqual(self.get_results("renee@"), ["rsmith@ufl.edu"])
+        self.assertEqual(self.get_results("ufl"), ["rsmith@ufl.edu"])
+        self.assertEqual(self.get_results("nobody"), [])
+
+    def test_ordered_by_relevance(self):
+        self.assertEqual(self.get_results("reno")[0], "reno@example.com")
+
+    def test_results_capped(self):
+        old_limit = conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS
+        conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS = 2
+        try:
+            self.assertEqual(len(self.get_results("ren")), 2)
+        finally:
+            conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_MAX_RESULTS = \
+                old_limit
+
+    def test_without_search_index(self):
+        conf_settings.DJANGO_CONFERENCE_USER_SEARCH_INDEX = False
+        self.assertEqual(self.get_results("Reno Jo"), ["reno@example.com"])
+
+
+class PaperAutocompleteTestCase(AutocompleteTestCase):
+    "Tests PaperAutocomplete and PaperPresenterAutocomplete"
+    def setUp(self):
+        super(PaperAutocompleteTestCase, self).setUp()
+        for title, first_name, last_name in [
+            ("A History of Early Modern Astronomy", "Jane", "Smith"),
+            ("Histories of Chemistry", u"Jos\xe9", "Jones"),
+            ("Alchemy in the Renaissance", "John", "Smithson"),
+        ]:
+            Paper.objects.create(title=title, abstract="ABSTRACT",
+                presenter=PaperPresenter.objects.create(first_name=first_name,
+                    last_name=last_name, email="foo@bar.com"))
+
+    def test_trigrams_maintained_on_save(self):
+        paper = Paper.objects.get(title__startswith="Alchemy")
+        paper.title = "Zoology"
+        paper.save()
+        self.assertEqual(
+            set(paper.title_trigrams.values_list('trigram', flat=True)),
+            set(["  z", " zo", "zoo", "ool", "olo", "log", "ogy", "gy "]))
+
+    def test_paper_search(self):
+        url = '/conference/paper-autocomplete/'
+        self.assertEqual(self.get_results(url, "histor"), [
+            "Histories of Chemistry",
+            "A History of Early Modern Astronomy",
+        ])
+        # typos
+        self.assertEqual(self.get_results(url, "alchemy renaisance"),
+            ["Alchemy in the Renaissance"])
+        self.assertEqual(self.get_results(url, "astronmoy")[0],
+            "A History of Early Modern Astronomy")
+        self.assertEqual(self.get_results(url, "xyz"), [])
+
+    def test_presenter_search(self):
+        url = '/conference/paper-presenter-autocomplete/'
+        self.assertEqual(self.get_results(url, "jose jones"),
+            [u"Jos\xe9 Jones"])
+        self.assertEqual(self.get_results(url, "smith"),
+            ["Jane Smith", "John Smithson"])
+        self.assertEqual(self.get_results(url, "smtih")[0], "Jane Smith")
+
+
+class ResultCacheTestCase(AutocompleteTestCase):
+    "Tests caching of autocomplete responses"
+    url = '/conference/paper-autocomplete/'
+
+    def create_paper(self, title):
+        return Paper.objects.create(title=title, abstract="ABSTRACT",
+            presenter=PaperPresenter.objects.create(first_name="F",
+                last_name="L", email="foo@bar.com"))
+
+    def get_stats(self):
+        response = self.client.get('/conference/autocomplete-cache-stats/')
+        return json.loads(response.content)
+
+    def test_repeated_queries_are_cached(self):
+        self.create_paper("Astronomy")
+        self.assertEqual(self.get_results(self.url, "Astro"), ["Astronomy"])
+        # only the session and user lookups for staff_member_required
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_results(self.url, " astro "),
+                ["Astronomy"])
+        self.get_results(self.url, "astronomy")
+        stats = self.get_stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['views']['PaperAutocomplete'],
+            {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3.0})
+
+    def test_invalidated_on_save(self):
+        paper = self.create_paper("Astronomy")
+        self.get_results(self.url, "astro")
+        paper.title = "Astrology"
+        paper.save()
+        self.assertEqual(self.get_results(self.url, "astro"), ["Astrology"])
+        paper.delete()
+        self.assertEqual(self.get_results(self.url, "astro"), [])
+
+    def test_size_is_bounded(self):
+        old_size = conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE
+        conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE = 2
+        try:
+            for query in ["a", "b", "c", "a"]:
+                self.get_results(self.url, query)
+            self.assertEqual(self.get_stats()['size'], 2)
+            self.assertEqual(
+                self.get_stats()['views']['PaperAutocomplete']['hits'], 0)
+        finally:
+            conf_settings.DJANGO_CONFERENCE_AUTOCOMPLETE_CACHE_SIZE = old_size
@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from django.core import mail as django_mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+
+from django_conference import mail, settings
+from django_conference.models import *
+from django_conference.tests.test_views import BaseTestCase, FlakyBackend
+
+
+class OutboxTestCase(BaseTestCase):
+    "Tests queuing e-mails in the outbox and delivering them"
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        self.old_DJANGO_CONFERENCE_EMAIL_OUTBOX = \
+            settings.DJANGO_CONFERENCE_EMAIL_OUTBOX
+        settings.DJANGO_CONFERENCE_EMAIL_OUTBOX = True
+
+    def tearDown(self):
+        super(OutboxTestCase, self).tearDown()
+        settings.DJANGO_CONFERENCE_EMAIL_OUTBOX = \
+            self.old_DJANGO_CONFERENCE_EMAIL_OUTBOX
+
+    def queue(self, to, subject="SUBJECT"):
+        mail.send_email(EmailMessage(subject=subject, body="BODY",
+            from_email="from@bar.com", to=[to]))
+
+    def test_submission_email_is_queued(self):
+        user = self.create_user()
+        paper = Paper.objects.create(title="PAPER", abstract="ABSTRACT",
+            submitter=user, presenter=PaperPresenter.objects.create(
+                first_name="FIRST", last_name="LAST", email="p@bar.com"))
+        paper.send_submission_email()
+        self.assertEqual(django_mail.outbox, [])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.to, "foo@bar.com")
+        self.assertIn("PAPER", email.html_body)
+
+        self.assertEqual(mail.deliver_queued_email(), (1, 0))
+        self.assertEqual(len(django_mail.outbox), 1)
+        message = django_mail.outbox[0]
+        self.assertEqual(message.subject, "Paper Submission Confirmation")
+        self.assertEqual(message.to, ["foo@bar.com"])
+        self.assertEqual(message.alternatives,
+            [(email.html_body, "text/html")])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.SENT)
+        self.assertEqual(email.attempts, 1)
+        self.assertIsNotNone(email.date_sent)
+
+    def test_queued_email_is_rolled_back(self):
+        try:
+            with transaction.atomic():
+                self.queue("foo@bar.com")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_retries(self):
+        settings_backup = (settings.DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS,
+            settings.DJANGO_CONFERENCE_EMAIL_RETRY_DELAY)
+        settings.DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS = 2
+        settings.DJANGO_CONFERENCE_EMAIL_RETRY_DELAY = 60
+        try:
+            self.queue("foo@bad.com", "BAD")
+            self.queue("foo@bar.com", "GOOD")
+            # a SELECT and an UPDATE to claim the e-mails, then one UPDATE
+            # for the sent e-mails and one for each failed e-mail, each step
+            # inside a savepoint
+            with self.assertNumQueries(8):
+                self.assertEqual(
+                    mail.deliver_queued_email(connection=FlakyBackend()),
+                    (1, 1))
+            self.assertEqual([m.subject for m in django_mail.outbox],
+                ["GOOD"])
+            email = OutgoingEmail.objects.get(subject="BAD")
+            self.assertEqual(email.status, OutgoingEmail.PENDING)
+            self.assertEqual(email.last_error, "IOError: Connection reset")
+            self.assertGreater(email.next_attempt,
+                datetime.now() + timedelta(seconds=50))
+            # not due yet
+            self.assertEqual(mail.deliver_queued_email(), (0, 0))
+
+            OutgoingEmail.objects.update(next_attempt=datetime.now())
+            self.assertEqual(
+                mail.deliver_queued_email(connection=FlakyBackend()), (0, 1))
+            email = OutgoingEmail.objects.get(subject="BAD")
+            self.assertEqual(email.status, OutgoingEmail.FAILED)
+            self.assertEqual(email.attempts, 2)
+        finally:
+            (settings.DJANGO_CONFERENCE_EMAIL_MAX_ATTEMPTS,
+             settings.DJANGO_CONFERENCE_EMAIL_RETRY_DELAY) = settings_backup
+
+    def test_claimed_email_not_sent_again(self):
+        self.queue("foo@bar.com", "CLAIMED")
+        self.queue("foo@bar.com", "PENDING")
+        # as if another run had claimed it
+        OutgoingEmail.objects.filter(subject="CLAIMED").update(
+            status=OutgoingEmail.SENDING)
+        self.assertEqual(mail.deliver_queued_email(), (1, 0))
+        self.assertEqual([m.subject for m in django_mail.outbox], ["PENDING"])
+
+        class CrashingBackend(EmailBackend):
+            def send_messages(self, messages):
+                raise KeyboardInterrupt
+        self.queue("foo@bar.com", "CRASHED")
+        self.assertRaises(KeyboardInterrupt, mail.deliver_queued_email,
+            connection=CrashingBackend())
+        self.assertEqual(OutgoingEmail.objects.get(subject="CRASHED").status,
+            OutgoingEmail.SENDING)
+        self.assertEqual(mail.deliver_queued_email(), (0, 0))
+
+    def test_command(self):
+        for i in range(5):
+            self.queue("user%d@bar.com" % i)
+        stdout = StringIO()
+        call_command('send_queued_email', batch_size=2, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Sent 5 e-mails. 0 failed.\n")
+        self.assertEqual(len(django_mail.outbox), 5)
+        self.assertEqual(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.SENT).count(), 5)
+
+
+class DeferredEmailTestCase(BaseTestCase):
+    "Tests sending e-mails directly with deferred_email()"
+    def send(self, subject):
+        mail.send_email(EmailMultiAlternatives(subject=subject, body="BODY",
+            from_email="from@bar.com", to=["foo@bar.com"]))
+
+    def test_sent_on_exit(self):
+        with mail.deferred_email():
+            self.send("FIRST")
+            with mail.deferred_email():
+                self.send("SECOND")
+            self.assertEqual(django_mail.outbox, [])
+        self.assertEqual([m.subject for m in django_mail.outbox],
+            ["FIRST", "SECOND"])
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_send_errors_logged(self):
+        class FailingBackend(EmailBackend):
+            def send_messages(self, messages):
+                raise IOError("Connection refused")
+        with mail.deferred_email():
+            mail.send_email(EmailMessage(subject="FIRST", body="BODY",
+                from_email="from@bar.com", to=["foo@bar.com"],
+                connection=FailingBackend()))
+            self.send("SECOND")
+        self.assertEqual([m.subject for m in django_mail.outbox], ["SECOND"])
+
+    def test_not_sent_on_error(self):
+        try:
+            with mail.deferred_email():
+                self.send("FIRST")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(django_mail.outbox, [])
+        self.send("SECOND")
+        self.assertEqual([m.subject for m in django_mail.outbox], ["SECOND"])
@@ -1,9 +1,15 @@
 from datetime import datetime, date
+from decimal import Decimal
 from freezegun import freeze_time
 
+from django.core import mail
+from django.db import connection
 from django.test import TestCase
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
 
 from django_conference.models import *
+from django_conference.tests.test_views import BaseTestCase
 
 
 class MeetingTestCase(TestCase):
@@ -43,3 +49,211 @@ class MeetingTestCase(TestCase):
     def test_can_submit_session(self):
         self.__do_test_daterange_method('session_submission_start',
             'session_submission_end', 'can_submit_session', datetime)
+
+
+class MeetingCloneTestCase(BaseTestCase):
+    "Tests Meeting.clone()"
+    def setUp(self):
+        super(MeetingCloneTestCase, self).setUp()
+        self.meeting = self.create_active_meeting()
+        self.create_registration_option(self.meeting, 'Student', 20)
+        self.create_registration_option(self.meeting, 'Member', 45)
+        self.meeting.extras.create(price=10, max_quantity=2,
+            extra_type=ExtraType.objects.create(name="banquet", label="!"))
+        self.meeting.donations.create(
+            donate_type=DonationType.objects.create(name="fund", label="!"))
+        self.meeting.institutions.create(acronym="HSS", name="HSS")
+
+    def test_clone(self):
+        # one query per model to read, and one to write
+        with self.assertNumQueries(11):
+            clone = self.meeting.clone(days=364, price_percent=10,
+                location="ELSEWHERE")
+        self.assertFalse(clone.is_active)
+        self.assertEqual(clone.location, "ELSEWHERE")
+        self.assertEqual(clone.start_date, date(2011, 9, 8))
+        self.assertEqual(clone.session_submission_end,
+            datetime(2012, 9, 7))
+        self.assertEqual(
+            list(clone.regoptions.order_by('option_name').values_list(
+                'option_name', 'early_price', 'onsite_price')),
+            [("Member", Decimal("49.50"), Decimal("49.50")),
+             ("Student", Decimal("22.00"), Decimal("22.00"))])
+        self.assertEqual(
+            list(clone.extras.values_list('extra_type', 'price',
+                'max_quantity')),
+            [("banquet", Decimal("11.00"), 2)])
+        self.assertEqual(
+            list(clone.donations.values_list('donate_type', flat=True)),
+            ["fund"])
+        self.assertEqual(
+            list(clone.institutions.values_list('acronym', flat=True)),
+            ["HSS"])
+        # the original is unchanged
+        self.assertEqual(self.meeting.regoptions.get(
+            option_name="Student").early_price, 20)
+        self.assertTrue(Meeting.objects.get(pk=self.meeting.pk).is_active)
+
+
+class SessionTestCase(BaseTestCase):
+    "Test for Session model"
+    def setUp(self):
+        super(SessionTestCase, self).setUp()
+        meeting = self.create_active_meeting()
+        presenter = PaperPresenter.objects.create(first_name="FIRST",
+            last_name="LAST", email="foo@bar.com")
+        self.sessions = []
+        for i in range(2):
+            session = Session.objects.create(meeting=meeting,
+                title="SESSION %d" % i)
+            for j in range(3):
+                SessionPapers.objects.create(session=session, position=j,
+                    paper=Paper.objects.create(title="PAPER %d" % j,
+                        abstract="ABSTRACT", presenter=presenter))
+            self.sessions.append(session)
+
+    def get_accepted_papers(self):
+        return Paper.objects.filter(accepted=True).count()
+
+    def count_paper_updates(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        update = 'UPDATE %s' % connection.ops.quote_name(
+            'django_conference_paper')
+        return len([q for q in queries if update in q['sql']])
+
+    def test_save_propagates_accepted(self):
+        session = Session.objects.get(pk=self.sessions[0].pk)
+        session.accepted = True
+        # the same on every backend, since the papers aren't joined (two of
+        # the queries are for the search index)
+        with self.assertNumQueries(4):
+            self.assertEqual(self.count_paper_updates(session.save), 1)
+        self.assertEqual(self.get_accepted_papers(), 3)
+        # no need to touch the papers if "accepted" hasn't changed
+        session.title = "NEW TITLE"
+        self.assertEqual(self.count_paper_updates(session.save), 0)
+        self.assertEqual(self.count_paper_updates(
+            Session.objects.get(pk=session.pk).save), 0)
+
+    def test_set_accepted(self):
+        # a SELECT for the IDs and two UPDATEs, inside a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(Session.objects.all().set_accepted(True), 2)
+        self.assertEqual(self.get_accepted_papers(), 6)
+        Session.objects.filter(pk=self.sessions[1].pk).set_accepted(False)
+        self.assertEqual(self.get_accepted_papers(), 3)
+        self.assertEqual(
+            list(Session.objects.filter(accepted=True)), [self.sessions[0]])
+
+
+class RegistrationTestCase(BaseTestCase):
+    "Tests Registration.save()"
+    def test_save_passes_arguments_through(self):
+        meeting = self.create_active_meeting()
+        # create() calls save(force_insert=True, using=...)
+        registration = Registration.objects.create(meeting=meeting,
+            type=self.create_registration_option(meeting, 'Student', 20),
+            entered_by=self.create_user("staff@bar.com"),
+            registrant=self.create_user("user@bar.com"))
+        self.assertEqual(registration.date_entered, datetime(2010, 10, 10))
+        registration.payment_type = "ca"
+        with self.assertNumQueries(1):
+            registration.save(update_fields=['payment_type'])
+        self.assertEqual(Registration.objects.get().payment_type, "ca")
+
+
+class RegistrationQuerySetTestCase(BaseTestCase):
+    "Tests the bulk payment methods of RegistrationQuerySet"
+    def setUp(self):
+        super(RegistrationQuerySetTestCase, self).setUp()
+        self.meeting = meeting = self.create_active_meeting()
+        option = self.create_registration_option(meeting, 'Student', 20)
+        self.staff = self.create_user("staff@bar.com")
+        for i, payment_type in enumerate(["ch", "ch", "mo"]):
+            Registration.objects.create(meeting=meeting, type=option,
+                payment_type=payment_type, entered_by=self.staff,
+                registrant=self.create_user("user%d@bar.com" % i))
+
+    def test_set_payment_type(self):
+        # a SELECT, an UPDATE, and an INSERT, inside a savepoint
+        with self.assertNumQueries(5):
+            num_updated = Registration.objects.all().set_payment_type("ca",
+                self.staff)
+        # only the registrations whose payment type changed are counted
+        self.assertEqual(num_updated, 3)
+        self.assertEqual(Registration.objects.filter(payment_type="ca")
+            .count(), 3)
+        self.assertEqual(Registration.objects.filter(payment_type="ch")
+            .set_payment_type("ca", self.staff), 0)
+
+        changes = RegistrationPaymentChange.objects.order_by(
+            'registration__registrant__username')
+        self.assertEqual(
+            [(c.changed_by, c.old_payment_type, c.payment_type)
+             for c in changes],
+            [(self.staff, "ch", "ca"), (self.staff, "ch", "ca"),
+             (self.staff, "mo", "ca")])
+
+    def test_record_and_clear_payment(self):
+        received = datetime(2010, 9, 1, 12, 0)
+        checks = Registration.objects.filter(payment_type="ch")
+        self.assertEqual(checks.record_payment(self.staff, received), 2)
+        # registrations that are already paid are left alone
+        self.assertEqual(Registration.objects.all().record_payment(
+            self.staff), 1)
+        self.assertEqual(
+            sorted(checks.values_list('payment_received', flat=True)),
+            [received, received])
+        self.assertEqual(RegistrationPaymentChange.objects.filter(
+            payment_received=received, old_payment_received=None).count(), 2)
+
+        self.assertEqual(checks.clear_payment(self.staff), 2)
+        self.assertEqual(Registration.objects.filter(
+            payment_received__isnull=True).count(), 2)
+        self.assertEqual(RegistrationPaymentChange.objects.count(), 5)
+
+    def add_details(self):
+        meeting = self.meeting
+        meeting.institutions.create(acronym="HSS", name="HSS")
+        meeting.institutions.create(acronym="PSA", name="PSA")
+        extras = [meeting.extras.create(price=5, extra_type=ExtraType.objects
+                      .create(name="extra%d" % i, label="EXTRA %d" % i))
+                  for i in range(2)]
+        donation = meeting.donations.create(donate_type=DonationType.objects
+            .create(name="fund", label="FUND"))
+        sessions = [Session.objects.create(meeting=meeting,
+                        title="SESSION %d" % i) for i in range(2)]
+        for registration in Registration.objects.all():
+            for extra in extras:
+                registration.regextras.create(extra=extra, quantity=2)
+            registration.regdonations.create(donate_type=donation, total=10)
+            registration.guests.create(first_name="GUEST", last_name="G")
+            registration.sessions.add(*sessions)
+
+    def test_register_email_query_count(self):
+        self.add_details()
+        registration = Registration.objects.all()[0]
+        # the registration, then institutions, guests, extras, donations,
+        # and sessions
+        with self.assertNumQueries(6):
+            registration.send_register_email()
+        self.assertIn("HSS/PSA", mail.outbox[0].body)
+        with self.assertNumQueries(6):
+            self.assertEqual(
+                Registration.objects.all().send_register_emails(), 3)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_registration_details_query_count(self):
+        self.add_details()
+        registration = Registration.objects.with_details().all()[0]
+        with self.assertNumQueries(0):
+            html = render_to_string(
+                "django_conference/registration_details.html",
+                {'registration': registration})
+        self.assertIn("GUEST G", html)
+        self.assertIn("EXTRA 1", html)
+        self.assertIn("FUND", html)
+        self.assertIn('"SESSION 1"', html)
+        # 20 for the registration, 2 x 2 x 5 for extras, 10 for the donation
+        self.assertIn("$50.00", html)
@@ -0,0 +1,320 @@
+from decimal import Decimal
+import json
+from StringIO import StringIO
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import RequestFactory
+
+from django_conference import payments, settings
+from django_conference.forms import StripeProcessPayment
+from django_conference.models import *
+from django_conference.tests.test_views import BaseTestCase
+
+
+class GatewayTestCase(BaseTestCase):
+    "Base class for tests that use the fake payment gateway"
+    SETTINGS = {
+        'DJANGO_CONFERENCE_DISABLE_PAYMENT_PROCESSING': False,
+        'DJANGO_CONFERENCE_PAYMENT_GATEWAY':
+            'django_conference.payments.FakeGateway',
+        'DJANGO_CONFERENCE_PAYMENT_MAX_RETRIES': 2,
+        'DJANGO_CONFERENCE_PAYMENT_RETRY_BACKOFF': 0,
+        'DJANGO_CONFERENCE_PAYMENT_CIRCUIT_THRESHOLD': 4,
+    }
+
+    def setUp(self):
+        super(GatewayTestCase, self).setUp()
+        self.old_settings = dict((name, getattr(settings, name))
+                                 for name in self.SETTINGS)
+        for name, value in self.SETTINGS.items():
+            setattr(settings, name, value)
+        payments.FakeGateway.reset()
+        cache.clear()
+
+    def tearDown(self):
+        super(GatewayTestCase, self).tearDown()
+        for name, value in self.old_settings.items():
+            setattr(settings, name, value)
+
+
+class PaymentsTestCase(GatewayTestCase):
+    "Tests charging cards with retries and the circuit breaker"
+    def charge(self, token="tok_ok", key="KEY"):
+        return payments.charge(Decimal("20.00"), token, "DESCRIPTION", key)
+
+    def test_charge_is_idempotent(self):
+        self.assertEqual(self.charge(), "ch_fake_1")
+        self.assertEqual(self.charge(), "ch_fake_1")
+        self.assertEqual(self.charge(key="OTHER KEY"), "ch_fake_2")
+        self.assertEqual(payments.FakeGateway.charges["KEY"]['amount'],
+            Decimal("20.00"))
+
+    def test_retries(self):
+        payments.FakeGateway.outages = 2
+        self.assertEqual(self.charge(), "ch_fake_1")
+        self.assertEqual(payments.FakeGateway.num_calls, 3)
+
+        payments.FakeGateway.reset()
+        payments.FakeGateway.outages = 3
+        self.assertRaises(payments.PaymentUnavailable, self.charge)
+        self.assertEqual(payments.FakeGateway.num_calls, 3)
+
+    def test_declined_cards_are_not_retried(self):
+        self.assertRaises(payments.CardDeclined, self.charge,
+            token="tok_declined")
+        self.assertEqual(payments.FakeGateway.num_calls, 1)
+
+    def test_circuit_breaker(self):
+        payments.FakeGateway.outages = 100
+        self.assertRaises(payments.PaymentUnavailable, self.charge)
+        # the fourth failure in a row opens the circuit
+        self.assertRaises(payments.PaymentUnavailable, self.charge)
+        self.assertEqual(payments.FakeGateway.num_calls, 4)
+        self.assertTrue(payments.is_circuit_open())
+        self.assertRaises(payments.PaymentUnavailable, self.charge)
+        self.assertEqual(payments.FakeGateway.num_calls, 4)
+
+        # once it closes, one more failure opens it again
+        cache.delete(payments.CIRCUIT_OPEN_KEY)
+        self.assertRaises(payments.PaymentUnavailable, self.charge)
+        self.assertEqual(payments.FakeGateway.num_calls, 5)
+
+        cache.delete(payments.CIRCUIT_OPEN_KEY)
+        payments.FakeGateway.outages = 0
+        self.assertEqual(self.charge(), "ch_fake_1")
+        self.assertIsNone(cache.get(payments.FAILURES_KEY))
+
+    def test_process_payment_errors(self):
+        def process(token):
+            payment = StripeProcessPayment({'total': Decimal("20"),
+                'description': "DESCRIPTION", 'stripeToken': token})
+            self.assertFalse(payment.is_valid())
+            return payment.last_error
+
+        self.assertIn("Your card was declined.", process("tok_declined"))
+        payments.FakeGateway.outages = 3
+        self.assertIn("card may not have been charged", process("tok_ok"))
+
+    def test_stripe_needs_timeouts(self):
+        import stripe
+        def old_client(**kwargs):
+            raise TypeError("unexpected keyword argument 'timeout'")
+        payments.StripeGateway._http_client = None
+        RequestsClient = stripe.http_client.RequestsClient
+        stripe.http_client.RequestsClient = old_client
+        try:
+            self.assertRaises(ImproperlyConfigured,
+                payments.StripeGateway.get_http_client)
+        finally:
+            stripe.http_client.RequestsClient = RequestsClient
+        self.assertEqual(payments.StripeGateway.get_http_client()._timeout,
+            (settings.DJANGO_CONFERENCE_PAYMENT_CONNECT_TIMEOUT,
+             settings.DJANGO_CONFERENCE_PAYMENT_READ_TIMEOUT))
+
+    def test_payment_view_charges_once(self):
+        user = self.create_user()
+        self.login(user)
+        meeting = self.create_active_meeting()
+        registration = Registration.objects.create(meeting=meeting,
+            registrant=user, entered_by=user,
+            type=self.create_registration_option(meeting, 'PAID', 20))
+        url = '/conference/payment/%d' % registration.id
+        for i in range(2):
+            response = self.client.post(url, {'stripeToken': 'tok_ok'})
+            self.assertRedirects(response, '/conference/paysuccess')
+        self.assertEqual(len(payments.FakeGateway.charges), 1)
+        self.assertEqual(payments.FakeGateway.charges.values()[0]['amount'],
+            Decimal("20.00"))
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual((payment.registration, payment.charge_id,
+                          payment.status, payment.description),
+            (registration, "ch_fake_1", RegistrationPayment.CAPTURED,
+             "PAID, Meeting Registration"))
+
+    def test_double_submission_saves_one_registration(self):
+        self.create_user("OnlineRegistration")
+        user = self.create_user()
+        self.login(user)
+        meeting = self.create_active_meeting()
+        option = self.create_registration_option(meeting, 'PAID', 20)
+        self.client.post('/conference/register', {
+            'registerMeeting': 'Submit',
+            'type': option.id,
+        })
+        draft = self.client.session['regDraft']
+        for i in range(2):
+            # as if both submissions arrived before either finished
+            session = self.client.session
+            session['regDraft'] = draft
+            session.save()
+            response = self.client.post('/conference/payment/',
+                {'stripeToken': 'tok_ok'})
+            self.assertRedirects(response, '/conference/register_success')
+        self.assertEqual(len(payments.FakeGateway.charges), 1)
+        registration = Registration.objects.get()
+        self.assertEqual(registration.card_payments.get().charge_id,
+            "ch_fake_1")
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class TwoPhasePaymentTestCase(GatewayTestCase):
+    "Tests authorizing payments and capturing them in the background"
+    SETTINGS = dict(GatewayTestCase.SETTINGS,
+        DJANGO_CONFERENCE_TWO_PHASE_PAYMENT=True)
+
+    def setUp(self):
+        super(TwoPhasePaymentTestCase, self).setUp()
+        self.create_user("OnlineRegistration")
+        self.user = self.create_user()
+        self.login(self.user)
+        self.meeting = self.create_active_meeting()
+        self.option = self.create_registration_option(self.meeting, 'PAID',
+            20)
+
+    def register(self, token="tok_ok"):
+        self.client.post('/conference/register', {
+            'registerMeeting': 'Submit',
+            'type': self.option.id,
+        })
+        return self.client.post('/conference/payment/',
+            {'stripeToken': token})
+
+    def post_events(self, events):
+        return self.client.post('/conference/payment/webhook/',
+            json.dumps(events), content_type="application/json")
+
+    def test_register(self):
+        response = self.register()
+        self.assertRedirects(response, '/conference/register_success')
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual(payment.status, RegistrationPayment.AUTHORIZED)
+        self.assertEqual(payment.amount, Decimal("20.00"))
+        self.assertEqual(payment.registration.registrant, self.user)
+        self.assertIsNone(payment.registration.payment_received)
+        self.assertFalse(payments.FakeGateway.charges.values()[0]['captured'])
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(payments.capture_payments(), (1, 0))
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual(payment.status, RegistrationPayment.CAPTURED)
+        self.assertIsNotNone(payment.registration.payment_received)
+        self.assertTrue(payments.FakeGateway.charges.values()[0]['captured'])
+        self.assertEqual([m.subject for m in mail.outbox],
+            ["2010 Meeting Registration"])
+        # the webhook event for the capture doesn't send it again
+        self.post_events([{'id': 'evt_1', 'type': 'captured',
+                           'charge_id': payment.charge_id}])
+        self.assertEqual(payments.process_payment_events(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_declined(self):
+        response = self.register("tok_declined")
+        self.assertContains(response, "Your card was declined.")
+        registration = Registration.objects.get()
+        self.assertIsNone(registration.payment_received)
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual(payment.status, RegistrationPayment.FAILED)
+        self.assertEqual(payment.last_error, response.context['payment_error'])
+        url = '/conference/payment/%d' % registration.pk
+        self.assertContains(response, 'action="%s"' % url)
+        # they can try again with another card
+        self.assertRedirects(self.client.post(url, {'stripeToken': 'tok_ok'}),
+            '/conference/paysuccess')
+        payment = registration.card_payments.get(
+            status=RegistrationPayment.AUTHORIZED)
+        self.assertTrue(payment.send_confirmation)
+        self.assertEqual(payments.capture_payments(), (1, 0))
+        self.assertEqual([m.subject for m in mail.outbox],
+            ["2010 Meeting Registration"])
+
+    def test_interrupted_authorization(self):
+        self.register()
+        # as if the process died while the card was being authorized
+        RegistrationPayment.objects.update(
+            status=RegistrationPayment.PENDING, charge_id=u'',
+            date_created=datetime.now() - timedelta(hours=1))
+        self.assertEqual(payments.capture_payments(), (0, 0))
+        stderr = StringIO()
+        call_command('process_payments', stdout=StringIO(), stderr=stderr)
+        self.assertIn("1 payments were interrupted", stderr.getvalue())
+
+        staff = self.create_user("staff@bar.com")
+        staff.is_staff = staff.is_superuser = True
+        staff.save()
+        self.login(staff)
+        response = self.client.get(
+            '/admin/django_conference/registrationpayment/',
+            {'attention': 'stale'})
+        self.assertEqual(list(response.context['cl'].result_list),
+            list(RegistrationPayment.objects.all()))
+        RegistrationPayment.objects.update(date_created=datetime.now())
+        self.assertFalse(RegistrationPayment.objects.stale_pending().exists())
+
+    def test_capture_retries(self):
+        self.register()
+        payments.FakeGateway.outages = 3
+        self.assertEqual(payments.capture_payments(), (0, 1))
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual(payment.status, RegistrationPayment.AUTHORIZED)
+        self.assertEqual(payment.attempts, 1)
+        self.assertIn("PaymentUnavailable", payment.last_error)
+        # not due yet
+        self.assertEqual(payments.capture_payments(), (0, 0))
+
+        cache.clear()
+        RegistrationPayment.objects.update(next_attempt=datetime.now())
+        stdout = StringIO()
+        call_command('process_payments', stdout=stdout)
+        self.assertEqual(stdout.getvalue(),
+            "Captured 1 payments. 0 failed. Processed 0 events.\n")
+        self.assertEqual(RegistrationPayment.objects.get().status,
+            RegistrationPayment.CAPTURED)
+
+    def test_stripe_partial_refunds_ignored(self):
+        import stripe
+        def construct_event(payload, signature, secret):
+            return stripe.Event.construct_from(json.loads(payload), "KEY")
+        old_construct_event = stripe.Webhook.construct_event
+        old_secret = settings.DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET
+        stripe.Webhook.construct_event = staticmethod(construct_event)
+        settings.DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET = "SECRET"
+        try:
+            def parse(amount_refunded):
+                request = RequestFactory().post('/', json.dumps({
+                    'id': 'evt_1', 'type': 'charge.refunded',
+                    'data': {'object': {'id': 'ch_1', 'amount': 2000,
+                                        'amount_refunded': amount_refunded}},
+                }), content_type="application/json")
+                return payments.StripeGateway().parse_webhook(request)
+            self.assertEqual(parse(500), [])
+            self.assertEqual(parse(2000), [{'id': 'evt_1',
+                'type': RegistrationPayment.REFUNDED, 'charge_id': 'ch_1'}])
+        finally:
+            stripe.Webhook.construct_event = old_construct_event
+            settings.DJANGO_CONFERENCE_STRIPE_WEBHOOK_SECRET = old_secret
+
+    def test_webhook(self):
+        self.register()
+        charge_id = RegistrationPayment.objects.get().charge_id
+        self.assertEqual(self.post_events({'id': 'evt_1'}).status_code, 400)
+        events = [
+            {'id': 'evt_1', 'type': 'captured', 'charge_id': charge_id},
+            {'id': 'evt_2', 'type': 'refunded', 'charge_id': charge_id},
+        ]
+        self.assertEqual(self.post_events(events).status_code, 200)
+        # events that were already received are ignored
+        self.assertEqual(self.post_events(events).status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+
+        with self.assertNumQueries(20):
+            self.assertEqual(payments.process_payment_events(), 2)
+        payment = RegistrationPayment.objects.get()
+        self.assertEqual(payment.status, RegistrationPayment.REFUNDED)
+        self.assertIsNone(payment.registration.payment_received)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(payments.process_payment_events(), 0)
+        # a refunded payment isn't captured again
+        self.assertEqual(payments.capture_payments(), (0, 0))
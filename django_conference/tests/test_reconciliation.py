@@ -0,0 +1,124 @@
+from decimal import Decimal
+from StringIO import StringIO
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_conference.models import *
+from django_conference.reconciliation import PaymentReconciler
+from django_conference.tests.test_views import BaseTestCase
+
+
+class PaymentReconcilerTestCase(BaseTestCase):
+    "Tests reconciling payments with a provider's export of charges"
+    def setUp(self):
+        super(PaymentReconcilerTestCase, self).setUp()
+        self.meeting = self.create_active_meeting()
+        option = self.create_registration_option(self.meeting, 'PAID', 20)
+        self.registrations = []
+        for i in range(4):
+            user = self.create_user("user%d@bar.com" % i)
+            registration = Registration.objects.create(meeting=self.meeting,
+                type=option, registrant=user, entered_by=user)
+            registration.card_payments.create(amount=Decimal("20.00"),
+                description=u"PAID, Meeting Registration",
+                charge_id="ch_%d" % i, idempotency_key="key%d" % i,
+                status=RegistrationPayment.CAPTURED)
+            self.registrations.append(registration)
+
+    def reconcile(self, lines, meeting=None):
+        reconciler = PaymentReconciler(meeting or self.meeting)
+        result = reconciler.run(StringIO("\n".join(lines)))
+        self.assertEqual(result, not reconciler.errors)
+        return reconciler
+
+    def test_reconcile(self):
+        with self.assertNumQueries(3):
+            reconciler = self.reconcile([
+                "\xef\xbb\xbfid,Description,Created (UTC),Amount,Status",
+                "ch_0,\"PAID, Meeting Registration\",2010-10-01,20.00,Paid",
+                "ch_1,\"PAID, Meeting Registration\",2010-10-01,25.00,Paid",
+                "ch_2,Something else,2010-10-01,20.00,Paid",
+                "",
+                "ch_other,Other,2010-10-01,\"1,000.00\",Paid",
+                "ch_3,\"PAID, Meeting Registration\",2010-10-01,20.00,Failed",
+            ])
+        self.assertEqual(reconciler.errors, [])
+        self.assertEqual(reconciler.num_matched, 1)
+        self.assertEqual(
+            [(m.charge.line_number, m.registration_id, m.problems)
+             for m in reconciler.mismatched],
+            [(3, self.registrations[1].pk,
+              [u"The amount is 25.00 instead of 20.00."]),
+             (4, self.registrations[2].pk,
+              [u'The description is "Something else" instead of '
+               u'"PAID, Meeting Registration".'])])
+        self.assertEqual(
+            [(c.line_number, c.charge_id, c.amount)
+             for c in reconciler.unmatched_charges],
+            [(6, "ch_other", Decimal("1000.00"))])
+        self.assertEqual(
+            [p.charge_id for p in reconciler.missing_payments], ["ch_3"])
+
+        other_meeting = self.create_active_meeting()
+        reconciler = self.reconcile(["id,amount,description"],
+            other_meeting)
+        self.assertEqual(reconciler.missing_payments, [])
+
+    def test_errors(self):
+        reconciler = self.reconcile(["id,amount"])
+        self.assertEqual(reconciler.errors,
+            [(1, u'Missing the "description" column.')])
+
+        reconciler = self.reconcile([
+            "id,amount,description",
+            "ch_0,twenty,X",
+            ",20,X",
+            "ch_1,20",
+            "ch_2,20,X",
+            "ch_2,20,X",
+        ])
+        self.assertEqual(reconciler.errors, [
+            (2, u'"twenty" is not a valid amount.'),
+            (3, u'The charge ID is missing.'),
+            (4, u'The row has 2 columns instead of 3.'),
+            (6, u'The charge "ch_2" is also on line 5.'),
+        ])
+        self.assertEqual(reconciler.num_matched, 0)
+
+    def test_admin_task(self):
+        staff = self.create_user("staff@bar.com")
+        staff.is_staff = True
+        staff.save()
+        self.login(staff)
+        url = '/conference/do_admin_task/%d/3' % self.meeting.pk
+        csv_file = StringIO("id,amount,description\n"
+            "ch_0,20.00,\"PAID, Meeting Registration\"\n"
+            "ch_9,5.00,Other\n")
+        csv_file.name = "charges.csv"
+        response = self.client.post(url, {'csv_file': csv_file})
+        self.assertContains(response, "1 charge matched.")
+        self.assertContains(response, "ch_9")
+        self.assertContains(response, "ch_3")
+
+    def test_command(self):
+        csv_fd, csv_path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(csv_fd, 'w') as csv_file:
+            csv_file.write("id,amount,description\n"
+                "ch_0,20.00,\"PAID, Meeting Registration\"\n"
+                "ch_1,20.00,\"PAID, Meeting Registration\"\n"
+                "ch_2,20.00,\"PAID, Meeting Registration\"\n"
+                "ch_3,21.00,\"PAID, Meeting Registration\"\n")
+        try:
+            stdout = StringIO()
+            call_command('reconcile_payments', csv_path,
+                meeting_id=self.meeting.pk, stdout=stdout)
+            self.assertEqual(stdout.getvalue().splitlines()[-1],
+                "3 matched, 1 mismatched, 0 with no payment, 0 missing "
+                "from file.")
+            self.assertRaisesMessage(CommandError, "No meeting with ID 0.",
+                call_command, 'reconcile_payments', csv_path, meeting_id=0)
+        finally:
+            os.remove(csv_path)
@@ -0,0 +1,206 @@
+from datetime import datetime
+from decimal import Decimal
+from StringIO import StringIO
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from django_conference.models import *
+from django_conference.registration_import import RegistrationImporter
+from django_conference.tests.test_views import BaseTestCase
+
+
+class RegistrationImportTestCase(BaseTestCase):
+    "Tests importing registrations from CSV files"
+    def setUp(self):
+        super(RegistrationImportTestCase, self).setUp()
+        self.meeting = self.create_active_meeting()
+        self.option = self.create_registration_option(self.meeting,
+            'Student', 20)
+        self.extra = self.meeting.extras.create(max_quantity=2,
+            extra_type=ExtraType.objects.create(name="banquet", label="!"))
+        self.donation = self.meeting.donations.create(
+            donate_type=DonationType.objects.create(name="fund", label="!"))
+        self.staff = self.create_user("staff@bar.com")
+        self.staff.is_staff = True
+        self.staff.save()
+        self.users = [self.create_user("user%d@bar.com" % i)
+                      for i in range(3)]
+
+    def run_import(self, lines):
+        importer = RegistrationImporter(self.meeting, self.staff,
+            chunk_size=2)
+        result = importer.run(StringIO("\n".join(lines)))
+        self.assertEqual(result, not importer.errors)
+        return importer
+
+    def test_import(self):
+        importer = self.run_import([
+            "Email,Option,payment_type,date_entered,extra:banquet,"
+                "donation:fund,guests,special_needs",
+            "user0@bar.com,student,ch,2010-08-01,2,$10.50,"
+                "Jane Smith; Mary Ann Jones,",
+            "USER1@bar.com,Student,,2010-08-02 13:30,0,,,wheelchair",
+            "",
+            "user2@bar.com,Student,,,,,,",
+        ])
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(importer.num_created, 3)
+
+        registrations = Registration.objects.order_by('registrant__username')
+        self.assertEqual(
+            [(r.registrant.username, r.type, r.payment_type, r.entered_by,
+              r.special_needs) for r in registrations],
+            [("user0@bar.com", self.option, "ch", self.staff, ""),
+             ("user1@bar.com", self.option, "cc", self.staff, "wheelchair"),
+             ("user2@bar.com", self.option, "cc", self.staff, "")])
+        self.assertEqual(registrations[0].date_entered,
+            datetime(2010, 8, 1))
+        self.assertEqual(registrations[1].date_entered,
+            datetime(2010, 8, 2, 13, 30))
+        self.assertEqual(
+            [(e.extra, e.quantity) for e in registrations[0].regextras.all()],
+            [(self.extra, 2)])
+        self.assertEqual(
+            [(d.donate_type, d.total)
+             for d in registrations[0].regdonations.all()],
+            [(self.donation, Decimal("10.50"))])
+        self.assertEqual(
+            sorted(unicode(g) for g in registrations[0].guests.all()),
+            ["Jane Smith", "Mary Ann Jones"])
+        self.assertEqual(RegistrationExtra.objects.count(), 1)
+        self.assertEqual(RegistrationGuest.objects.count(), 2)
+
+    def test_header_errors(self):
+        importer = self.run_import([
+            "email,extra:lunch,donation:fund,foo",
+            "user0@bar.com,1,1,1",
+        ])
+        self.assertEqual(importer.errors, [
+            (1, 'Missing the "option" column.'),
+            (1, '"lunch" is not an extra for this meeting.'),
+            (1, 'Unknown column "foo".'),
+        ])
+
+    def test_row_errors(self):
+        Registration.objects.create(meeting=self.meeting, type=self.option,
+            registrant=self.users[2],
+            entered_by=self.staff)
+        importer = self.run_import([
+            "email,option,payment_type,date_entered,extra:banquet,"
+                "donation:fund,guests",
+            "user0@bar.com,Professor,xx,2010-13-01,3,-1,Jane",
+            "nobody@bar.com,Student,,,,,",
+            "user1@bar.com,Student,,,,,",
+            "user1@bar.com,Student,,,,,",
+            "user2@bar.com,Student,,,,,",
+        ])
+        self.assertEqual(importer.errors, [
+            (2, '"Professor" is not a registration option for this '
+                'meeting.'),
+            (2, '"xx" is not a valid payment type. Must be one of: ca, cc, '
+                'ch, mo, na.'),
+            (2, '"2010-13-01" is not a valid date.'),
+            (2, 'The quantity for "banquet" must be a whole number between 0 '
+                'and 2.'),
+            (2, 'The donation to "fund" must be an amount between 0 and '
+                '9999.99.'),
+            (2, 'Guests must have a first and last name.'),
+            (3, 'There is no user with the e-mail address '
+                '"nobody@bar.com".'),
+            (5, '"user1@bar.com" is already registered for this meeting.'),
+            (6, '"user2@bar.com" is already registered for this meeting.'),
+        ])
+        # nothing is imported if there are any errors
+        self.assertEqual(Registration.objects.count(), 1)
+
+    def test_ambiguous_email(self):
+        other = self.create_user("other")
+        other.email = "User0@bar.com"
+        other.save()
+        importer = self.run_import([
+            "email,option",
+            "User0@bar.com,Student",
+            "user1@bar.com,Student",
+        ])
+        self.assertEqual(importer.errors, [
+            (2, 'More than one user has the e-mail address '
+                '"User0@bar.com".'),
+        ])
+        self.assertFalse(Registration.objects.exists())
+
+    def test_registered_during_import(self):
+        importer = RegistrationImporter(self.meeting, self.staff)
+        check_registrants = importer.check_registrants
+        def register_during_import(rows):
+            check_registrants(rows)
+            Registration.objects.create(meeting=self.meeting,
+                type=self.option, registrant=self.users[1],
+                entered_by=self.staff)
+        importer.check_registrants = register_during_import
+        self.assertFalse(importer.run(StringIO("email,option,extra:banquet\n"
+            "user0@bar.com,Student,1\nuser1@bar.com,Student,1\n")))
+        self.assertEqual(importer.errors, [
+            (3, '"user1@bar.com" was registered for this meeting while the '
+                'import was running.'),
+        ])
+        self.assertEqual(importer.num_created, 0)
+        self.assertEqual(
+            list(Registration.objects.values_list('registrant', flat=True)),
+            [self.users[1].pk])
+        self.assertFalse(RegistrationExtra.objects.exists())
+
+        # a registration that slips in between the check and the insert
+        importer = RegistrationImporter(self.meeting, self.staff)
+        bulk_create = Registration.objects.bulk_create
+        def register_while_saving(objs, *args):
+            Registration.objects.create(meeting=self.meeting,
+                type=self.option, registrant=self.users[2],
+                entered_by=self.staff)
+            return bulk_create(objs, *args)
+        Registration.objects.bulk_create = register_while_saving
+        try:
+            self.assertFalse(importer.run(StringIO("email,option\n"
+                "user0@bar.com,Student\nuser2@bar.com,Student\n")))
+        finally:
+            del Registration.objects.bulk_create
+        self.assertEqual(importer.errors, [
+            (3, '"user2@bar.com" was registered for this meeting while the '
+                'import was running.'),
+        ])
+        self.assertEqual(Registration.objects.count(), 1)
+
+    def test_admin_task(self):
+        self.login(self.staff)
+        url = '/conference/do_admin_task/%d/2' % self.meeting.pk
+        csv_file = StringIO("email,option\nuser0@bar.com,Student\n")
+        csv_file.name = "registrations.csv"
+        response = self.client.post(url, {'csv_file': csv_file})
+        self.assertContains(response, "Imported 1 registration.")
+        self.assertEqual(Registration.objects.get().entered_by, self.staff)
+
+        csv_file = StringIO("email,option\nuser0@bar.com,Student\n")
+        csv_file.name = "registrations.csv"
+        response = self.client.post(url, {'csv_file': csv_file})
+        self.assertContains(response, "Line 2: &quot;user0@bar.com&quot; is "
+            "already registered for this meeting.")
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as csv_file:
+                csv_file.write("email,option\r\nuser0@bar.com,Student\r\n")
+            stdout = StringIO()
+            call_command('import_registrations', str(self.meeting.pk), path,
+                entered_by=self.staff.username, stdout=stdout)
+            self.assertEqual(stdout.getvalue(), "Created 1 registrations.\n")
+
+            stderr = StringIO()
+            self.assertRaises(CommandError, call_command,
+                'import_registrations', str(self.meeting.pk), path,
+                entered_by=self.staff.username, stderr=stderr)
+            self.assertIn("Line 2:", stderr.getvalue())
+        finally:
+            os.remove(path)
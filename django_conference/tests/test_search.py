@@ -0,0 +1,176 @@
+from django.contrib import admin
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_conference import search
+from django_conference.models import (Paper, PaperPresenter,
+    PaperSearchTerm, Session, SessionCadre, SessionSearchTerm)
+from django_conference.tests.test_views import BaseTestCase
+
+
+class SearchTestCase(TestCase):
+    "Tests for the text processing functions in django_conference.search"
+    def test_normalize(self):
+        self.assertEqual(search.normalize(u"Ren\xe9e \xc7elik"),
+            u"renee celik")
+
+    def test_get_trigrams(self):
+        self.assertEqual(search.get_trigrams("Cat"),
+            set(["  c", " ca", "cat", "at "]))
+        self.assertEqual(search.get_trigrams("a cat", partial=True),
+            set(["  a", " a ", "  c", " ca", "cat"]))
+
+    def test_stem(self):
+        for word, expected in [
+            ("histories", "histori"),
+            ("history", "histori"),
+            ("studied", "studi"),
+            ("studies", "studi"),
+            ("classes", "class"),
+            ("agreed", "agree"),
+            ("hoping", "hope"),
+            ("hopping", "hop"),
+            ("falling", "fall"),
+            ("sing", "sing"),
+            ("is", "is"),
+        ]:
+            self.assertEqual(search.stem(word), expected)
+
+    def test_get_terms(self):
+        self.assertEqual(
+            dict(search.get_terms("The histories of the History of Science")),
+            {"histori": 2, "science": 1})
+
+
+class FullTextSearchAdminTestCase(TestCase):
+    "Tests searching the admin through the full-text index"
+    def setUp(self):
+        presenter = PaperPresenter.objects.create(first_name="Jane",
+            last_name="Smith", email="foo@bar.com")
+        for title, abstract in [
+            ("Alchemy", "Studying the history of alchemy"),
+            ("Astronomy", "Histories of astronomy and the histories of "
+                "astrology"),
+            ("Chemistry", "A short study of chemistry"),
+        ]:
+            Paper.objects.create(title=title, abstract=abstract,
+                presenter=presenter)
+        self.model_admin = admin.site._registry[Paper]
+
+    def search(self, query, params=None):
+        request = RequestFactory().get('/', params or {})
+        queryset, use_distinct = self.model_admin.get_search_results(
+            request, Paper.objects.order_by('title'), query)
+        return [paper.title for paper in queryset]
+
+    def test_terms_maintained_on_save(self):
+        paper = Paper.objects.get(title="Chemistry")
+        paper.abstract = "Physics"
+        paper.save()
+        self.assertEqual(
+            sorted(paper.search_terms.values_list('term', flat=True)),
+            ["chemistri", "physic"])
+
+    def test_stemmed_search(self):
+        self.assertEqual(self.search("studies"), ["Alchemy", "Chemistry"])
+        self.assertEqual(self.search("history"),
+            ["Astronomy", "Alchemy"])
+        self.assertEqual(self.search("history astro"), ["Astronomy"])
+        self.assertEqual(self.search("physics"), [])
+
+    def test_other_search_fields(self):
+        self.assertEqual(self.search("smith"),
+            ["Alchemy", "Astronomy", "Chemistry"])
+
+    def test_stop_words_match_other_fields(self):
+        presenter = PaperPresenter.objects.create(first_name="Will",
+            last_name="An", email="will@bar.com")
+        Paper.objects.create(title="Botany", abstract="Plants",
+            presenter=presenter)
+        self.assertEqual(self.search("will"), ["Botany"])
+        self.assertEqual(self.search("an will"), ["Botany"])
+        self.assertEqual(self.search("will histories"), [])
+        # stop words are searched for in every field with icontains
+        self.assertEqual(self.search("the history"),
+            ["Astronomy", "Alchemy"])
+
+    def test_ranking_within_queryset(self):
+        queryset = Paper.objects.exclude(title="Astronomy")
+        with self.assertNumQueries(2):
+            ranked_ids = search.rank_by_terms(PaperSearchTerm, queryset,
+                ["histori"], 10)
+        self.assertEqual(ranked_ids,
+            [Paper.objects.get(title="Alchemy").pk])
+
+    def test_explicit_ordering_kept(self):
+        self.assertEqual(self.search("history", {'o': '1'}),
+            ["Alchemy", "Astronomy"])
+
+
+class SessionSearchTestCase(BaseTestCase):
+    "Tests indexing the people involved in sessions"
+    def setUp(self):
+        super(SessionSearchTestCase, self).setUp()
+        self.chair = SessionCadre.objects.create(first_name="Jane",
+            last_name="Smith", email="foo@bar.com", institution="Harvard")
+        self.submitter = self.create_user()
+        self.submitter.first_name = "Alice"
+        self.submitter.last_name = "Jones"
+        self.submitter.save()
+        self.session = Session.objects.create(title="Alchemy",
+            submitter=self.submitter, meeting=self.create_active_meeting())
+
+    def get_terms(self):
+        return sorted(self.session.search_terms.values_list('term', flat=True))
+
+    def search(self, query):
+        model_admin = admin.site._registry[Session]
+        queryset, use_distinct = model_admin.get_search_results(
+            RequestFactory().get('/'), Session.objects.all(), query)
+        self.assertFalse(use_distinct)
+        return list(queryset)
+
+    def test_chairs_indexed(self):
+        self.session.chairs.add(self.chair)
+        self.assertEqual(self.get_terms(),
+            ["alchemi", "alice", "harvard", "jane", "jone", "smith"])
+        self.assertEqual(self.search("smith harv"), [self.session])
+
+        self.chair.institution = "Yale"
+        self.chair.save()
+        self.assertEqual(self.search("harvard"), [])
+        self.assertEqual(self.search("yale"), [self.session])
+
+        self.session.chairs.remove(self.chair)
+        self.assertEqual(self.search("smith"), [])
+        self.chair.sessions_chaired.add(self.session)
+        self.assertEqual(self.search("smith"), [self.session])
+        self.chair.sessions_chaired.clear()
+        self.assertEqual(self.search("smith"), [])
+
+        self.session.chairs.add(self.chair)
+        self.chair.delete()
+        self.assertEqual(self.get_terms(), ["alchemi", "alice", "jone"])
+
+    def test_submitter_indexed(self):
+        self.submitter.last_name = "Brown"
+        self.submitter.save()
+        self.assertEqual(self.search("alice brown"), [self.session])
+        self.assertEqual(self.search("jones"), [])
+
+    def test_rebuild(self):
+        self.session.chairs.add(self.chair)
+        SessionSearchTerm.objects.all().delete()
+        self.assertEqual(search.rebuild_terms(SessionSearchTerm), 6)
+        self.assertEqual(self.search("jane"), [self.session])
+
+        Session.objects.create(title="Botany", meeting=self.session.meeting)
+        insert = 'INSERT INTO %s' % connection.ops.quote_name(
+            SessionSearchTerm._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                search.rebuild_terms(SessionSearchTerm, batch_size=4), 7)
+        # 4 rows and 3 rows
+        self.assertEqual(len([q for q in queries if insert in q['sql']]), 2)
+        self.assertEqual(self.search("botany smith"), [])
@@ -0,0 +1,130 @@
+from decimal import Decimal
+
+from django import forms
+from django.template import Context, Template, TemplateSyntaxError
+
+from django_conference.models import *
+from django_conference.templatetags.columnize import columnize
+from django_conference.templatetags.money_format import money_format
+from django_conference.tests.test_views import BaseTestCase
+
+
+class NumDonatedTestCase(BaseTestCase):
+    "Tests the num_donated and has_donated template tags"
+    def setUp(self):
+        super(NumDonatedTestCase, self).setUp()
+        self.meeting = self.create_active_meeting()
+        option = self.create_registration_option(self.meeting, 'OPTION', 10)
+        entered_by = self.create_user("OnlineRegistration")
+        self.registrations = []
+        for i in range(3):
+            registration = Registration(meeting=self.meeting, type=option,
+                registrant=self.create_user("user%d@bar.com" % i),
+                entered_by=entered_by)
+            registration.save()
+            self.registrations.append(registration)
+        self.donation = self.meeting.donations.create(
+            donate_type=DonationType.objects.create(name="DONATE1", label="!"))
+        self.meeting.donations.create(
+            donate_type=DonationType.objects.create(name="DONATE2", label="!"))
+        for registration in self.registrations[1:]:
+            registration.regdonations.create(donate_type=self.donation,
+                total=Decimal("12.50"))
+
+    def render(self, template_string):
+        registrations = (Registration.objects.order_by('id')
+            .prefetch_related('regdonations__donate_type'))
+        template = Template("{% load num_donated %}" + template_string)
+        return template.render(Context({'registrations': registrations}))
+
+    def test_num_donated(self):
+        rendered = self.render("{% for r in registrations %}"
+            "{% num_donated r 'DONATE1' %}/{% num_donated r 'DONATE2' %} "
+            "{% endfor %}")
+        self.assertEqual(rendered, "0/0 12.50/0 12.50/0 ")
+
+    def test_has_donated(self):
+        rendered = self.render("{% for r in registrations %}"
+            "{% has_donated r 'DONATE1' %} {% endfor %}")
+        self.assertEqual(rendered, "No Yes Yes ")
+
+    def test_invalid_donation_type(self):
+        with self.assertRaises(TemplateSyntaxError):
+            self.render("{% for r in registrations %}"
+                "{% num_donated r 'NOPE' %}{% endfor %}")
+
+    def test_fixed_number_of_queries(self):
+        # registrations, regdonations, donate_type and DonationType names
+        with self.assertNumQueries(4):
+            self.render("{% for r in registrations %}"
+                "{% num_donated r 'DONATE1' %}{% has_donated r 'DONATE2' %}"
+                "{% endfor %}")
+
+
+class DisplayFormTestCase(BaseTestCase):
+    "Tests the display_form template tag"
+    class TestForm(forms.Form):
+        name = forms.CharField(help_text="HELP")
+        notes = forms.CharField(required=False)
+
+    def render(self, form):
+        template = Template("{% load display_form %}{% display_form form %}")
+        return template.render(Context({'form': form}))
+
+    def test_unbound_form(self):
+        rendered = self.render(self.TestForm())
+        self.assertIn("<div class='container container_name' "
+            "id='id_name_container'><b><label for=\"id_name\">Name:</label>"
+            "</b><input id=\"id_name\" name=\"name\" type=\"text\" />"
+            "<p class='help_text'>HELP</p></div>", rendered)
+        self.assertIn("<label for=\"id_notes\">Notes:</label><input",
+            rendered)
+        self.assertNotIn("error_list", rendered)
+
+    def test_bound_values_and_errors_rendered_per_form(self):
+        self.render(self.TestForm())
+        rendered = self.render(self.TestForm({'notes': 'NOTES'}))
+        self.assertIn('value="NOTES"', rendered)
+        self.assertIn("This field is required", rendered)
+        rendered = self.render(self.TestForm({'name': 'NAME'}))
+        self.assertIn('value="NAME"', rendered)
+        self.assertNotIn("NOTES", rendered)
+        self.assertNotIn("error_list", rendered)
+
+    def test_shell_depends_on_field_configuration(self):
+        form = self.TestForm(prefix="foo")
+        form.fields['name'].label = "Changed"
+        rendered = self.render(form)
+        self.assertIn("<label for=\"id_foo-name\">Changed:</label>", rendered)
+
+
+class ColumnizeTestCase(BaseTestCase):
+    "Tests the columnize template filter"
+    def test_columnize(self):
+        text = "col1: foo\na really long term: bar\nl: baz\nno label"
+        self.assertEqual(columnize(text, 10),
+            "col1:       foo\n\n"
+            "a really  \nlong term:  bar\n\n"
+            "l:          baz\n\n"
+            "no label  \n")
+
+    def test_empty_label(self):
+        self.assertEqual(columnize(": foo", 4), ":     foo\n\n")
+
+
+class MoneyFormatTestCase(BaseTestCase):
+    "Tests the money_format template filter"
+    def test_money_format(self):
+        for value, expected in [
+            (0, "$0.00"),
+            (1234567, "$1,234,567.00"),
+            (-5, "-$5.00"),
+            (Decimal("12.5"), "$12.50"),
+            (Decimal("1234.567"), "$1,234.57"),
+            (Decimal("0.015"), "$0.02"),
+            (Decimal("-0.001"), "$0.00"),
+            (Decimal("1E+3"), "$1,000.00"),
+            (2.675, "$2.68"),
+            ("99.9", "$99.90"),
+        ]:
+            self.assertEqual(money_format(value), expected)
@@ -5,6 +5,7 @@ from freezegun import freeze_time
 
 from django.apps import apps
 from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
 from django.conf import settings
 from django.test import TestCase
 
@@ -79,6 +80,15 @@ class BaseTestCase(TestCase):
         )
 
 
+class FlakyBackend(EmailBackend):
+    "Backend that can't deliver to addresses at bad.com"
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.endswith("@bad.com") for address in message.to):
+                raise IOError("Connection reset")
+        return super(FlakyBackend, self).send_messages(messages)
+
+
 class HomepageTestCase(BaseTestCase):
     "Tests homepage() view"
     def __do_get(self):
@@ -465,6 +475,73 @@ class SubmitSessionTestCase(BaseTestCase):
         self.assertEqual(mail.outbox[0].to, ['f@b.com'])
         self.assertIn(msg, mail.outbox[0].body)
 
+    def test_failed_submission_is_rolled_back(self):
+        self.login(self.create_user())
+        self.create_active_meeting()
+        session_post_data = self.post_data_for_valid_session.copy()
+        session_post_data.update(self.post_data_for_valid_commentator)
+        session_post_data['num_papers'] = 3
+        self.__do_post(**session_post_data)
+
+        time_period = PaperPresenterTimePeriod.objects.create(time_period="P")
+        paper_post_data = SubmitPaperTestCase.post_data_for_valid_paper.copy()
+        paper_post_data['time_periods'] = time_period.pk
+        # the first paper's form has no prefix
+        post_data = paper_post_data.copy()
+        for paper_num in range(1, 3):
+            post_data.update(dict([
+                ('%d-%s' % (paper_num, field), value)
+                for field, value in paper_post_data.iteritems()
+            ]))
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("FAIL")
+        SessionPapers.objects.bulk_create = fail
+        try:
+            self.assertRaises(RuntimeError, self.client.post,
+                '/conference/submit_session_papers', post_data)
+        finally:
+            del SessionPapers.objects.bulk_create
+        for model in [Session, SessionCadre, PaperPresenter, Paper,
+                      PaperPresenter.time_periods.through]:
+            self.assertEqual(model.objects.count(), 0)
+
+        self.client.post('/conference/submit_session_papers', post_data)
+        session = Session.objects.get()
+        self.assertEqual(
+            [(p.title, p.presenter.time_periods.count())
+             for p in session.papers.order_by('sessionpapers__position')],
+            [(paper_post_data['title'], 1)] * 3)
+        self.assertEqual(
+            list(session.search_terms.filter(term='uw')
+                 .values_list('term', flat=True)), ['uw'])
+
+
+    def test_session_draft(self):
+        self.login(self.create_user())
+        self.create_active_meeting()
+        self.__do_post(**self.post_data_for_valid_session)
+        draft = self.client.session['session_draft']
+        self.assertEqual(draft['num_papers'], 4)
+        self.assertEqual(draft['title'], 'session title')
+        self.assertEqual(draft['chairs']['email'], 'g@c.com')
+        self.assertEqual(draft['organizers']['gender'], '')
+        self.assertIsNone(draft['commentators'])
+        self.assertNotIn('chair-email', draft)
+
+        paper_post_data = SubmitPaperTestCase.post_data_for_valid_paper
+        post_data = paper_post_data.copy()
+        for paper_num in range(1, 4):
+            post_data.update(dict([
+                ('%d-%s' % (paper_num, field), value)
+                for field, value in paper_post_data.iteritems()
+            ]))
+        self.client.post('/conference/submit_session_papers', post_data)
+        session = Session.objects.get()
+        self.assertEqual(session.papers.count(), 4)
+        self.assertEqual(session.chairs.get().email, 'g@c.com')
+        self.assertFalse(session.commentators.exists())
+
 
 class RegisterTestCase(BaseTestCase):
     "Tests register() and payment() views"
@@ -584,6 +661,55 @@ class RegisterTestCase(BaseTestCase):
         self.assertEqual(regdonation.donate_type, self.donation1)
         self.assertEqual(regdonation.total, Decimal('123.45'))
 
+    def test_registration_draft(self):
+        user = self.create_user()
+        self.login(user)
+        session = Session.objects.create(meeting=self.meeting, title="TITLE",
+            submitter=user, accepted=True, start_time=datetime(2010, 11, 1),
+            stop_time=datetime(2010, 11, 1, 1))
+        response = self.__do_post(
+            type=self.paid_option.id,
+            guest_first_name="FOO",
+            guest_last_name="BAR",
+            EXTRA1='2',
+            DONATE1='5.50',
+            sessions_0=[session.pk],
+        )
+        self.assertRegexpMatches(response.content,
+            'class="orderTotal">\s*\$45.50')
+        draft = self.client.session['regDraft']
+        self.assertEqual(draft['extras'], [['EXTRA1', 2]])
+        self.assertEqual(draft['donations'], [['DONATE1', '5.50']])
+        self.assertEqual(draft['guest'], ['FOO', 'BAR'])
+        self.assertEqual(draft['sessions'], [session.pk])
+
+        # the forms are filled in if they go back
+        response = self.client.get('/conference/register')
+        self.assertEqual(response.context['extras_form'].initial['EXTRA1'], 2)
+        self.assertEqual(
+            response.context['register_form'].initial['guest_last_name'],
+            'BAR')
+        self.assertEqual(
+            response.context['session_form'].initial['sessions_0'],
+            [session.pk])
+
+        response = self.client.post('/conference/payment/', {
+            'stripeToken': 'dummy',
+        })
+        self.assertRedirects(response, '/conference/register_success')
+        registration = Registration.objects.get()
+        self.assertEqual(registration.get_total(), decimal.Decimal('45.50'))
+        self.assertEqual(registration.guests.get().last_name, 'BAR')
+        self.assertEqual(list(registration.sessions.all()), [session])
+        self.assertNotIn('regDraft', self.client.session)
+
+    def test_stale_registration_draft(self):
+        self.login(self.create_user())
+        self.__do_post(type=self.paid_option.id, EXTRA1='2')
+        self.extra1.delete()
+        response = self.client.get('/conference/payment/')
+        self.assertRedirects(response, '/conference/register')
+
     def test_pay_for_nonexistent_registration(self):
         self.login(self.create_user())
         response = self.client.get('/conference/payment/39999')
@@ -1,5 +1,6 @@
 from django.http import HttpResponseNotFound, HttpResponse
 from django.conf.urls import patterns, url, include
+from django.contrib import admin
 
 
 handler404 = lambda request: HttpResponseNotFound()
@@ -7,4 +8,5 @@ handler404 = lambda request: HttpResponseNotFound()
 urlpatterns = patterns('',
     url(r'^account/', lambda request: HttpResponse("LOGIN")),
     url(r'^conference/', include('django_conference.urls')),
+    url(r'^admin/', include(admin.site.urls)),
 )
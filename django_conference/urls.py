@@ -25,6 +25,9 @@ urlpatterns = patterns('',
         name="django_conference_submit_session"),
 
     # Meeting registration
+    url(r'^payment/webhook/$',
+        views.payment_webhook,
+        name="django_conference_payment_webhook"),
     url(r'^payment/(?P<reg_id>\d+)?',
         views.payment,
         name="django_conference_payment"),
@@ -56,6 +59,9 @@ urlpatterns = patterns('',
     url(r'^paper-autocomplete/$',
         autocomplete.PaperAutocomplete.as_view(),
         name='paper-autocomplete'),
+    url(r'^autocomplete-cache-stats/$',
+        autocomplete.cache_stats,
+        name='autocomplete-cache-stats'),
 
     # Homepage
     url(r'',
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from decimal import Decimal
 from datetime import datetime, date
 
@@ -5,32 +6,141 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.http import (HttpResponse, HttpResponseBadRequest,
+    HttpResponseRedirect)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-from django_conference import settings
+from django_conference import mail, payments, search, settings
 from django_conference.forms import (PaperForm, MeetingSessions,
     MeetingRegister, MeetingExtras, MeetingDonations, SessionForm,
     SessionCadreForm, StripePaymentForm, StripeProcessPayment,
-    PaperPresenterForm)
-from django_conference.models import (Meeting, Registration, Paper,
-    SessionPapers, current_meeting_or_none)
+    StripeAuthorizePayment, PaperPresenterForm, get_form_m2m_through_rows,
+    get_m2m_through_rows)
+from django_conference.models import (Meeting, Registration,
+    RegistrationDonation, RegistrationExtra, RegistrationGuest,
+    RegistrationOption, RegistrationPayment, Paper, Session, SessionCadre,
+    SessionPapers, SessionSearchTerm, current_meeting_or_none)
 
 
 class RegistrationContainer(object):
     """
     Container to contain unsaved Registration, Session, RegistrationExtra,
-    and RegistrationDonation objects until they can be saved.
+    and RegistrationDonation objects until they can be saved. Between
+    requests, it's kept in the session as a draft (see to_draft()).
     """
-    def __init__(self, registration, guest, extras, donations,
-        sessions, page1_cache):
+    DRAFT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+    def __init__(self, registration, guest, extras, donations, sessions):
         self.registration = registration
         self.guest = guest
         self.extras = extras
         self.donations = donations
         self.sessions = sessions
-        # cache of POST data so fields can be filled in if registrant returns
-        # to first page after getting to payment page
-        self.page1_cache = page1_cache
+
+    def to_draft(self):
+        """
+        Returns a dict of the IDs, quantities and amounts needed to rebuild
+        this container with from_draft(). Unlike the container, it's small
+        and can be stored in the session with the JSON serializer.
+        """
+        registration = self.registration
+        return {
+            'meeting': registration.meeting_id,
+            'type': registration.type_id,
+            'entered_by': registration.entered_by_id,
+            'payment_type': registration.payment_type,
+            'special_needs': registration.special_needs,
+            'date_entered': registration.date_entered.strftime(
+                self.DRAFT_DATE_FORMAT),
+            'guest': [self.guest.first_name, self.guest.last_name]
+                     if self.guest else None,
+            'extras': [[extra.extra.extra_type_id, extra.quantity]
+                       for extra in self.extras],
+            'donations': [[donation.donate_type.donate_type_id,
+                           unicode(donation.total)]
+                          for donation in self.donations],
+            'sessions': [session.pk for session in self.sessions],
+        }
+
+    @classmethod
+    def from_draft(cls, draft, registrant):
+        """
+        Rebuilds a container from a dict returned by to_draft() for the given
+        registrant, with one query for each kind of object in it. Returns
+        None if anything in the draft no longer exists.
+        """
+        try:
+            option = RegistrationOption.objects.select_related('meeting') \
+                .get(pk=draft['type'], meeting=draft['meeting'])
+        except RegistrationOption.DoesNotExist:
+            return None
+        meeting = option.meeting
+        registration = Registration(meeting=meeting, type=option,
+            entered_by_id=draft['entered_by'],
+            payment_type=draft['payment_type'],
+            special_needs=draft['special_needs'],
+            date_entered=datetime.strptime(draft['date_entered'],
+                cls.DRAFT_DATE_FORMAT),
+            registrant=registrant)
+        guest = None
+        if draft['guest']:
+            first_name, last_name = draft['guest']
+            guest = RegistrationGuest(first_name=first_name,
+                last_name=last_name)
+
+        extras = []
+        if draft['extras']:
+            meeting_extras = dict((extra.extra_type_id, extra)
+                for extra in meeting.extras.select_related('extra_type')
+                    .filter(extra_type__in=[name for name, _
+                                            in draft['extras']]))
+            for name, quantity in draft['extras']:
+                if name not in meeting_extras:
+                    return None
+                extras.append(RegistrationExtra(extra=meeting_extras[name],
+                    quantity=quantity))
+        donations = []
+        if draft['donations']:
+            meeting_donations = dict((donation.donate_type_id, donation)
+                for donation in meeting.donations.select_related('donate_type')
+                    .filter(donate_type__in=[name for name, _
+                                             in draft['donations']]))
+            for name, total in draft['donations']:
+                if name not in meeting_donations:
+                    return None
+                donations.append(RegistrationDonation(
+                    donate_type=meeting_donations[name],
+                    total=Decimal(total)))
+        sessions = []
+        if draft['sessions']:
+            sessions_by_pk = meeting.sessions.in_bulk(draft['sessions'])
+            if len(sessions_by_pk) != len(draft['sessions']):
+                return None
+            sessions = [sessions_by_pk[pk] for pk in draft['sessions']]
+        return cls(registration, guest, extras, donations, sessions)
+
+    def get_initial_data(self):
+        """
+        Returns the initial data for the registration forms, so they can be
+        filled in if the registrant goes back to the first page after
+        getting to the payment page.
+        """
+        registration = self.registration
+        initial = {
+            'type': registration.type_id,
+            'special_needs': registration.special_needs,
+            'sessions': [session.pk for session in self.sessions],
+        }
+        if self.guest:
+            initial['guest_first_name'] = self.guest.first_name
+            initial['guest_last_name'] = self.guest.last_name
+        for extra in self.extras:
+            initial[extra.extra.extra_type_id] = extra.quantity
+        for donation in self.donations:
+            initial[donation.donate_type.donate_type_id] = donation.total
+        return initial
 
     def save(self):
         """
@@ -57,6 +167,21 @@ class RegistrationContainer(object):
         total += sum(d.total for d in self.donations)
         return total
 
+    def get_idempotency_key(self, token):
+        """
+        Returns the idempotency key for paying for this registration with
+        the card represented by the given token. It's derived from what's
+        being paid for, so submitting the payment form twice can't charge
+        the card twice.
+        """
+        registration = self.registration
+        return payments.get_idempotency_key(token, registration.pk,
+            registration.registrant_id, registration.meeting_id,
+            registration.type_id, self.get_total(),
+            sorted((e.extra_id, e.quantity) for e in self.extras),
+            sorted((d.donate_type_id, d.total) for d in self.donations),
+            sorted(s.pk for s in self.sessions))
+
     def get_description(self):
         """ Get a string describing all the registration information."""
         desc = unicode(self.registration.type) + ", Meeting Registration"
@@ -85,26 +210,26 @@ def register(request):
                 register_form.get_guest(),
                 extras,
                 donations_form.get_donations(),
-                session_form.get_sessions(),
-                request.POST)
+                session_form.get_sessions())
             if cont.get_total() == Decimal("0.00"):
                 # they must have registered with a free option, so no
                 # payment is necessary
                 cont.registration.payment_type = "na"
-                cont.save()
-                cont.registration.send_register_email()
-                if 'regContainer' in request.session:
-                    del request.session['regContainer']
+                with mail.deferred_email(), transaction.atomic():
+                    cont.save()
+                    cont.registration.send_register_email()
+                request.session.pop('regDraft', None)
                 url = reverse("django_conference_register_success")
             else:
                 #don't save registration object yet since we haven't
                 #received payment.
-                request.session['regContainer'] = cont
+                request.session['regDraft'] = cont.to_draft()
                 url = reverse("django_conference_payment")
             return HttpResponseRedirect(url)
     else:
-        cont = request.session.get('regContainer')
-        previous_data = cont.page1_cache if cont else None
+        draft = request.session.get('regDraft')
+        cont = draft and RegistrationContainer.from_draft(draft, request.user)
+        previous_data = cont.get_initial_data() if cont else None
         initial_data = request.POST or previous_data or {}
         register_form = MeetingRegister(meeting, initial=initial_data)
         session_form = MeetingSessions(meeting, initial=initial_data)
@@ -126,7 +251,9 @@ def payment(request, reg_id=None):
     """
     Handles processing payment for a meeting registration.
     Allows both saved and unsaved registrations to be paid for. The former
-    requires that the ID of the registration be passed as reg_id.
+    requires that the ID of the registration be passed as reg_id. With
+    DJANGO_CONFERENCE_TWO_PHASE_PAYMENT, the card is only authorized here
+    (see authorize_payment()).
     """
     notice = ""
     if reg_id:
@@ -135,35 +262,64 @@ def payment(request, reg_id=None):
         donations = list(registration.regdonations.all())
         sessions = list(registration.sessions.all())
         cont = RegistrationContainer(
-            registration, None, extras, donations, sessions, None)
+            registration, None, extras, donations, sessions)
         meeting = registration.meeting
         notice = "Please pay for the following meeting registration."
-    elif 'previous' in request.POST or 'regContainer' not in request.session:
-        #either they shouldn't be here or they clicked "Previous" button
-        return HttpResponseRedirect(reverse("django_conference_register"))
     else:
-        cont = request.session['regContainer']
+        draft = request.session.get('regDraft')
+        cont = draft and RegistrationContainer.from_draft(draft, request.user)
+        if 'previous' in request.POST or not cont:
+            #either they shouldn't be here or they clicked "Previous" button
+            return HttpResponseRedirect(reverse("django_conference_register"))
         meeting = Meeting.current()
 
     payment_error = ''
     if 'stripeToken' in request.POST:
-        process_payment = StripeProcessPayment({
+        payment_data = {
             'total': cont.get_total(),
             'description': cont.get_description(),
             'stripeToken': request.POST['stripeToken'],
-        })
-        if process_payment.is_valid():
-            #save registration and send an e-mail
+            'idempotency_key': cont.get_idempotency_key(
+                request.POST['stripeToken']),
+        }
+        if settings.DJANGO_CONFERENCE_TWO_PHASE_PAYMENT and \
+           not settings.DJANGO_CONFERENCE_DISABLE_PAYMENT_PROCESSING:
+            success, payment_error = authorize_payment(cont, payment_data,
+                new_registration=not reg_id)
+            if not success and not reg_id:
+                # the registration was saved, and the payment form now pays
+                # for it with its ID
+                request.session.pop('regDraft', None)
+        else:
+            process_payment = StripeProcessPayment(payment_data)
+            success = process_payment.is_valid()
+            payment_error = process_payment.last_error
+            if success:
+                try:
+                    with mail.deferred_email(), transaction.atomic():
+                        if not reg_id:
+                            #save registration and send an e-mail
+                            cont.save()
+                            cont.registration.send_register_email()
+                        if process_payment.charge_id:
+                            record_charge(cont, payment_data,
+                                process_payment.charge_id)
+                except IntegrityError:
+                    # The payment form was submitted twice. The charge is
+                    # idempotent, so the first submission saved the
+                    # registration and the payment, and this one is undone.
+                    if not RegistrationPayment.objects.filter(
+                            idempotency_key=payment_data['idempotency_key'],
+                    ).exists():
+                        raise
+        if success:
             if reg_id:
                 url = reverse("django_conference_paysuccess")
             else:
-                cont.save()
-                cont.registration.send_register_email()
-                del request.session['regContainer']
+                # a double submission may have removed it already
+                request.session.pop('regDraft', None)
                 url = reverse("django_conference_register_success")
             return HttpResponseRedirect(url)
-        else:
-            payment_error = process_payment.last_error
 
     return render_to_response('django_conference/payment.html', {
         'payment_form': StripePaymentForm(),
@@ -175,6 +331,93 @@ def payment(request, reg_id=None):
     }, context_instance=RequestContext(request))
 
 
+def authorize_payment(cont, payment_data, new_registration):
+    """
+    Saves the registration in the given RegistrationContainer, if it's new,
+    along with a pending RegistrationPayment, then authorizes the card. The
+    process_payments management command captures the payment and sends the
+    confirmation e-mail later. Returns a tuple of whether the card was
+    authorized and the error message to show if it wasn't.
+
+    If the card can't be authorized, the registration is kept along with the
+    failed payment, and can be paid for like any other saved registration.
+    The confirmation e-mail is still sent once that payment is captured.
+    """
+    idempotency_key = payment_data['idempotency_key']
+    now = datetime.now()
+    try:
+        with transaction.atomic():
+            if new_registration:
+                cont.save()
+                send_confirmation = True
+            else:
+                # a new registration whose card couldn't be authorized
+                send_confirmation = cont.registration.card_payments.filter(
+                    status=RegistrationPayment.FAILED,
+                    send_confirmation=True).exists()
+            payment = RegistrationPayment.objects.create(
+                registration=cont.registration,
+                amount=payment_data['total'],
+                description=payment_data['description'],
+                idempotency_key=idempotency_key,
+                send_confirmation=send_confirmation,
+                date_created=now, next_attempt=now)
+    except IntegrityError:
+        # the payment form was submitted twice
+        payment = RegistrationPayment.objects.get(
+            idempotency_key=idempotency_key)
+        return payment.status != RegistrationPayment.FAILED, \
+            payment.last_error
+
+    process_payment = StripeAuthorizePayment(payment_data)
+    if process_payment.is_valid():
+        RegistrationPayment.objects.filter(pk=payment.pk,
+            status=RegistrationPayment.PENDING,
+        ).update(status=RegistrationPayment.AUTHORIZED,
+                 charge_id=process_payment.charge_id)
+        return True, ''
+    RegistrationPayment.objects.filter(pk=payment.pk,
+        status=RegistrationPayment.PENDING,
+    ).update(status=RegistrationPayment.FAILED,
+             last_error=process_payment.last_error)
+    return False, process_payment.last_error
+
+
+def record_charge(cont, payment_data, charge_id):
+    """
+    Records the charge made for the registration in the given
+    RegistrationContainer by the one-step payment flow, so it can be
+    reconciled with the payment gateway's records. Raises IntegrityError if
+    the charge was already recorded by an earlier submission of the payment
+    form, which must roll back the registration saved with it.
+    """
+    now = datetime.now()
+    RegistrationPayment.objects.create(
+        idempotency_key=payment_data['idempotency_key'],
+        registration=cont.registration,
+        amount=payment_data['total'],
+        description=payment_data['description'],
+        charge_id=charge_id,
+        status=RegistrationPayment.CAPTURED,
+        date_created=now, next_attempt=now, date_captured=now)
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """
+    Receives events from the payment gateway and saves them to be processed
+    by the process_payments management command, so the gateway gets its
+    response without waiting for them to be processed.
+    """
+    try:
+        events = payments.get_gateway().parse_webhook(request)
+    except ValueError:
+        return HttpResponseBadRequest()
+    payments.save_events(events)
+    return HttpResponse()
+
+
 @login_required
 def submit_session(request):
     """
@@ -200,7 +443,8 @@ def submit_session(request):
             errors = {'Paper Abstracts': ['Sessions with 3 papers '+\
                 'must have a commentator.']}
         else:
-            request.session['session_data'] = request.POST
+            request.session['session_draft'] = get_session_draft(
+                session_form, [organizer_form, chair_form, commentator_form])
             url = reverse('django_conference_submit_session_papers')
             return HttpResponseRedirect(url)
 
@@ -219,44 +463,21 @@ def submit_session(request):
 def submit_session_papers(request):
     meeting = Meeting.current()
     if not meeting.can_submit_session() or \
-        'session_data' not in request.session:
+        'session_draft' not in request.session:
         return HttpResponseRedirect(reverse("django_conference_home"))
 
-    session_data = request.session['session_data']
-    num = int(session_data['num_papers'])
+    session_draft = request.session['session_draft']
+    num = session_draft['num_papers']
     forms = []
     for i in range(num):
         forms.append(PaperPresenterForm(request.POST or None, prefix=i))
         forms.append(PaperForm(request.POST or None, prefix=i))
 
     if request.POST and all([x.is_valid() for x in forms]):
-        session_form = SessionForm(session_data)
-        session = session_form.save(meeting=meeting, submitter=request.user)
-
-        organizer_form = SessionCadreForm(session_data)
-        organizer = organizer_form.save()
-        session.organizers.add(organizer)
-
-        chair_form = SessionCadreForm(session_data, prefix="chair")
-        chair = chair_form.save()
-        session.chairs.add(chair)
-
-        commentator_form = SessionCadreForm(session_data, prefix="commentator")
-        commentator_form.is_valid()
-        if commentator_form.has_entered_info():
-            commentator = commentator_form.save()
-            session.commentators.add(commentator)
-
-        position = 1
-        for i in range(0, num * 2, 2):
-            paper_presenter = forms[i].save()
-            paper = forms[i + 1].save(request.user, paper_presenter)
-            SessionPapers.objects.create(session=session, paper=paper,
-                position=position)
-            position += 1
-
-        session.save()
-        session.send_submission_email()
+        with mail.deferred_email(), transaction.atomic():
+            session = save_session(session_draft,
+                zip(forms[::2], forms[1::2]), meeting, request.user)
+            session.send_submission_email()
         kwargs = {'id': session.id}
         url = reverse('django_conference_submission_success', kwargs=kwargs)
         return HttpResponseRedirect(url)
@@ -267,6 +488,76 @@ def submit_session_papers(request):
     }, context_instance=RequestContext(request))
 
 
+# the M2M fields of Session that the organizer, chair and commentator forms
+# in session submission are for
+SESSION_CADRE_FIELDS = ['organizers', 'chairs', 'commentators']
+
+
+def get_session_draft(session_form, cadre_forms):
+    """
+    Returns a dict of the cleaned data of the valid forms from the first step
+    of session submission: the SessionForm and the SessionCadreForms in the
+    order of SESSION_CADRE_FIELDS. It's kept in the session until the papers
+    are submitted, so they don't need to be validated again. The commentator
+    is None if none was entered.
+    """
+    draft = dict((name, session_form.cleaned_data[name])
+                 for name in ['title', 'abstract', 'notes'])
+    draft['num_papers'] = int(session_form.cleaned_data['num_papers'])
+    for field_name, cadre_form in zip(SESSION_CADRE_FIELDS, cadre_forms):
+        if field_name == 'commentators' and \
+            not cadre_form.has_entered_info():
+            draft[field_name] = None
+        else:
+            draft[field_name] = dict((name, cadre_form.cleaned_data[name])
+                for name in SessionCadreForm._meta.fields)
+    return draft
+
+
+def save_session(session_draft, paper_forms, meeting, submitter):
+    """
+    Saves a submitted session from the draft made by get_session_draft() and
+    the list of (PaperPresenterForm, PaperForm) pairs for its papers, which
+    must all be valid. Should be called inside a transaction so a failure
+    can't leave a partial session behind.
+
+    Presenters and papers are inserted one at a time because their IDs are
+    needed for the rows that refer to them, but the rows for every M2M
+    field (including SessionPapers) are inserted with one bulk_create() per
+    table.
+    """
+    session = Session.objects.create(meeting=meeting, submitter=submitter,
+        title=session_draft['title'], abstract=session_draft['abstract'],
+        notes=session_draft['notes'])
+    through_rows = []
+    for field_name in SESSION_CADRE_FIELDS:
+        if session_draft[field_name]:
+            cadre = SessionCadre.objects.create(**session_draft[field_name])
+            through_rows.extend(get_m2m_through_rows(session, field_name,
+                [cadre]))
+
+    for position, (presenter_form, paper_form) in \
+        enumerate(paper_forms, 1):
+        presenter = presenter_form.save(commit=False)
+        presenter.save()
+        paper = paper_form.save(submitter, presenter, commit=False)
+        paper.save()
+        through_rows.extend(get_form_m2m_through_rows(presenter_form))
+        through_rows.extend(get_form_m2m_through_rows(paper_form))
+        through_rows.append(SessionPapers(session=session, paper=paper,
+            position=position))
+
+    rows_by_model = OrderedDict()
+    for row in through_rows:
+        rows_by_model.setdefault(type(row), []).append(row)
+    for model, rows in rows_by_model.items():
+        model.objects.bulk_create(rows)
+    # bulk_create() doesn't send m2m_changed, which is what normally adds
+    # the chairs to the session's search index
+    search.update_terms(SessionSearchTerm, session)
+    return session
+
+
 def submission_success(request, id=None):
     message = 'Your reference number is %s.' % id
     return render_to_response('django_conference/submission_success.html', {
@@ -289,9 +580,10 @@ def submit_paper(request):
 
     if request.POST and paper_form.is_valid() and \
         paper_presenter_form.is_valid():
-        presenter = paper_presenter_form.save()
-        paper = paper_form.save(request.user, presenter)
-        paper.send_submission_email()
+        with mail.deferred_email(), transaction.atomic():
+            presenter = paper_presenter_form.save()
+            paper = paper_form.save(request.user, presenter)
+            paper.send_submission_email()
         kwargs = {'id': paper.id}
         url = reverse('django_conference_submission_success', kwargs=kwargs)
         return HttpResponseRedirect(url)
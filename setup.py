@@ -21,6 +21,8 @@ setup(name='django-conference',
     install_requires=[
         'django>=1.8,<1.9',
         'django-autocomplete-light>=3.0',
+        'requests>=2.0',
+        'stripe>=1.62.0',
         'setuptools',
     ],
     zip_safe=False,